@@ -12,6 +12,16 @@ class ErrorMessages:
     Forbidden = "The server understood the request but refuses to authorize it"
     
     FileAlreadyStored = "This file has already been stored."
+    ProbeBatchTooLarge = "Too many files were submitted in a single probe."
+    InvalidChunk = "The chunk offset or length is invalid for this upload session."
+    UploadSessionClosed = "This upload session is no longer accepting changes."
+    UploadSessionIncomplete = "Some chunks of this upload session are still missing."
+    UploadSessionExpired = "This upload session has expired, start a new one."
+    InvalidCursor = "The pagination cursor is invalid."
+    BulkBatchTooLarge = "Too many files were submitted in a single bulk upload."
+    BulkFileFailed = "This file could not be stored."
+    InvalidArchive = "The archive could not be read, only zip archives are supported."
+    ArchiveTooLarge = "The archive expands to more than the server accepts."
 
 class Strings:
     Success = "Success"
\ No newline at end of file
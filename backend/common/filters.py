@@ -1,10 +1,36 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+import math
+
+from common.constants import ErrorMessages
+from common.exceptions import BadRequestError
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db.models import Q
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.settings import api_settings
+
+
+def known_count(view, queryset):
+    """The total the view knows for ``queryset`` without a COUNT query (``get_known_count``), else None"""
+    known = getattr(view, "get_known_count", None)
+    return known(queryset) if known else None
 
 
 class BasePageNumberPagination(PageNumberPagination):
     page_size_query_param = "page_size"
     max_page_size = 100
 
+    def paginate_queryset(self, queryset, request, view=None):
+        self.known_count = known_count(view, queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def django_paginator_class(self, object_list, per_page):
+        paginator = DjangoPaginator(object_list, per_page)
+        if self.known_count is not None:
+            paginator.count = self.known_count
+        return paginator
+
     def get_paginated_response(self, data):
         return {
             "items": data,
@@ -15,3 +41,118 @@ class BasePageNumberPagination(PageNumberPagination):
             "has_next": self.page.has_next(),
             "has_previous": self.page.has_previous(),
         }
+
+
+class BaseCursorPagination(BasePagination):
+    """
+    Keyset pagination over ``ordering``, which must end with a unique field.
+    Each page is a single indexed range scan of ``page_size + 1`` rows, so it
+    costs the same at any depth. The response keeps the page-number envelope
+    and adds ``next_cursor``/``previous_cursor``.
+
+    ``?count=exact`` (default) runs a COUNT for ``total``/``total_pages``
+    unless the view's ``get_known_count`` has the total, ``?count=estimate``
+    asks the view's ``get_estimated_count`` instead and ``?count=none`` skips
+    it, returning null totals.
+    """
+
+    ordering = ("-created_at", "-id")
+    cursor_query_param = "cursor"
+    count_query_param = "count"
+    page_size_query_param = "page_size"
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            page_size = self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def encode_cursor(self, row, reverse):
+        # Rows may be model instances or values() dicts
+        get = row.get if isinstance(row, dict) else lambda name: getattr(row, name)
+        values = [str(get(field.lstrip("-"))) for field in self.ordering]
+        payload = json.dumps({"r": reverse, "v": values}).encode()
+        return base64.urlsafe_b64encode(payload).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            values, reverse = payload["v"], bool(payload["r"])
+            if len(values) != len(self.ordering):
+                raise ValueError
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise BadRequestError(ErrorMessages.InvalidCursor)
+        return values, reverse
+
+    def keyset_filter(self, values, reverse):
+        """Rows strictly after ``values`` in the direction of travel"""
+        condition = Q()
+        for index in reversed(range(len(self.ordering))):
+            field = self.ordering[index]
+            descending = field.startswith("-") != reverse
+            lookup = "lt" if descending else "gt"
+            name = field.lstrip("-")
+            step = Q(**{f"{name}__{lookup}": values[index]})
+            if index < len(self.ordering) - 1:
+                step |= Q(**{name: values[index]}) & condition
+            condition = step
+        # The redundant bound on the leading field lets the database range-scan its index
+        first = self.ordering[0]
+        lookup = "lte" if first.startswith("-") != reverse else "gte"
+        return Q(**{f"{first.lstrip('-')}__{lookup}": values[0]}) & condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.view = view
+        self.queryset = queryset
+        self.page_size = self.get_page_size(request)
+        values, reverse = self.decode_cursor(request)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [field[1:] if field.startswith("-") else f"-{field}" for field in ordering]
+        page = queryset.order_by(*ordering)
+        if values is not None:
+            page = page.filter(self.keyset_filter(values, reverse))
+
+        rows = list(page[: self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = values is not None if not reverse else has_more
+        self.next_cursor = self.encode_cursor(rows[-1], False) if rows and self.has_next else None
+        self.previous_cursor = self.encode_cursor(rows[0], True) if rows and self.has_previous else None
+        return rows
+
+    def get_total(self):
+        mode = self.request.query_params.get(self.count_query_param, "exact")
+        if mode == "none":
+            return None
+        if mode == "estimate":
+            estimate = getattr(self.view, "get_estimated_count", None)
+            return estimate(self.queryset) if estimate else None
+        total = known_count(self.view, self.queryset)
+        return total if total is not None else self.queryset.count()
+
+    def get_paginated_response(self, data):
+        total = self.get_total()
+        return {
+            "items": data,
+            "page": None,
+            "total": total,
+            "total_pages": math.ceil(total / self.page_size) if total is not None else None,
+            "page_size": self.page_size,
+            "has_next": self.has_next,
+            "has_previous": self.has_previous,
+            "next_cursor": self.next_cursor,
+            "previous_cursor": self.previous_cursor,
+        }
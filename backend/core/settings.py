@@ -42,12 +42,13 @@ INSTALLED_APPS = [
   "rest_framework",
   "corsheaders",
   "files",
-  "common"
+  "common",
+  "jobs",
 ]
 
 MIDDLEWARE = [
   "django.middleware.security.SecurityMiddleware",
-  "whitenoise.middleware.WhiteNoiseMiddleware",
+  "common.middleware.AsyncWhiteNoiseMiddleware",
   "django.contrib.sessions.middleware.SessionMiddleware",
   "corsheaders.middleware.CorsMiddleware",
   "django.middleware.common.CommonMiddleware",
@@ -83,8 +84,13 @@ WSGI_APPLICATION = "core.wsgi.application"
 
 DATABASES = {
   "default": {
-    "ENGINE": "django.db.backends.sqlite3",
+    "ENGINE": "common.sqlite3",
     "NAME": os.path.join(BASE_DIR, 'data', 'db.sqlite3'),
+    # Seconds a write waits for the one ahead of it before failing
+    'OPTIONS': {'timeout': float(os.environ.get('DB_TIMEOUT', 20))},
+    # On disk, the views write from worker threads that an in-memory database
+    # shared between connections would fail with "table is locked"
+    'TEST': {'NAME': os.path.join(BASE_DIR, 'data', 'test_db.sqlite3')},
   }
 }
 
@@ -131,6 +137,113 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Blobs are stored content-addressed under uploads/ab/cd/<sha256>. Use
+# 'files.chunking.ChunkedBlobStorage' to also deduplicate inside files with
+# content-defined chunking (saves space on versioned documents, costs CPU on upload)
+# or 'files.storage.CompressedBlobStorage' to compress text-like blobs at rest
+FILES_BLOB_STORAGE = os.environ.get('FILES_BLOB_STORAGE', 'files.storage.ContentAddressedStorage')
+
+# Compression at rest: 'zstd' (needs the zstandard package, gzip otherwise) or
+# 'gzip'; blobs whose sample does not shrink below this ratio are stored raw
+FILES_COMPRESSION_CODEC = os.environ.get('FILES_COMPRESSION_CODEC', 'zstd')
+FILES_COMPRESSION_MAX_RATIO = float(os.environ.get('FILES_COMPRESSION_MAX_RATIO', 0.9))
+
+# Filename search through the SQLite FTS5 trigram index, use
+# 'files.search.ContainsSearchBackend' for plain LIKE scans
+FILES_SEARCH_BACKEND = 'files.search.FTS5SearchBackend'
+
+# Orphaned files and blobs are only collected once unused for this many seconds
+FILES_GC_GRACE_PERIOD = int(os.environ.get('FILES_GC_GRACE_PERIOD', 3600))
+
+# Content hash of new files: 'sha256', 'blake2b' or 'blake3' (needs the blake3
+# package, blake2b otherwise). Files keep the algorithm they were hashed with.
+FILES_HASH_TYPE = os.environ.get('FILES_HASH_TYPE', 'sha256')
+
+# Uploads whose size and sampled fingerprint match no stored file are stored
+# right away and hashed by a background job, only a likely duplicate is hashed
+# during the upload. Off, every upload is hashed while it is parsed.
+FILES_DEFER_HASHING = os.environ.get('FILES_DEFER_HASHING', 'True') == 'True'
+
+# Without deferred hashing uploads are hashed while they are parsed, so
+# deduplication never re-reads them. Deferred, Django's own handlers are kept:
+# the hashing ones would have nothing to do.
+if not FILES_DEFER_HASHING:
+  FILE_UPLOAD_HANDLERS = [
+    "files.upload_handlers.HashingMemoryFileUploadHandler",
+    "files.upload_handlers.HashingTemporaryFileUploadHandler",
+  ]
+
+# Part files of resumable upload sessions, kept next to the media root so
+# finalizing a session is a rename rather than a copy
+FILE_UPLOAD_SESSION_ROOT = os.path.join(MEDIA_ROOT, 'sessions')
+
+# Upload sessions (python manage.py collect_upload_sessions): seconds without a
+# chunk before a session and its part file are removed, and seconds a session
+# may stay finalizing before it counts as left behind by a crashed request and
+# can be completed again
+FILE_UPLOAD_SESSION_TTL = int(os.environ.get('FILE_UPLOAD_SESSION_TTL', 24 * 3600))
+FILE_UPLOAD_FINALIZE_TIMEOUT = int(os.environ.get('FILE_UPLOAD_FINALIZE_TIMEOUT', 3600))
+
+# How downloads leave the server: 'files.downloads.StreamTransfer' (through the
+# worker), 'files.downloads.SendfileTransfer' (os.sendfile via the file wrapper
+# of a WSGI server only, requests served under ASGI like start.sh's are
+# streamed with the default),
+# or handed to the proxy with 'files.downloads.XAccelRedirectTransfer' (nginx,
+# internal location at FILES_X_ACCEL_REDIRECT_PREFIX, what docker-compose.yml
+# runs) or 'files.downloads.XSendfileTransfer' (Apache/lighttpd)
+FILES_DOWNLOAD_TRANSFER = os.environ.get('FILES_DOWNLOAD_TRANSFER', 'files.downloads.StreamTransfer')
+FILES_X_ACCEL_REDIRECT_PREFIX = os.environ.get('FILES_X_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+
+# Integrity scrubbing (python manage.py scrub_files): threads re-hashing blobs,
+# their shared read budget in bytes per second, and how long a verification
+# holds before the blob is due again
+FILES_SCRUB_WORKERS = int(os.environ.get('FILES_SCRUB_WORKERS', 2))
+FILES_SCRUB_MAX_RATE = int(os.environ.get('FILES_SCRUB_MAX_RATE', 50 * 1024 * 1024))
+FILES_SCRUB_MAX_AGE = int(os.environ.get('FILES_SCRUB_MAX_AGE', 30 * 24 * 3600))
+
+# Backups (python manage.py backup_vault / restore_vault): threads copying
+# blobs and, on restore, re-hashing them
+FILES_BACKUP_WORKERS = int(os.environ.get('FILES_BACKUP_WORKERS', 8))
+
+# Bulk uploads: files accepted in one request and threads hashing and
+# writing their blobs
+DATA_UPLOAD_MAX_NUMBER_FILES = 1000
+FILES_BULK_WORKERS = int(os.environ.get('FILES_BULK_WORKERS', min(8, (os.cpu_count() or 1) + 4)))
+# Bytes a member of an uploaded archive and all of its members together may
+# decompress to, a small archive can expand to far more than it weighs
+FILE_UPLOAD_MAX_SIZE = int(os.environ.get('FILE_UPLOAD_MAX_SIZE', 1024 * 1024 * 1024))
+FILES_ARCHIVE_MAX_SIZE = int(os.environ.get('FILES_ARCHIVE_MAX_SIZE', 4 * 1024 * 1024 * 1024))
+
+# Threads running the blocking work of the async upload, download and stats
+# views, every connection shares them however many are open
+FILES_IO_WORKERS = int(os.environ.get('FILES_IO_WORKERS', 32))
+
+# Cached list and stats responses, keyed by a catalog version the database
+# keeps and every change bumps, so each server process revalidates against it.
+# Local memory (LRU) keeps one cache per process; point FILES_CACHE_BACKEND at
+# e.g. 'django.core.cache.backends.filebased.FileBasedCache' and
+# FILES_CACHE_LOCATION at a shared directory to share one between processes
+CACHES = {
+  'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+  },
+  'files': {
+    'BACKEND': os.environ.get('FILES_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+    'LOCATION': os.environ.get('FILES_CACHE_LOCATION', 'files'),
+    'TIMEOUT': int(os.environ.get('FILES_CACHE_TIMEOUT', 300)),
+    'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('FILES_CACHE_MAX_ENTRIES', 1000))},
+  },
+}
+FILES_RESPONSE_CACHE = 'files'
+
+# Background jobs (python manage.py run_jobs): threads per worker process,
+# limits on how many jobs of a type run at once across all workers (overriding
+# the limits the job types declare, e.g. {'files.verify_blob': 4}) and how
+# long succeeded jobs are kept, in seconds
+JOBS_WORKER_CONCURRENCY = int(os.environ.get('JOBS_WORKER_CONCURRENCY', 4))
+JOBS_CONCURRENCY = {}
+JOBS_RETENTION = int(os.environ.get('JOBS_RETENTION', 7 * 24 * 3600))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
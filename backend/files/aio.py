@@ -0,0 +1,60 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+
+# Blocking work of the async views (request parsing, hashing, queries, blob
+# reads) runs here, a bounded pool shared by every connection
+io_executor = ThreadPoolExecutor(max_workers=settings.FILES_IO_WORKERS, thread_name_prefix="files-io")
+
+_exhausted = object()
+
+
+def _call(func, *args, **kwargs):
+    # Pool threads outlive requests, so they clean up database connections
+    # the way the request cycle does for Django's own threads
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run ``func`` on the I/O pool without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_executor, partial(_call, func, *args, **kwargs))
+
+
+async def iterate_blocking(iterator):
+    """Drive a blocking iterator from the pool, one item per hop"""
+    iterator = iter(iterator)
+    while (item := await run_blocking(next, iterator, _exhausted)) is not _exhausted:
+        yield item
+
+
+def _render(view, request, *args, **kwargs):
+    response = view(request, *args, **kwargs)
+    if callable(getattr(response, "render", None)):
+        response.render()
+    return response
+
+
+def offload(view):
+    """
+    Turn a sync view into an async one whose work runs on the I/O pool. Under
+    ASGI a streamed body is pulled from the pool block by block, so slow
+    clients hold a socket rather than a thread and never starve other requests.
+    """
+
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        response = await run_blocking(_render, view, request, *args, **kwargs)
+        if isinstance(request, ASGIRequest) and response.streaming and not response.is_async:
+            response.streaming_content = iterate_blocking(response.streaming_content)
+        return response
+
+    return async_view
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate, pre_migrate
 
 
 class FilesConfig(AppConfig):
   default_auto_field = "django.db.models.BigAutoField"
   name = "files"
+
+  def ready(self):
+    from files.search import drop_search_triggers, install_search_index
+
+    pre_migrate.connect(drop_search_triggers, sender=self)
+    post_migrate.connect(install_search_index, sender=self)
@@ -0,0 +1,278 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from files.cache import response_cache
+from files.chunking import chunk_path
+from files.models import Chunk, File
+from files.scrub import Scrubber
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+DATABASE_NAME = "db.sqlite3"
+BLOBS_DIR = "blobs"
+SNAPSHOTS_DIR = "snapshots"
+
+# Blobs handed to the copying threads at a time
+COPY_BATCH_SIZE = 1000
+
+
+class BackupError(Exception):
+    pass
+
+
+def file_digest(path, block_size=1024 * 1024):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as source:
+        while block := source.read(block_size):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def snapshot_database(path):
+    """
+    Write a consistent copy of the database to ``path`` with SQLite's online
+    backup: it copies every page under one read transaction, which writers
+    do not wait for in WAL mode. The copy is a single self-contained file.
+    """
+    connection.ensure_connection()
+    target = sqlite3.connect(path)
+    try:
+        connection.connection.backup(target)
+        target.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        target.close()
+
+
+def restore_database(path):
+    """Replace the content of the database with the snapshot at ``path``, under the database's own locks"""
+    connection.ensure_connection()
+    source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        source.backup(connection.connection)
+    finally:
+        source.close()
+
+
+def stored_names(database, previous=None):
+    """
+    Names of the blobs and chunks the snapshot ``database`` references,
+    relative to the storage root, leaving out those the snapshot
+    ``previous`` references already
+    """
+    db = sqlite3.connect(f"file:{database}?mode=ro", uri=True)
+    try:
+        files, chunks = File._meta.db_table, Chunk._meta.db_table
+        files_query = f"SELECT file FROM {files} WHERE file != ''"
+        chunks_query = f"SELECT hash_value FROM {chunks}"
+        if previous:
+            db.execute("ATTACH DATABASE ? AS previous", (f"file:{previous}?mode=ro",))
+            files_query += f" AND file NOT IN (SELECT file FROM previous.{files})"
+            chunks_query += f" WHERE hash_value NOT IN (SELECT hash_value FROM previous.{chunks})"
+        yield from (name for name, in db.execute(files_query))
+        yield from (chunk_path(hash_value) for hash_value, in db.execute(chunks_query))
+    finally:
+        db.close()
+
+
+def copy_blob(source_root, target_root, name):
+    """
+    Copy blob ``name`` between storage roots unless the target holds it
+    already (blobs never change under a name). Returns the bytes copied,
+    None when the source is missing.
+    """
+    source, target = os.path.join(source_root, name), os.path.join(target_root, name)
+    try:
+        size = os.stat(source).st_size
+    except FileNotFoundError:
+        return None
+    try:
+        if os.stat(target).st_size == size:
+            return 0
+    except FileNotFoundError:
+        pass
+
+    directory, basename = os.path.split(target)
+    os.makedirs(directory, exist_ok=True)
+    temp = os.path.join(directory, f".{basename}.{uuid.uuid4().hex}.tmp")
+    try:
+        shutil.copyfile(source, temp)
+        with open(temp, "rb") as copy:
+            os.fsync(copy.fileno())
+        os.replace(temp, target)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+    return size
+
+
+class BlobCopy:
+    """Copies blobs between storage roots on ``workers`` threads and counts what it did"""
+
+    def __init__(self, source_root, target_root, workers, log=print):
+        self.source_root = source_root
+        self.target_root = target_root
+        self.workers = workers
+        self.log = log
+        self.checked = 0
+        self.copied = 0
+        self.bytes = 0
+        self.missing = []
+
+    def copy(self, name):
+        return copy_blob(self.source_root, self.target_root, name)
+
+    def run(self, names):
+        batch = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="blob-copy") as pool:
+            for name in names:
+                batch.append(name)
+                if len(batch) == COPY_BATCH_SIZE:
+                    self.collect(batch, pool.map(self.copy, batch))
+                    batch = []
+            self.collect(batch, pool.map(self.copy, batch))
+        return self
+
+    def collect(self, names, results):
+        for name, copied in zip(names, results):
+            self.checked += 1
+            if copied is None:
+                self.missing.append(name)
+                self.log(f"Blob missing: {name}")
+            elif copied:
+                self.copied += 1
+                self.bytes += copied
+        if names and self.checked % (COPY_BATCH_SIZE * 10) == 0:
+            self.log(f"{self.checked} blobs checked, {self.copied} copied")
+
+
+class VaultBackup:
+    """
+    Backups of the database and blobs in ``destination``::
+
+        blobs/                 every blob and chunk backed up, named as in storage
+        snapshots/<time>/      db.sqlite3 and manifest.json, one per backup
+
+    Blobs are shared by all snapshots, so a backup only copies the ones its
+    snapshot references and the previous one did not. The manifest is
+    written last: a snapshot without one never completed and is ignored.
+    """
+
+    def __init__(self, destination, workers=None, log=print):
+        self.destination = os.path.abspath(destination)
+        self.workers = workers or settings.FILES_BACKUP_WORKERS
+        self.log = log
+        self.storage = File._meta.get_field("file").storage
+
+    @property
+    def snapshots_root(self):
+        return os.path.join(self.destination, SNAPSHOTS_DIR)
+
+    def snapshots(self):
+        """Names of the completed snapshots, oldest first"""
+        try:
+            names = sorted(os.listdir(self.snapshots_root))
+        except FileNotFoundError:
+            return []
+        return [name for name in names if os.path.exists(os.path.join(self.snapshots_root, name, MANIFEST_NAME))]
+
+    def manifest(self, snapshot):
+        with open(os.path.join(self.snapshots_root, snapshot, MANIFEST_NAME), encoding="utf-8") as manifest:
+            return json.load(manifest)
+
+    def run(self, full=False):
+        """Take a snapshot and back up the blobs it references, ``full`` checks every blob and not only new ones"""
+        completed = self.snapshots()
+        for name in os.listdir(self.snapshots_root) if os.path.isdir(self.snapshots_root) else ():
+            if name not in completed:
+                shutil.rmtree(os.path.join(self.snapshots_root, name))
+
+        started = timezone.now()
+        snapshot = started.strftime("%Y%m%dT%H%M%S%fZ")
+        directory = os.path.join(self.snapshots_root, snapshot)
+        os.makedirs(directory)
+        database = os.path.join(directory, DATABASE_NAME)
+        snapshot_database(database)
+
+        previous = completed[-1] if completed and not full else None
+        previous_database = os.path.join(self.snapshots_root, previous, DATABASE_NAME) if previous else None
+        blobs = BlobCopy(self.storage.location, os.path.join(self.destination, BLOBS_DIR), self.workers, self.log)
+        blobs.run(stored_names(database, previous_database))
+
+        manifest = {
+            "version": FORMAT_VERSION,
+            "created_at": started.isoformat(),
+            "completed_at": timezone.now().isoformat(),
+            "previous": previous,
+            "storage": settings.FILES_BLOB_STORAGE,
+            "database": {
+                "name": DATABASE_NAME,
+                "size": os.path.getsize(database),
+                "sha256": file_digest(database),
+            },
+            "blobs": {
+                "checked": blobs.checked,
+                "copied": blobs.copied,
+                "copied_bytes": blobs.bytes,
+                "missing": blobs.missing,
+            },
+        }
+        temp = os.path.join(directory, f".{MANIFEST_NAME}.tmp")
+        with open(temp, "w", encoding="utf-8") as out:
+            json.dump(manifest, out, indent=2)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(temp, os.path.join(directory, MANIFEST_NAME))
+        return snapshot, manifest
+
+
+class VaultRestore:
+    """
+    Restores a snapshot of a ``VaultBackup``: the database is checked
+    against the manifest and copied in, the blobs it references are copied
+    to storage where missing, and every file is then re-hashed on
+    ``workers`` threads by the scrubber, which records the outcome.
+    """
+
+    def __init__(self, source, snapshot=None, workers=None, log=print):
+        self.backup = VaultBackup(source, workers, log)
+        self.snapshot = snapshot
+        self.workers = self.backup.workers
+        self.log = log
+
+    def run(self, verify=True):
+        snapshots = self.backup.snapshots()
+        if not snapshots:
+            raise BackupError(f"No completed snapshot in {self.backup.destination}")
+        snapshot = self.snapshot or snapshots[-1]
+        if snapshot not in snapshots:
+            raise BackupError(f"No completed snapshot {snapshot} in {self.backup.destination}")
+        manifest = self.backup.manifest(snapshot)
+        if manifest["version"] != FORMAT_VERSION:
+            raise BackupError(f"Snapshot {snapshot} has format version {manifest['version']}, not {FORMAT_VERSION}")
+        if manifest["storage"] != settings.FILES_BLOB_STORAGE:
+            self.log(f"Snapshot {snapshot} was taken with {manifest['storage']}, blobs are restored as they were stored")
+
+        database = os.path.join(self.backup.snapshots_root, snapshot, manifest["database"]["name"])
+        if file_digest(database) != manifest["database"]["sha256"]:
+            raise BackupError(f"The database of snapshot {snapshot} does not match its manifest")
+        restore_database(database)
+        response_cache.bump()
+
+        blobs = BlobCopy(
+            os.path.join(self.backup.destination, BLOBS_DIR), self.backup.storage.location, self.workers, self.log
+        )
+        blobs.run(stored_names(database))
+
+        scrubber = Scrubber(workers=self.workers, max_age=0, log=self.log)
+        if verify:
+            scrubber.run()
+        return snapshot, blobs, scrubber
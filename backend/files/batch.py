@@ -0,0 +1,58 @@
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Sum
+from files.models import Entry, File, StorageStats
+
+
+class BatchDelete:
+    """
+    Deletes every entry of a queryset in keyset-ordered batches, each batch
+    in its own short transaction so a large cleanup never holds the database
+    for long. Files left without entries are then collected by ``files.gc``.
+    """
+
+    def __init__(self, queryset, batch_size=1000, dry_run=False):
+        # Search ranking and ordering only slow the id scan down
+        self.queryset = queryset.order_by()
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+
+    def freed_bytes(self):
+        """Size of the files whose every entry is part of the deletion"""
+        matched = self.queryset.values("pk")
+        files = File.objects.filter(
+            Exists(matched.filter(file=OuterRef("pk"))),
+            ~Exists(Entry.objects.filter(file=OuterRef("pk")).exclude(pk__in=matched)),
+        )
+        return files.aggregate(total=Sum("size"))["total"] or 0
+
+    def summary(self):
+        totals = self.queryset.aggregate(entries=Count("pk"), bytes=Sum("size"))
+        return {"entries": totals["entries"], "bytes": totals["bytes"] or 0}
+
+    def delete(self):
+        """Delete the matched entries, returns (entries, bytes) deleted"""
+        deleted_entries = deleted_bytes = 0
+        last_pk = None
+        while True:
+            queryset = self.queryset.order_by("pk")
+            if last_pk is not None:
+                queryset = queryset.filter(pk__gt=last_pk)
+            with transaction.atomic():
+                batch = list(queryset.values_list("pk", "size")[: self.batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1][0]
+                Entry.objects.filter(pk__in=[pk for pk, _ in batch]).delete()
+                size = sum(size for _, size in batch)
+                StorageStats.record(total_entries=-len(batch), would_be_space=-size)
+            deleted_entries += len(batch)
+            deleted_bytes += size
+        return deleted_entries, deleted_bytes
+
+    def run(self):
+        result = {"dry_run": self.dry_run, "freed_bytes": self.freed_bytes()}
+        if self.dry_run:
+            result.update(self.summary())
+        else:
+            result["entries"], result["bytes"] = self.delete()
+        return result
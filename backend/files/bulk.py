@@ -0,0 +1,231 @@
+import mimetypes
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from common.constants import ErrorMessages
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import transaction
+from django.utils import timezone
+
+from files.dedup import find_stored, write_blob
+from files.hashing import HASH_TYPE, fingerprint, hash_file, new_hasher
+from files.models import Entry, File, StorageStats
+from jobs.queue import enqueue_many
+
+# Bytes copied at a time when extracting archive members
+COPY_BLOCK_SIZE = 1024 * 1024
+
+
+class ArchiveTooLarge(Exception):
+    pass
+
+
+class BulkItem:
+    """One file of a bulk upload and what became of it"""
+
+    CREATED = "created"
+    DEDUPLICATED = "deduplicated"
+    FAILED = "failed"
+
+    def __init__(self, upload, name=None):
+        self.upload = upload
+        self.name = name or upload.name
+        self.hash_value = None
+        self.fingerprint = ""
+        self.blob_name = None
+        self.entry = None
+        self.status = None
+        self.error = None
+
+
+def extract_archive(archive, limit):
+    """
+    Return the regular files of a zip archive as ``(upload, path)`` pairs,
+    each member is copied to a temporary file and hashed on the way so it is
+    decompressed once. Returns None for more than ``limit`` members, raises
+    ``ArchiveTooLarge`` for a member bigger than ``FILE_UPLOAD_MAX_SIZE`` or
+    members adding up to more than ``FILES_ARCHIVE_MAX_SIZE``, whether their
+    headers say so or their content turns out to, and ``zipfile.BadZipFile``
+    for anything that is not a zip archive.
+    """
+    with zipfile.ZipFile(archive) as zf:
+        members = [info for info in zf.infolist() if not info.is_dir()]
+        if len(members) > limit:
+            return None
+        if any(info.file_size > settings.FILE_UPLOAD_MAX_SIZE for info in members):
+            raise ArchiveTooLarge()
+        if sum(info.file_size for info in members) > settings.FILES_ARCHIVE_MAX_SIZE:
+            raise ArchiveTooLarge()
+
+        uploads = []
+        budget = settings.FILES_ARCHIVE_MAX_SIZE
+        try:
+            for info in members:
+                filename = os.path.basename(info.filename)
+                content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+                upload = TemporaryUploadedFile(filename, content_type, info.file_size, None)
+                uploads.append((upload, info.filename))
+                hasher = new_hasher()
+                size = 0
+                with zf.open(info) as member:
+                    while block := member.read(COPY_BLOCK_SIZE):
+                        # Counted as written, the sizes in the headers are the archive's word
+                        size += len(block)
+                        budget -= len(block)
+                        if size > settings.FILE_UPLOAD_MAX_SIZE or budget < 0:
+                            raise ArchiveTooLarge()
+                        hasher.update(block)
+                        upload.write(block)
+                upload.flush()
+                upload.seek(0)
+                upload.hash_type = HASH_TYPE
+                upload.hash_value = hasher.hexdigest()
+        except BaseException:
+            for upload, _ in uploads:
+                upload.close()
+            raise
+        return uploads
+
+
+class BulkIngest:
+    """
+    Store many uploads at once: files are hashed (and their blobs written) on
+    a thread pool, dedup hits on the current hash are resolved by one query
+    for the whole batch, the other items are matched like single uploads
+    (``files.dedup.find_stored``) and the new rows are inserted with
+    ``bulk_create`` in a single transaction.
+    """
+
+    # Enqueue a verify_blob job for every new file
+    verify = True
+
+    def __init__(self, workers=None):
+        self.workers = workers or settings.FILES_BULK_WORKERS
+        self.storage = File._meta.get_field("file").storage
+
+    def hash_item(self, item):
+        item.hash_value = hash_file(item.upload)
+        item.fingerprint = fingerprint(item.upload, item.upload.size)
+        return item
+
+    def write_blob(self, item):
+        # Content-addressed blobs make concurrent writes of the same hash
+        # harmless, and concurrent uploads of it in this process share one
+        item.blob_name = write_blob(self.storage, item.hash_value, item.upload)
+        return item
+
+    def attempt(self, func, item):
+        """Apply ``func`` to the item, a failure only fails this item"""
+        try:
+            func(item)
+        except Exception:
+            item.status = BulkItem.FAILED
+            item.error = ErrorMessages.BulkFileFailed
+
+    def run(self, pool, func, items):
+        pending = [item for item in items if item.status is None]
+        list(pool.map(lambda item: self.attempt(func, item), pending))
+
+    def claim_stored(self, hashes):
+        """Claim the already stored files of ``hashes`` so the garbage collector keeps them"""
+        candidates = File.objects.filter(hash_value__in=hashes, hash_type=HASH_TYPE)
+        candidates.update(referenced_at=timezone.now())
+        return candidates.in_bulk(field_name="hash_value")
+
+    def find_stored(self, items, stored):
+        """
+        Match the items ``claim_stored`` did not the way single uploads are
+        matched: files hashed with another algorithm, or stored with deferred
+        hashing and not hashed yet, hold their content too
+        """
+        for item in items:
+            if item.status is None and item.hash_value not in stored:
+                existing = find_stored(item.upload, item.upload.size, item.fingerprint, {HASH_TYPE: item.hash_value})
+                if existing:
+                    stored[item.hash_value] = existing
+
+    def ingest(self, items):
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            self.run(pool, self.hash_item, items)
+
+            hashes = {item.hash_value for item in items if item.status is None}
+            stored = self.claim_stored(hashes)
+            self.find_stored(items, stored)
+
+            # First occurrence of every new hash writes its blob, the chunked
+            # storage writes to the database as well so it stays sequential
+            new = {}
+            for item in items:
+                if item.status is None and item.hash_value not in stored:
+                    new.setdefault(item.hash_value, item)
+            if self.storage.raw_blobs:
+                self.run(pool, self.write_blob, new.values())
+            else:
+                for item in new.values():
+                    self.attempt(self.write_blob, item)
+
+        files = [
+            File(
+                file=item.blob_name,
+                original_filename=item.upload.name,
+                file_type=item.upload.content_type or "application/octet-stream",
+                size=item.upload.size,
+                hash_value=item.hash_value,
+                hash_type=HASH_TYPE,
+                fingerprint=item.fingerprint,
+            )
+            for item in new.values()
+            if item.status is None
+        ]
+
+        with transaction.atomic():
+            # Rows a concurrent upload inserted first are skipped and reused
+            File.objects.bulk_create(files, ignore_conflicts=True)
+            if files:
+                inserted = set(
+                    File.objects.filter(pk__in=[file.pk for file in files]).values_list("pk", flat=True)
+                )
+                stored.update(self.claim_stored({file.hash_value for file in files}))
+            else:
+                inserted = set()
+            created = {file.hash_value for file in files if file.pk in inserted}
+
+            entries = []
+            for item in items:
+                if item.status is not None:
+                    continue
+                file = stored.get(item.hash_value)
+                if file is None:
+                    item.status = BulkItem.FAILED
+                    item.error = ErrorMessages.BulkFileFailed
+                    continue
+                item.entry = Entry(file=file, name=item.name)
+                if item.hash_value in created:
+                    item.status = BulkItem.CREATED
+                    created.discard(item.hash_value)
+                else:
+                    item.status = BulkItem.DEDUPLICATED
+                entries.append(item.entry)
+
+            Entry.objects.bulk_create(entries)
+            new_files = [file for file in files if file.pk in inserted]
+            StorageStats.record(
+                total_files=len(new_files),
+                actual_space=sum(file.size for file in new_files),
+                stored_space=sum(file.stored_size for file in new_files),
+                total_entries=len(entries),
+                would_be_space=sum(entry.file.size for entry in entries),
+            )
+            if self.verify:
+                enqueue_many("files.verify_blob", [{"file_id": str(file.pk)} for file in new_files])
+        return items
+
+
+def close_uploads(items):
+    for item in items:
+        try:
+            item.upload.close()
+        except OSError:
+            pass
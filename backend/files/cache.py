@@ -0,0 +1,85 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import patch_cache_control
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class ResponseCache:
+    """
+    Caches read responses under a catalog version that every committed change
+    to entries, files or stats bumps, so nothing is ever invalidated by key:
+    a bump makes all older responses unreachable and the cache's LRU evicts
+    them. The version doubles as the ETag, a client that already holds the
+    current version gets a 304 for a single primary key read.
+
+    The version is a column of the ``StorageStats`` row, moved on in the
+    transaction of the change, so the server, the job workers and management
+    commands all see it whatever the cache backend is.
+    """
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def version(self):
+        from files.models import StorageStats
+
+        return StorageStats.current_version()
+
+    def bump(self):
+        from files.models import StorageStats
+
+        StorageStats.bump()
+
+    def key(self, request, version):
+        # Query parameters are normalized so their order and empty values
+        # do not split the cache
+        params = sorted(
+            (key, value) for key, values in request.query_params.lists() for value in values if value != ""
+        )
+        identity = repr((request.build_absolute_uri(request.path), params))
+        return f"files:response:{version}:{hashlib.sha256(identity.encode()).hexdigest()}"
+
+    def etag(self, version):
+        return f'W/"{version}"'
+
+    def finalize(self, response, etag):
+        response["ETag"] = etag
+        # Always revalidate, which costs the client a 304 at most
+        patch_cache_control(response, no_cache=True)
+        return response
+
+    def serve(self, request, compute):
+        version = self.version()
+        etag = self.etag(version)
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match and etag in parse_etags(if_none_match):
+            return self.finalize(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+
+        key = self.key(request, version)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return self.finalize(Response(cached), etag)
+
+        response = compute()
+        if response.status_code == status.HTTP_200_OK:
+            self.cache.set(key, response.data)
+        return self.finalize(response, etag)
+
+
+response_cache = SimpleLazyObject(lambda: ResponseCache(settings.FILES_RESPONSE_CACHE))
+
+
+def cache_response(method):
+    """Serve a read-only DRF view method through ``response_cache``"""
+
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        return response_cache.serve(request, lambda: method(self, request, *args, **kwargs))
+
+    return wrapper
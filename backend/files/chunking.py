@@ -0,0 +1,347 @@
+import hashlib
+import io
+import json
+import os
+import random
+from bisect import bisect_right
+from collections import Counter
+
+from django.core.files import File as DjangoFile
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from files.storage import ContentAddressedStorage
+
+try:
+    import numpy
+except ImportError:  # optional, cut points are then found byte by byte (about 6MB/s)
+    numpy = None
+
+CHUNK_ROOT = "chunks"
+
+# FastCDC parameters, chunks average 64KB and never exceed 256KB
+MIN_CHUNK_SIZE = 16 * 1024
+AVG_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 256 * 1024
+READ_SIZE = 4 * MAX_CHUNK_SIZE
+# Chunks whose references are taken and files written together, bounds memory use
+CHUNK_BATCH_SIZE = 64
+
+# Gear table of the rolling hash, seeded so cut points never change between runs
+_gear_random = random.Random(0xFA57CDC)
+GEAR = tuple(_gear_random.getrandbits(64) for _ in range(256))
+MASK_64 = (1 << 64) - 1
+_AVG_BITS = AVG_CHUNK_SIZE.bit_length() - 1
+# Normalized chunking: a stricter mask below the average size and a looser
+# one above it pulls chunk sizes towards the average
+MASK_S = ((1 << (_AVG_BITS + 2)) - 1) << (64 - _AVG_BITS - 2)
+MASK_L = ((1 << (_AVG_BITS - 2)) - 1) << (64 - _AVG_BITS + 2)
+# Bits of the fingerprint, every byte is shifted out after this many more
+GEAR_WINDOW = 64
+# Bytes fingerprinted at once by the vectorized path
+FINGERPRINT_SEGMENT = 32 * 1024
+if numpy is not None:
+    GEAR_ARRAY = numpy.array(GEAR, dtype=numpy.uint64)
+
+
+def chunk_path(hash_value):
+    return os.path.join(CHUNK_ROOT, hash_value[:2], hash_value[2:4], hash_value)
+
+
+def _fingerprints(buffer, start=0):
+    """
+    The gear fingerprint after every byte of ``buffer`` from ``start`` on, as
+    a numpy array. A fingerprint only holds the last ``GEAR_WINDOW`` bytes:
+    it is the sum of their gear values shifted by their distance, summed for
+    all positions at once over windows doubling in width, a segment small
+    enough to stay in the CPU cache at a time.
+    """
+    data = numpy.frombuffer(buffer, dtype=numpy.uint8)
+    fingerprints = numpy.empty(len(data) - start, dtype=numpy.uint64)
+    window = numpy.empty(FINGERPRINT_SEGMENT + GEAR_WINDOW - 1, dtype=numpy.uint64)
+    shifted = numpy.empty_like(window)
+    for segment in range(start, len(data), FINGERPRINT_SEGMENT):
+        # Led by the bytes still held by the fingerprint of its first position
+        low, high = max(segment - GEAR_WINDOW + 1, 0), min(segment + FINGERPRINT_SEGMENT, len(data))
+        size = high - low
+        numpy.take(GEAR_ARRAY, data[low:high], out=window[:size])
+        width = 1
+        while width < min(GEAR_WINDOW, size):
+            numpy.left_shift(window[: size - width], numpy.uint64(width), out=shifted[width:size])
+            window[width:size] += shifted[width:size]
+            width *= 2
+        fingerprints[segment - start : high - start] = window[segment - low : size]
+    return fingerprints
+
+
+def _cut_point(buffer, start, end, fingerprints=None):
+    """
+    Length of the next chunk in ``buffer[start:end]``. With the buffer's
+    ``_fingerprints`` only the bytes that start the rolling hash over are
+    hashed one by one, the cut is then searched for in the array.
+    """
+    length = end - start
+    if length <= MIN_CHUNK_SIZE:
+        return length
+    normal = start + min(AVG_CHUNK_SIZE, length)
+    limit = start + min(MAX_CHUNK_SIZE, length)
+
+    gear = GEAR
+    fingerprint = 0
+    position = start + MIN_CHUNK_SIZE
+    # Hashing starts over at the minimum size, the fingerprint covers a
+    # whole window (and equals the precomputed one) from the 64th byte on
+    rolling = limit if fingerprints is None else min(position + GEAR_WINDOW - 1, limit)
+    while position < min(normal, rolling):
+        fingerprint = ((fingerprint << 1) + gear[buffer[position]]) & MASK_64
+        position += 1
+        if not fingerprint & MASK_S:
+            return position - start
+    while position < rolling:
+        fingerprint = ((fingerprint << 1) + gear[buffer[position]]) & MASK_64
+        position += 1
+        if not fingerprint & MASK_L:
+            return position - start
+
+    if position < limit:
+        strict = max(normal - position, 0)
+        window = fingerprints[position:limit]
+        for offset, part, mask in ((0, window[:strict], MASK_S), (strict, window[strict:], MASK_L)):
+            cuts = numpy.flatnonzero((part & numpy.uint64(mask)) == 0)
+            if cuts.size:
+                return position + offset + int(cuts[0]) + 1 - start
+    return limit - start
+
+
+def iter_chunks(blocks):
+    """Split an iterable of byte blocks into content-defined chunks"""
+    blocks = iter(blocks)
+    buffer = b""
+    fingerprints = None
+    eof = False
+    while True:
+        # Read ahead further when fingerprints are computed for whole buffers
+        fill = READ_SIZE if numpy is not None else MAX_CHUNK_SIZE
+        while not eof and len(buffer) < fill:
+            data = next(blocks, b"")
+            if not data:
+                eof = True
+            buffer += data
+        if not buffer:
+            return
+
+        if numpy is not None:
+            # Those of the bytes carried over from the last round are known
+            known = len(fingerprints) if fingerprints is not None else 0
+            fresh = _fingerprints(buffer, known)
+            fingerprints = numpy.concatenate((fingerprints, fresh)) if known else fresh
+        start = 0
+        # Only cut while a full window is buffered, unless the stream has ended
+        while len(buffer) - start >= MAX_CHUNK_SIZE or (eof and start < len(buffer)):
+            length = _cut_point(buffer, start, len(buffer), fingerprints)
+            yield buffer[start:start + length]
+            start += length
+        buffer = buffer[start:]
+        if fingerprints is not None:
+            fingerprints = fingerprints[start:]
+
+
+class ChunkReader(io.RawIOBase):
+    """Seekable stream that reassembles a file from its chunks"""
+
+    def __init__(self, storage, chunks):
+        self.storage = storage
+        self.chunks = chunks
+        self.offsets = []
+        position = 0
+        for _, size in chunks:
+            self.offsets.append(position)
+            position += size
+        self.size = position
+        self.position = 0
+        self._current = None
+        self._current_index = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size or not len(buffer):
+            return 0
+        index = bisect_right(self.offsets, self.position) - 1
+        if index != self._current_index:
+            self._close_current()
+            self._current = open(self.storage.path(chunk_path(self.chunks[index][0])), "rb")
+            self._current_index = index
+        self._current.seek(self.position - self.offsets[index])
+        count = self._current.readinto(memoryview(buffer)[: self.chunks[index][1]])
+        self.position += count
+        return count
+
+    def _close_current(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+            self._current_index = None
+
+    def close(self):
+        self._close_current()
+        super().close()
+
+
+class ChunkedBlobStorage(ContentAddressedStorage):
+    """
+    Optional storage engine with sub-file deduplication. Content is split with
+    a FastCDC-style rolling hash, every unique chunk is kept once under
+    ``chunks/ab/cd/<sha256>`` with a reference count, and the blob itself is a
+    small manifest listing its chunks. Reading a blob streams the chunks back
+    in order, so two versions of a large file share everything but the chunks
+    that actually changed.
+    """
+
+    raw_blobs = False
+    links_imports = False
+
+    def import_file(self, name, path, mode="copy"):
+        # A blob is a manifest of chunks, there is nothing to link
+        return self.save_path(name, path)
+
+    def _read_manifest(self, name):
+        with super()._open(name, "rb") as manifest:
+            return json.load(manifest)
+
+    def _release_chunks(self, manifest):
+        from files.models import Chunk, StorageStats
+
+        sizes = dict(manifest["chunks"])
+        references = Counter(hash_value for hash_value, _ in manifest["chunks"])
+        with transaction.atomic():
+            for hash_value, count in references.items():
+                Chunk.objects.filter(hash_value=hash_value).update(ref_count=F("ref_count") - count)
+            unreferenced = list(
+                Chunk.objects.filter(hash_value__in=references, ref_count=0).values_list("hash_value", flat=True)
+            )
+            Chunk.objects.filter(hash_value__in=unreferenced, ref_count=0).delete()
+            StorageStats.record(
+                total_chunks=-len(unreferenced),
+                chunk_stored_space=-sum(sizes[hash_value] for hash_value in unreferenced),
+                chunk_referenced_space=-sum(sizes[hash_value] * count for hash_value, count in references.items()),
+            )
+
+        for hash_value in unreferenced:
+            self.delete_chunk_if_unreferenced(hash_value)
+
+    def delete_chunk_if_unreferenced(self, hash_value, grace=0):
+        from files.models import Chunk
+
+        return super().delete_if_unreferenced(
+            chunk_path(hash_value),
+            lambda: Chunk.objects.filter(hash_value=hash_value).exists(),
+            grace,
+            os.remove,
+        )
+
+    def _store_chunks(self, batch):
+        from files.models import Chunk, StorageStats
+
+        chunks = dict(batch)
+        references = Counter(hash_value for hash_value, _ in batch)
+        by_count = {}
+        for hash_value, count in references.items():
+            by_count.setdefault(count, []).append(hash_value)
+
+        # Take the references before looking at the chunk files, see delete()
+        with transaction.atomic():
+            known = set(Chunk.objects.filter(hash_value__in=chunks).values_list("hash_value", flat=True))
+            new = [Chunk(hash_value=hash_value, size=len(data)) for hash_value, data in chunks.items() if hash_value not in known]
+            Chunk.objects.bulk_create(new, ignore_conflicts=True)
+            for count, hashes in by_count.items():
+                Chunk.objects.filter(hash_value__in=hashes).update(ref_count=F("ref_count") + count)
+            StorageStats.record(
+                total_chunks=len(new),
+                chunk_stored_space=sum(chunk.size for chunk in new),
+                chunk_referenced_space=sum(len(chunks[hash_value]) * count for hash_value, count in references.items()),
+            )
+
+        for hash_value, data in chunks.items():
+            super()._save(chunk_path(hash_value), ContentFile(data))
+
+    def _save(self, name, content):
+        if self.touch(name):
+            return name
+
+        chunks = []
+        batch = []
+        for data in iter_chunks(content.chunks(READ_SIZE)):
+            hash_value = hashlib.sha256(data).hexdigest()
+            chunks.append([hash_value, len(data)])
+            batch.append((hash_value, data))
+            if len(batch) >= CHUNK_BATCH_SIZE:
+                self._store_chunks(batch)
+                batch = []
+        if batch:
+            self._store_chunks(batch)
+
+        manifest = {"size": sum(size for _, size in chunks), "chunks": chunks}
+        # Published without replacing: when a concurrent writer of the same
+        # blob got there first, its manifest already holds the references and
+        # the ones just taken are given back
+        temp_name = FileSystemStorage._save(
+            self, self._private_name(name, "tmp"), ContentFile(json.dumps(manifest).encode())
+        )
+        try:
+            os.link(self.path(temp_name), self.path(name))
+        except FileExistsError:
+            self._release_chunks(manifest)
+        finally:
+            os.remove(self.path(temp_name))
+        return name
+
+    def _open(self, name, mode="rb"):
+        manifest = self._read_manifest(name)
+        return DjangoFile(io.BufferedReader(ChunkReader(self, manifest["chunks"])), name=name)
+
+    def size(self, name):
+        return self._read_manifest(name)["size"]
+
+    def delete(self, name):
+        try:
+            manifest = self._read_manifest(name)
+            linked = os.stat(self.path(name)).st_nlink > 1
+        except FileNotFoundError:
+            return
+        super().delete(name)
+        if not linked:
+            self._release_chunks(manifest)
+
+    def delete_if_unreferenced(self, name, is_referenced, grace=0, discard=None):
+        return super().delete_if_unreferenced(name, is_referenced, grace, discard or self._discard_manifest)
+
+    def _discard_manifest(self, path):
+        # A collected manifest gives its chunk references back, unless it is
+        # still linked under another name (see link()) which keeps them
+        try:
+            with open(path, "rb") as manifest:
+                manifest = json.load(manifest)
+        except ValueError:
+            manifest = None
+        if os.stat(path).st_nlink > 1:
+            manifest = None
+        os.remove(path)
+        if manifest:
+            self._release_chunks(manifest)
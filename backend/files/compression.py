@@ -0,0 +1,90 @@
+import gzip
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # optional, gzip is used without it
+    zstandard = None
+
+# Leading bytes of formats that are compressed already
+COMPRESSED_SIGNATURES = (
+    b"\x1f\x8b",  # gzip
+    b"PK\x03\x04",  # zip, docx, xlsx, jar...
+    b"\x28\xb5\x2f\xfd",  # zstd
+    b"BZh",  # bzip2
+    b"\xfd7zXZ\x00",  # xz
+    b"7z\xbc\xaf\x27\x1c",  # 7z
+    b"Rar!",  # rar
+    b"\x89PNG",
+    b"\xff\xd8\xff",  # jpeg
+    b"GIF8",
+    b"OggS",
+    b"fLaC",
+    b"ID3",  # mp3
+)
+
+
+class GzipCodec:
+    name = "gzip"
+    suffix = ".gz"
+    # Token of the codec in Accept-Encoding / Content-Encoding
+    encoding = "gzip"
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def writer(self, fileobj):
+        return gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=self.level, mtime=0)
+
+    def reader(self, fileobj):
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+
+
+class ZstdCodec:
+    name = "zstd"
+    suffix = ".zst"
+    encoding = "zstd"
+
+    def __init__(self, level=3):
+        self.level = level
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def writer(self, fileobj):
+        return zstandard.ZstdCompressor(level=self.level).stream_writer(fileobj, closefd=False)
+
+    def reader(self, fileobj):
+        # Seeks forward by decompressing, enough for ascending byte ranges
+        return zstandard.ZstdDecompressor().stream_reader(fileobj, read_size=256 * 1024, closefd=True)
+
+
+CODECS = {codec.name: codec for codec in (ZstdCodec, GzipCodec)}
+
+# Raised when reading a damaged compressed blob
+DECODE_ERRORS = (OSError, EOFError, zlib.error) + ((zstandard.ZstdError,) if zstandard else ())
+
+
+def get_codec(name):
+    """The codec called ``name``, zstd falls back to gzip when zstandard is not installed"""
+    if name == ZstdCodec.name and zstandard is None:
+        name = GzipCodec.name
+    return CODECS[name]()
+
+
+def codec_for_name(blob_name):
+    """The codec whose suffix the storage appended to a blob name it generated, None for raw blobs"""
+    for codec in CODECS.values():
+        if blob_name.endswith(codec.suffix):
+            return codec()
+    return None
+
+
+def is_worth_compressing(sample, codec, max_ratio):
+    """Sniff the first bytes and trial-compress them, False for content that would barely shrink"""
+    if sample.startswith(COMPRESSED_SIGNATURES) or sample[8:12] in (b"WEBP", b"AVI ") or sample[4:8] == b"ftyp":
+        return False
+    return len(codec.compress(sample)) <= len(sample) * max_ratio
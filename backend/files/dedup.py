@@ -0,0 +1,250 @@
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from files.hashing import ALGORITHMS, HASH_TYPE, fingerprint, hash_file, new_hasher
+from files.models import Entry, File, StorageStats, file_upload_path
+from files.scrub import read_blob
+from files.storage import blob_path
+from jobs.queue import enqueue
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.ok = False
+        self.result = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: the first caller runs the
+    function and callers arriving while it runs wait for it and share its
+    result. A failure is not shared, the waiting callers then try themselves.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, func):
+        """``(result, shared)``, ``shared`` is True when another caller did the work"""
+        while True:
+            with self.lock:
+                call = self.calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self.calls[key] = _Call()
+            if leader:
+                break
+            call.done.wait()
+            if call.ok:
+                return call.result, True
+
+        try:
+            call.result = func()
+            call.ok = True
+            return call.result, False
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+
+# Blob writes in flight in this process, by content hash. Identical uploads
+# arriving together wait for the first one's blob instead of each writing
+# (and flushing) their own copy.
+blob_writes = SingleFlight()
+
+# Writes of unhashed blobs in flight, by size and fingerprint
+unhashed_writes = SingleFlight()
+
+# Hashes of blobs stored unhashed in flight, by file
+deferred_hashes = SingleFlight()
+
+
+def write_blob(storage, hash_value, content):
+    """Store ``content`` under its hash, coalesced with concurrent writes of the same hash"""
+
+    def write():
+        content.seek(0)
+        return storage.save(blob_path(hash_value), content)
+
+    name, _ = blob_writes.do(hash_value, write)
+    return name
+
+
+def claim_file(hash_value, hash_type=None):
+    """The stored file of ``hash_value`` claimed for a new entry, None when there is none"""
+    queryset = File.objects.filter(hash_value=hash_value)
+    if hash_type is not None:
+        queryset = queryset.filter(hash_type=hash_type)
+    file = queryset.first()
+    # A file the garbage collector removed in the meantime is stored again
+    if file and file.touch():
+        return file
+    return None
+
+
+def find_duplicate(upload, size, fingerprint, hashes):
+    """
+    The stored file holding the content of ``upload``, claimed, or None.
+    Candidates are the files of the same size whose fingerprint matches (or
+    was never taken), most uploads have none and are never hashed here. The
+    upload is hashed once per algorithm the candidates were hashed with, so
+    files from before a change of ``FILES_HASH_TYPE`` still match, and the
+    digests are collected in ``hashes`` by algorithm.
+    """
+    candidates = File.objects.filter(size=size, fingerprint__in=[fingerprint, ""], hash_value__isnull=False)
+    for hash_type in candidates.order_by().values_list("hash_type", flat=True).distinct():
+        # Hashed with an algorithm that is no longer installed
+        if hash_type not in ALGORITHMS:
+            continue
+        if hash_type not in hashes:
+            hashes[hash_type] = hash_file(upload, hash_type)
+        existing = claim_file(hashes[hash_type], hash_type)
+        if existing:
+            return existing
+    return None
+
+
+def find_stored(upload, size, fingerprint, hashes):
+    """
+    ``find_duplicate``, also matching files stored with deferred hashing that
+    are still waiting for their hash: the ones of the same size and
+    fingerprint are hashed first, once however many uploads look for them.
+    """
+    existing = find_duplicate(upload, size, fingerprint, hashes)
+    if existing:
+        return existing
+    pending = list(File.objects.filter(size=size, fingerprint=fingerprint, hash_value__isnull=True))
+    for file in pending:
+        deferred_hashes.do(file.pk, lambda: hash_deferred(file, merge=False))
+    return find_duplicate(upload, size, fingerprint, hashes) if pending else None
+
+
+def store_unhashed(storage, upload, attributes):
+    """
+    Store an upload without hashing it, ``(file, created)``. A file of the
+    same size and fingerprint stored meanwhile is returned instead: a likely
+    duplicate, which the caller hashes right away if it is waiting for it.
+    """
+    stored = File.objects.filter(size=attributes["size"], fingerprint=attributes["fingerprint"]).first()
+    if stored:
+        return stored, False
+    # Named like any blob without a hash, see file_upload_path
+    name = storage.save(file_upload_path(File(**attributes), upload.name), upload)
+    return create_file(attributes, name), True
+
+
+def hash_deferred(file, merge=True):
+    """
+    Hash ``file``, stored with deferred hashing, and move its blob to its
+    content-addressed name. When the content turns out to be stored already
+    (identical uploads that raced, or a duplicate whose fingerprint was
+    taken differently) the stored file takes over the entries and this one
+    is removed with its blob, unless ``merge`` is False: a file whose entry
+    may not exist yet is left to its job. Does nothing for a file hashed
+    meanwhile.
+    """
+    hasher = new_hasher()
+    try:
+        for block in read_blob(file.file):
+            hasher.update(block)
+    except FileNotFoundError:
+        # Moved by another process hashing it
+        if File.objects.filter(pk=file.pk, hash_value__isnull=True).exists():
+            raise
+        return
+    hash_value = hasher.hexdigest()
+    storage = file.file.storage
+    name = file.file.name
+
+    with transaction.atomic():
+        # Transactions take the write lock first, nobody hashes it from here on
+        if not File.objects.filter(pk=file.pk, hash_value__isnull=True).exists():
+            return
+        existing = File.objects.filter(hash_value=hash_value).first()
+        if existing is None:
+            # Linked under its hash first, the row then switches names and
+            # the old one is deleted below once nothing points at it
+            target = blob_path(hash_value, file.codec)
+            storage.link(name, target)
+            File.objects.filter(pk=file.pk).update(file=target, hash_value=hash_value, hash_type=HASH_TYPE)
+        elif not merge:
+            return
+        else:
+            attributes = {
+                entry_field: getattr(existing, field) for field, entry_field in Entry.FILE_ATTRIBUTES.items()
+            }
+            Entry.objects.filter(file=file).update(file=existing, **attributes)
+            File.objects.filter(pk=file.pk).delete()
+            StorageStats.record(total_files=-1, actual_space=-file.size, stored_space=-file.stored_size)
+
+    storage.delete_if_unreferenced(name, lambda: File.objects.filter(file=name).exists())
+
+
+def create_file(attributes, name, job=None):
+    file = File(**{**attributes, "file": name})
+    with transaction.atomic():
+        file.save(force_insert=True)
+        StorageStats.record(total_files=1, actual_space=file.size, stored_space=file.stored_size)
+        if job:
+            enqueue(job, {"file_id": str(file.pk)})
+    return file
+
+
+def get_or_create_file(upload, attributes):
+    """
+    ``(file, created)`` for an upload, deduplicated in tiers: a size and
+    fingerprint lookup first, a full hash only for a likely duplicate. With
+    ``FILES_DEFER_HASHING`` content that matched nothing is stored without
+    a hash, the caller enqueues ``files.hash_blob`` once its entry exists;
+    identical uploads arriving together share that one file.
+
+    The blob is written before any transaction starts, the row is then
+    inserted on its own: when a concurrent upload of the same content
+    inserted it first, the unique hash rejects ours and theirs is returned
+    instead, so racing uploads never fail and never store twice.
+    """
+    size = attributes["size"]
+    attributes = {**attributes, "fingerprint": fingerprint(upload, size)}
+    hashes = {}
+    # Hashed by the upload handler while the request body was parsed
+    if getattr(upload, "hash_value", None):
+        hashes[upload.hash_type] = upload.hash_value
+    existing = find_duplicate(upload, size, attributes["fingerprint"], hashes)
+    if existing:
+        return existing, False
+
+    storage = File._meta.get_field("file").storage
+    if HASH_TYPE not in hashes and settings.FILES_DEFER_HASHING:
+        key = (size, attributes["fingerprint"])
+        (file, created), shared = unhashed_writes.do(key, lambda: store_unhashed(storage, upload, attributes))
+        if created and not shared:
+            return file, True
+        # Identical looking content arrived alongside or is waiting for its
+        # hash: it is hashed now, once for all uploads waiting on it, and
+        # this upload is deduplicated against it like against any hashed file
+        if file.hash_value is None:
+            deferred_hashes.do(file.pk, lambda: hash_deferred(file, merge=False))
+        existing = find_duplicate(upload, size, attributes["fingerprint"], hashes)
+        if existing:
+            return existing, False
+
+    hash_value = hashes.get(HASH_TYPE) or hash_file(upload)
+    attributes.update(hash_value=hash_value, hash_type=HASH_TYPE)
+    name = write_blob(storage, hash_value, upload)
+    try:
+        file = create_file(attributes, name, "files.verify_blob")
+    except IntegrityError:
+        existing = claim_file(hash_value)
+        if existing is None:
+            raise
+        # Both uploads normally wrote the very same blob. One stored under
+        # another name (e.g. compressed by a differently configured process)
+        # can never get a row now that this hash has one.
+        if existing.file.name != name:
+            storage.delete_if_unreferenced(name, lambda: File.objects.filter(file=name).exists())
+        return existing, False
+    return file, True
@@ -0,0 +1,291 @@
+import mimetypes
+import posixpath
+
+# Bytes of a blob read to detect its type
+SNIFF_SIZE = 8192
+
+DEFAULT_TYPE = "application/octet-stream"
+
+# (offset, signature, MIME type), checked in order so longer signatures
+# sharing a prefix come first
+SIGNATURES = (
+    (0, b"%PDF-", "application/pdf"),
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (0, b"II*\x00", "image/tiff"),
+    (0, b"MM\x00*", "image/tiff"),
+    (0, b"\x00\x00\x01\x00", "image/x-icon"),
+    (0, b"8BPS", "image/vnd.adobe.photoshop"),
+    (0, b"\x1f\x8b", "application/gzip"),
+    (0, b"BZh", "application/x-bzip2"),
+    (0, b"\xfd7zXZ\x00", "application/x-xz"),
+    (0, b"\x28\xb5\x2f\xfd", "application/zstd"),
+    (0, b"7z\xbc\xaf\x27\x1c", "application/x-7z-compressed"),
+    (0, b"Rar!\x1a\x07", "application/vnd.rar"),
+    (257, b"ustar", "application/x-tar"),
+    (0, b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "application/x-ole-storage"),  # doc, xls, ppt, msi
+    (0, b"{\\rtf", "application/rtf"),
+    (0, b"OggS", "audio/ogg"),
+    (0, b"fLaC", "audio/flac"),
+    (0, b"ID3", "audio/mpeg"),
+    (0, b"\xff\xfb", "audio/mpeg"),
+    (0, b"\xff\xf3", "audio/mpeg"),
+    (0, b"MThd", "audio/midi"),
+    (0, b"\x1a\x45\xdf\xa3", "video/x-matroska"),  # mkv, webm
+    (0, b"FLV\x01", "video/x-flv"),
+    (0, b"\x7fELF", "application/x-executable"),
+    (0, b"\x00asm", "application/wasm"),
+    (0, b"SQLite format 3\x00", "application/vnd.sqlite3"),
+    (0, b"wOFF", "font/woff"),
+    (0, b"wOF2", "font/woff2"),
+    (0, b"\x00\x01\x00\x00\x00", "font/ttf"),
+    (0, b"OTTO", "font/otf"),
+)
+
+# Signatures too short to trust for content that decodes as text
+WEAK_SIGNATURES = (
+    (b"BM", "image/bmp"),
+    (b"MZ", "application/vnd.microsoft.portable-executable"),
+)
+
+# RIFF containers carry their format at offset 8
+RIFF_TYPES = {b"WEBP": "image/webp", b"WAVE": "audio/wav", b"AVI ": "video/x-msvideo"}
+
+# ISO base media (mp4 & co) carry a brand after "ftyp" at offset 4
+FTYP_BRANDS = {
+    b"heic": "image/heic", b"heix": "image/heic", b"mif1": "image/heif", b"avif": "image/avif",
+    b"qt  ": "video/quicktime", b"M4A ": "audio/mp4", b"M4V ": "video/x-m4v", b"3gp4": "video/3gpp",
+}
+
+# Zip and OLE containers only say what they hold through their extension
+CONTAINER_TYPES = {"application/zip", "application/x-ole-storage"}
+
+# Non-standard spellings browsers and tools send, mapped to the registered type
+ALIASES = {
+    "image/jpg": "image/jpeg",
+    "image/pjpeg": "image/jpeg",
+    "image/x-png": "image/png",
+    "image/x-ms-bmp": "image/bmp",
+    "image/vnd.microsoft.icon": "image/x-icon",
+    "application/x-zip-compressed": "application/zip",
+    "application/x-zip": "application/zip",
+    "application/x-gzip": "application/gzip",
+    "application/x-rar-compressed": "application/vnd.rar",
+    "application/x-pdf": "application/pdf",
+    "audio/x-wav": "audio/wav",
+    "audio/wave": "audio/wav",
+    "audio/mp3": "audio/mpeg",
+    "audio/x-flac": "audio/flac",
+    "video/avi": "video/x-msvideo",
+    "text/xml": "application/xml",
+    "application/x-javascript": "text/javascript",
+    "application/javascript": "text/javascript",
+    "application/x-yaml": "application/yaml",
+    "text/yaml": "application/yaml",
+    "application/x-sqlite3": "application/vnd.sqlite3",
+}
+
+# Extensions whose type is not in every system's mimetypes table
+EXTENSION_TYPES = {
+    ".csv": "text/csv",
+    ".json": "application/json",
+    ".md": "text/markdown",
+    ".log": "text/plain",
+    ".yaml": "application/yaml",
+    ".yml": "application/yaml",
+    ".js": "text/javascript",
+    ".py": "text/x-python",
+    ".doc": "application/msword",
+    ".xls": "application/vnd.ms-excel",
+    ".ppt": "application/vnd.ms-powerpoint",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".pptx": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    ".odt": "application/vnd.oasis.opendocument.text",
+    ".ods": "application/vnd.oasis.opendocument.spreadsheet",
+    ".odp": "application/vnd.oasis.opendocument.presentation",
+    ".epub": "application/epub+zip",
+    ".jar": "application/java-archive",
+    ".apk": "application/vnd.android.package-archive",
+    ".msi": "application/x-msi",
+    ".webp": "image/webp",
+    ".heic": "image/heic",
+    ".avif": "image/avif",
+    ".mkv": "video/x-matroska",
+    ".webm": "video/webm",
+    ".flac": "audio/flac",
+}
+
+# Text formats plain text detection is refined to by extension
+TEXT_FORMATS = {"application/json", "application/xml", "application/yaml", "image/svg+xml"}
+
+
+class Category:
+    IMAGE = "image"
+    VIDEO = "video"
+    AUDIO = "audio"
+    DOCUMENT = "document"
+    SPREADSHEET = "spreadsheet"
+    PRESENTATION = "presentation"
+    ARCHIVE = "archive"
+    TEXT = "text"
+    CODE = "code"
+    FONT = "font"
+    EXECUTABLE = "executable"
+    OTHER = "other"
+
+    choices = [
+        IMAGE, VIDEO, AUDIO, DOCUMENT, SPREADSHEET, PRESENTATION, ARCHIVE, TEXT, CODE, FONT, EXECUTABLE, OTHER,
+    ]
+
+
+CATEGORY_TYPES = {
+    Category.DOCUMENT: {
+        "application/pdf",
+        "application/msword",
+        "application/rtf",
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        "application/vnd.oasis.opendocument.text",
+        "application/epub+zip",
+    },
+    Category.SPREADSHEET: {
+        "text/csv",
+        "application/vnd.ms-excel",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "application/vnd.oasis.opendocument.spreadsheet",
+    },
+    Category.PRESENTATION: {
+        "application/vnd.ms-powerpoint",
+        "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+        "application/vnd.oasis.opendocument.presentation",
+    },
+    Category.ARCHIVE: {
+        "application/zip",
+        "application/gzip",
+        "application/x-bzip2",
+        "application/x-xz",
+        "application/zstd",
+        "application/x-7z-compressed",
+        "application/vnd.rar",
+        "application/x-tar",
+        "application/java-archive",
+        "application/vnd.android.package-archive",
+    },
+    Category.CODE: {
+        "application/json",
+        "application/xml",
+        "application/yaml",
+        "application/wasm",
+        "text/html",
+        "text/css",
+        "text/javascript",
+        "text/x-python",
+        "application/vnd.sqlite3",
+    },
+    Category.EXECUTABLE: {
+        "application/x-executable",
+        "application/vnd.microsoft.portable-executable",
+        "application/x-msdownload",
+        "application/x-msi",
+    },
+}
+TYPE_CATEGORIES = {mime: category for category, types in CATEGORY_TYPES.items() for mime in types}
+PREFIX_CATEGORIES = {
+    "image": Category.IMAGE,
+    "video": Category.VIDEO,
+    "audio": Category.AUDIO,
+    "font": Category.FONT,
+    "text": Category.TEXT,
+}
+
+
+def normalize_type(value):
+    """Canonical spelling of a MIME type: lower case, without parameters, aliases resolved"""
+    value = (value or "").split(";")[0].strip().lower()
+    if "/" not in value:
+        return ""
+    return ALIASES.get(value, value)
+
+
+def type_for_extension(filename):
+    extension = posixpath.splitext(filename)[1].lower()
+    if extension in EXTENSION_TYPES:
+        return EXTENSION_TYPES[extension]
+    mime, _ = mimetypes.guess_type(filename, strict=False)
+    return normalize_type(mime)
+
+
+def sniff(head):
+    """The MIME type the leading bytes of a blob identify, "" when they do not"""
+    for offset, signature, mime in SIGNATURES:
+        if head.startswith(signature, offset):
+            return mime
+    if head.startswith(b"RIFF"):
+        return RIFF_TYPES.get(head[8:12], "")
+    if head[4:8] == b"ftyp":
+        return FTYP_BRANDS.get(head[8:12], "video/mp4")
+    if head.startswith(b"PK\x03\x04") or head.startswith(b"PK\x05\x06"):
+        return "application/zip"
+    stripped = head.lstrip()
+    if stripped[:5].lower() == b"<?xml" or stripped[:4] == b"<svg":
+        return "image/svg+xml" if b"<svg" in head else "application/xml"
+    if stripped[:14].lower() == b"<!doctype html" or stripped[:5].lower() == b"<html":
+        return "text/html"
+    if is_text(head):
+        return "text/plain"
+    for signature, mime in WEAK_SIGNATURES:
+        if head.startswith(signature):
+            return mime
+    return ""
+
+
+def is_text(head):
+    if not head or b"\x00" in head:
+        return False
+    try:
+        # The sample may end inside a multi-byte character
+        head.decode("utf-8")
+    except UnicodeDecodeError as error:
+        if error.start < len(head) - 3:
+            return False
+    return True
+
+
+def category_for_type(mime):
+    if mime in TYPE_CATEGORIES:
+        return TYPE_CATEGORIES[mime]
+    return PREFIX_CATEGORIES.get(mime.split("/")[0], Category.OTHER)
+
+
+def detect_type(head, filename="", declared=""):
+    """
+    The normalized MIME type and category of a blob. The content decides,
+    the filename only refines what the bytes cannot tell apart (a zip from a
+    docx, plain text from CSV) and the declared type is the last resort.
+    """
+    extension_type = type_for_extension(filename) if filename else ""
+    mime = sniff(head)
+    if mime in CONTAINER_TYPES:
+        if extension_type and extension_type != DEFAULT_TYPE and not extension_type.startswith("text/"):
+            mime = extension_type
+        elif mime == "application/x-ole-storage":
+            mime = DEFAULT_TYPE
+    elif mime == "text/plain":
+        if extension_type.startswith("text/") or extension_type in TEXT_FORMATS:
+            mime = extension_type
+    elif not mime:
+        mime = normalize_type(declared) or extension_type or DEFAULT_TYPE
+    return mime, category_for_type(mime)
+
+
+def resolve_type(value):
+    """
+    Turn a type filter into the stored MIME type, accepting MIME types in any
+    spelling as well as bare extensions such as ``pdf`` or ``jpg``
+    """
+    mime = normalize_type(value)
+    if mime:
+        return mime
+    return type_for_extension(f"file.{value.strip().lower().lstrip('.')}")
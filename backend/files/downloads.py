@@ -0,0 +1,321 @@
+import io
+import os
+import uuid
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import parse_etags
+from django.utils.module_loading import import_string
+from files.compression import CODECS
+
+# Bytes read per iteration when the response is streamed by the worker
+STREAM_BLOCK_SIZE = 256 * 1024
+# Requests asking for more ranges than this get the whole file instead
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range_header(header, size):
+    """
+    Parse a ``Range: bytes=...`` header into sorted, merged (start, end)
+    pairs with inclusive ends. Returns None when the header should be
+    ignored and raises ``RangeNotSatisfiable`` when no range fits the file.
+    """
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs:
+        return None
+
+    ranges = []
+    for spec in specs.split(","):
+        first, dash, last = spec.strip().partition("-")
+        if not dash:
+            return None
+        try:
+            if not first:
+                # Suffix range, the last N bytes
+                length = int(last)
+                if length <= 0:
+                    continue
+                start, end = max(size - length, 0), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else None
+                if end is not None and end < start:
+                    return None
+                if start >= size:
+                    continue
+                end = size - 1 if end is None else min(end, size - 1)
+        except ValueError:
+            return None
+        ranges.append((start, end))
+
+    if not ranges:
+        raise RangeNotSatisfiable
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        if start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def accepted_encoding(request, codec):
+    """
+    The content coding to send a blob compressed with ``codec`` as it is
+    stored, None when the client did not list it in ``Accept-Encoding``.
+    """
+    if not codec:
+        return None
+    encoding = CODECS[codec].encoding
+    for item in request.headers.get("Accept-Encoding", "").split(","):
+        token, _, params = item.partition(";")
+        if token.strip().lower() != encoding:
+            continue
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                return encoding if float(quality[2:]) > 0 else None
+            except ValueError:
+                return None
+        return encoding
+    return None
+
+
+def is_etag_match(header, etag):
+    """Weak comparison of an ``If-None-Match`` header against ``etag``"""
+    if header.strip() == "*":
+        return True
+    strip_weak = lambda tag: tag[2:] if tag.startswith("W/") else tag
+    return strip_weak(etag) in (strip_weak(tag) for tag in parse_etags(header))
+
+
+class FileRange(io.RawIOBase):
+    """
+    A window of an open file. It keeps ``fileno()`` so a WSGI server's file
+    wrapper (gunicorn) can hand it to ``os.sendfile`` from the current offset
+    for ``Content-Length`` bytes, while plain reads never pass the window end.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.start = start
+        self.length = length
+        self.file.seek(start)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        return self.file.tell() - self.start
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.tell()
+        elif whence == io.SEEK_END:
+            offset += self.length
+        offset = min(max(offset, 0), self.length)
+        self.file.seek(self.start + offset)
+        return offset
+
+    def read(self, size=-1):
+        remaining = self.length - self.tell()
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        return self.file.read(size) if size > 0 else b""
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+class StreamTransfer:
+    """Stream the content through the worker, works with every storage backend"""
+
+    def open(self, file):
+        return file.file.storage.open_blob(file.file.name, file.codec)
+
+    def read_range(self, handle, start, end):
+        handle.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = handle.read(min(STREAM_BLOCK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+    def stream(self, file, ranges):
+        handle = self.open(file)
+        try:
+            for start, end in ranges:
+                yield from self.read_range(handle, start, end)
+        finally:
+            handle.close()
+
+    def full(self, file, content_type):
+        response = StreamingHttpResponse(self.stream(file, [(0, file.size - 1)]), content_type=content_type)
+        response["Content-Length"] = file.size
+        return response
+
+    def single_range(self, file, content_type, start, end):
+        response = StreamingHttpResponse(self.stream(file, [(start, end)]), status=206, content_type=content_type)
+        response["Content-Length"] = end - start + 1
+        response["Content-Range"] = f"bytes {start}-{end}/{file.size}"
+        return response
+
+    def multiple_ranges(self, file, content_type, ranges):
+        boundary = uuid.uuid4().hex
+        parts = [
+            (
+                f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Range: bytes {start}-{end}/{file.size}\r\n\r\n"
+            ).encode()
+            for start, end in ranges
+        ]
+        closing = f"--{boundary}--\r\n".encode()
+
+        def body():
+            handle = self.open(file)
+            try:
+                for header, (start, end) in zip(parts, ranges):
+                    yield header
+                    yield from self.read_range(handle, start, end)
+                    yield b"\r\n"
+                yield closing
+            finally:
+                handle.close()
+
+        response = StreamingHttpResponse(
+            body(), status=206, content_type=f"multipart/byteranges; boundary={boundary}"
+        )
+        response["Content-Length"] = (
+            sum(len(header) + end - start + 1 + 2 for header, (start, end) in zip(parts, ranges)) + len(closing)
+        )
+        return response
+
+    def encoded(self, file, content_type, encoding):
+        """Send a compressed blob as it is stored, the client decodes it"""
+
+        def body():
+            with open(file.file.path, "rb") as handle:
+                while block := handle.read(STREAM_BLOCK_SIZE):
+                    yield block
+
+        response = StreamingHttpResponse(body(), content_type=content_type)
+        response["Content-Length"] = file.stored_size
+        response["Content-Encoding"] = encoding
+        return response
+
+    def respond(self, file, content_type, ranges=None):
+        if ranges is None:
+            return self.full(file, content_type)
+        if len(ranges) == 1:
+            return self.single_range(file, content_type, *ranges[0])
+        return self.multiple_ranges(file, content_type, ranges)
+
+
+class SendfileTransfer(StreamTransfer):
+    """
+    Serve raw blobs as file responses, the WSGI server then copies them with
+    ``os.sendfile`` without the bytes passing through Python. Multi-range
+    requests and storages without raw blobs are streamed, and so is every
+    request served under ASGI (see ``get_transfer``).
+    """
+
+    def is_raw(self, file):
+        return file.file.storage.is_raw(file.codec)
+
+    def file_response(self, file, content_type, start, length, status=200):
+        handle = open(file.file.path, "rb")
+        response = FileResponse(FileRange(handle, start, length), status=status, content_type=content_type)
+        response.block_size = STREAM_BLOCK_SIZE
+        response["Content-Length"] = length
+        return response
+
+    def full(self, file, content_type):
+        if not self.is_raw(file):
+            return super().full(file, content_type)
+        return self.file_response(file, content_type, 0, file.size)
+
+    def encoded(self, file, content_type, encoding):
+        response = self.file_response(file, content_type, 0, file.stored_size)
+        response["Content-Encoding"] = encoding
+        return response
+
+    def single_range(self, file, content_type, start, end):
+        if not self.is_raw(file):
+            return super().single_range(file, content_type, start, end)
+        response = self.file_response(file, content_type, start, end - start + 1, status=206)
+        response["Content-Range"] = f"bytes {start}-{end}/{file.size}"
+        return response
+
+
+class ProxyTransfer(StreamTransfer):
+    """
+    Hand the transfer to the front proxy through a header, the proxy serves
+    the file (ranges included) and the worker is free immediately.
+    """
+
+    header = None
+
+    def location(self, file):
+        raise NotImplementedError
+
+    def respond(self, file, content_type, ranges=None):
+        if not file.file.storage.is_raw(file.codec):
+            return super().respond(file, content_type, ranges)
+        response = HttpResponse(content_type=content_type)
+        response[self.header] = self.location(file)
+        return response
+
+    def encoded(self, file, content_type, encoding):
+        response = HttpResponse(content_type=content_type)
+        response[self.header] = self.location(file)
+        response["Content-Encoding"] = encoding
+        return response
+
+
+class XAccelRedirectTransfer(ProxyTransfer):
+    """nginx: ``location <FILES_X_ACCEL_REDIRECT_PREFIX> { internal; alias <MEDIA_ROOT>/; }``"""
+
+    header = "X-Accel-Redirect"
+
+    def location(self, file):
+        return settings.FILES_X_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + file.file.name
+
+
+class XSendfileTransfer(ProxyTransfer):
+    """Apache mod_xsendfile, lighttpd and other servers reading ``X-Sendfile``"""
+
+    header = "X-Sendfile"
+
+    def location(self, file):
+        return os.path.abspath(file.file.path)
+
+
+def get_transfer(request=None):
+    transfer = import_string(settings.FILES_DOWNLOAD_TRANSFER)
+    # os.sendfile is only reached through a WSGI server's file wrapper, under
+    # ASGI (start.sh) a file response is read in Python like any stream
+    if issubclass(transfer, SendfileTransfer) and request is not None and "wsgi.file_wrapper" not in request.META:
+        transfer = StreamTransfer
+    return transfer()
@@ -1,48 +1,54 @@
 import django_filters
 from django.db.models import Q
+from files.detection import Category, resolve_type
 from files.models import Entry
+from files.search import search_backend
 
 
 class EntryFilter(django_filters.FilterSet):
-    # Search by filename (case-insensitive partial match)
+    # Search by name and filename (case-insensitive partial match)
     search = django_filters.CharFilter(
-        field_name="file__original_filename",
-        lookup_expr="icontains",
-        help_text="Search files by filename",
+        method="filter_search",
+        help_text="Search files by name and filename",
     )
 
-    # Filter by file type (exact match)
+    # Filter by detected type, an exact match on the canonical MIME type
     file_type = django_filters.CharFilter(
-        field_name="file__file_type",
-        lookup_expr="iexact",
-        help_text="Filter by file type (e.g., 'pdf', 'jpg')",
+        method="filter_file_type",
+        help_text="Filter by file type, a MIME type or an extension (e.g., 'application/pdf', 'pdf', 'jpg')",
+    )
+
+    category = django_filters.ChoiceFilter(
+        field_name="category",
+        choices=[(value, value) for value in Category.choices],
+        help_text="Filter by kind of file (e.g., 'image', 'document', 'archive')",
     )
 
     # Size range filters
     min_size = django_filters.NumberFilter(
-        field_name="file__size", lookup_expr="gte", help_text="Minimum file size in bytes"
+        field_name="size", lookup_expr="gte", help_text="Minimum file size in bytes"
     )
 
     max_size = django_filters.NumberFilter(
-        field_name="file__size", lookup_expr="lte", help_text="Maximum file size in bytes"
+        field_name="size", lookup_expr="lte", help_text="Maximum file size in bytes"
     )
 
     # Date filters
     uploaded_after = django_filters.DateTimeFilter(
-        field_name="file__created_at",
+        field_name="uploaded_at",
         lookup_expr="gte",
         help_text="Files uploaded after this date (ISO format: 2024-01-01T00:00:00Z)",
     )
 
     uploaded_before = django_filters.DateTimeFilter(
-        field_name="file__created_at",
+        field_name="uploaded_at",
         lookup_expr="lte",
         help_text="Files uploaded before this date",
     )
 
     # Date range filter (alternative approach)
     uploaded_at = django_filters.DateFromToRangeFilter(
-        field_name="file__created_at",
+        field_name="uploaded_at",
         help_text="Date range filter (uploaded_at_after and uploaded_at_before)",
     )
 
@@ -52,18 +58,41 @@ class EntryFilter(django_filters.FilterSet):
         help_text="Search across filename and file type",
     )
 
+    # Order search results by relevance instead of upload date
+    rank = django_filters.BooleanFilter(
+        method="filter_rank",
+        help_text="Rank search results by relevance",
+    )
+
+    def filter_file_type(self, queryset, name, value):
+        return queryset.filter(mime_type=resolve_type(value))
+
+    def filter_search(self, queryset, name, value):
+        return search_backend.search(
+            queryset, value, ["name", "original_filename"], ranked=self.ranked
+        )
+
     def filter_advanced_search(self, queryset, name, value):
         """Search across multiple fields"""
-        return queryset.filter(
-            Q(file__original_filename__icontains=value) | Q(file__file_type__icontains=value)
+        return search_backend.search(
+            queryset, value, ["name", "original_filename", "file_type"], ranked=self.ranked
         )
 
+    def filter_rank(self, queryset, name, value):
+        # Applied by the search filters themselves
+        return queryset
+
+    @property
+    def ranked(self):
+        return bool(self.form.cleaned_data.get("rank"))
+
     class Meta:
         model = Entry
         fields = [
             "search",
             "name",
             "file_type",
+            "category",
             "min_size",
             "max_size",
             "uploaded_after",
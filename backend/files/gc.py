@@ -0,0 +1,143 @@
+import os
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from files.chunking import CHUNK_ROOT, ChunkedBlobStorage, chunk_path
+from files.models import Chunk, Entry, File, StorageStats
+from files.storage import BLOB_ROOT
+
+
+class GarbageCollector:
+    """
+    Removes ``File`` rows no entry points at any more together with their
+    blobs, and reconciles the blob directory against the database.
+
+    Nothing younger than ``grace`` seconds is touched: a new file has no
+    entry until its upload finishes, and a deduplicated upload claims an
+    existing file (``File.touch``) before it adds an entry to it.
+    """
+
+    def __init__(self, grace=3600, batch_size=500, max_rate=None, dry_run=False, log=print):
+        self.grace = grace
+        self.batch_size = batch_size
+        self.max_rate = max_rate
+        self.dry_run = dry_run
+        self.log = log
+        self.storage = File._meta.get_field("file").storage
+
+    def orphaned_files(self):
+        cutoff = timezone.now() - timedelta(seconds=self.grace)
+        return File.objects.filter(
+            Q(referenced_at__lt=cutoff) | Q(referenced_at__isnull=True, created_at__lt=cutoff),
+            ~Exists(Entry.objects.filter(file=OuterRef("pk"))),
+        )
+
+    def throttle(self, count, started):
+        if self.max_rate:
+            time.sleep(max(0, count / self.max_rate - (time.monotonic() - started)))
+
+    def is_referenced(self, name):
+        return lambda: File.objects.filter(file=name).exists()
+
+    def collect_files(self):
+        """Delete orphaned files in batches, returns (files, bytes) collected"""
+        collected_files = collected_bytes = 0
+        last_pk = None
+        while True:
+            started = time.monotonic()
+            queryset = self.orphaned_files().order_by("pk")
+            if last_pk is not None:
+                queryset = queryset.filter(pk__gt=last_pk)
+            batch = list(queryset.values_list("pk", "file", "size", "stored_size")[: self.batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+
+            if self.dry_run:
+                collected = batch
+            else:
+                ids = [pk for pk, _, _, _ in batch]
+                with transaction.atomic():
+                    # One conditional DELETE re-checks every condition, so a
+                    # file claimed by an upload since the SELECT is left alone
+                    self.orphaned_files().filter(pk__in=ids)._raw_delete(File.objects.db)
+                    remaining = set(File.objects.filter(pk__in=ids).values_list("pk", flat=True))
+                    collected = [row for row in batch if row[0] not in remaining]
+                    StorageStats.record(
+                        total_files=-len(collected),
+                        actual_space=-sum(size for _, _, size, _ in collected),
+                        stored_space=-sum(stored_size for _, _, _, stored_size in collected),
+                    )
+                for _, name, _, _ in collected:
+                    self.storage.delete_if_unreferenced(name, self.is_referenced(name), self.grace)
+
+            collected_files += len(collected)
+            collected_bytes += sum(size for _, _, size, _ in collected)
+            self.throttle(len(batch), started)
+        return collected_files, collected_bytes
+
+    def walk(self, root):
+        """Yield batches of the blob names stored below ``root``, removing stale temp files"""
+        batch = []
+        for directory, _, filenames in os.walk(self.storage.path(root)):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                if filename.startswith("."):
+                    # Temp or trash file left behind by a crash
+                    if not self.dry_run and time.time() - os.stat(path).st_mtime > self.grace:
+                        os.remove(path)
+                    continue
+                batch.append(os.path.relpath(path, self.storage.location).replace(os.sep, "/"))
+                if len(batch) >= self.batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def reconcile_blobs(self):
+        """Delete blobs no file row references, returns (blobs deleted, rows whose blob is gone)"""
+        deleted = 0
+        for names in self.walk(BLOB_ROOT):
+            started = time.monotonic()
+            known = set(File.objects.filter(file__in=names).values_list("file", flat=True))
+            for name in names:
+                if name in known:
+                    continue
+                if self.dry_run or self.storage.delete_if_unreferenced(name, self.is_referenced(name), self.grace):
+                    deleted += 1
+            self.throttle(len(names), started)
+
+        missing = 0
+        for pk, name in File.objects.values_list("pk", "file").iterator(chunk_size=self.batch_size):
+            if not self.storage.exists(name):
+                missing += 1
+                self.log(f"Blob missing for file {pk}: {name}")
+        return deleted, missing
+
+    def reconcile_chunks(self):
+        """Same as ``reconcile_blobs`` for the chunk store of ``ChunkedBlobStorage``"""
+        deleted = 0
+        for names in self.walk(CHUNK_ROOT):
+            started = time.monotonic()
+            hashes = {os.path.basename(name) for name in names}
+            known = set(Chunk.objects.filter(hash_value__in=hashes).values_list("hash_value", flat=True))
+            for hash_value in hashes - known:
+                if self.dry_run or self.storage.delete_chunk_if_unreferenced(hash_value, self.grace):
+                    deleted += 1
+            self.throttle(len(names), started)
+
+        missing = 0
+        for hash_value in Chunk.objects.values_list("hash_value", flat=True).iterator(chunk_size=self.batch_size):
+            if not self.storage.exists(chunk_path(hash_value)):
+                missing += 1
+                self.log(f"Chunk missing: {hash_value}")
+        return deleted, missing
+
+    def reconcile(self):
+        results = {"blobs": self.reconcile_blobs()}
+        if isinstance(self.storage, ChunkedBlobStorage):
+            results["chunks"] = self.reconcile_chunks()
+        return results
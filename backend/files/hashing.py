@@ -0,0 +1,99 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import blake3
+except ImportError:  # optional, blake2b is used without it
+    blake3 = None
+
+# Algorithms a file can be hashed with, by the name recorded in ``File.hash_type``.
+# Blobs are named after their hash, so only cryptographic hashes qualify: a
+# fast non-cryptographic one (xxh3 & co) can be made to collide.
+ALGORITHMS = {
+    "sha256": hashlib.sha256,
+    "blake2b": hashlib.blake2b,
+}
+if blake3 is not None:
+    # Hashes large updates on several cores
+    ALGORITHMS["blake3"] = lambda: blake3.blake3(max_threads=blake3.blake3.AUTO)
+
+# Bytes read at the start, middle and end of a file for its fingerprint
+FINGERPRINT_SAMPLE_SIZE = 64 * 1024
+
+
+def get_hash_type(name):
+    """The algorithm called ``name``, blake3 falls back to blake2b when it is not installed"""
+    if name == "blake3" and blake3 is None:
+        name = "blake2b"
+    if name not in ALGORITHMS:
+        raise ImproperlyConfigured(f"Unknown hash algorithm {name!r}, choose one of {', '.join(ALGORITHMS)}")
+    return name
+
+
+# Algorithm new files are hashed with, files hashed with another one keep
+# their own ``hash_type`` and are compared with it
+HASH_TYPE = get_hash_type(settings.FILES_HASH_TYPE)
+
+
+def new_hasher(hash_type=HASH_TYPE):
+    """Return a fresh hasher for the algorithm recorded in ``File.hash_type``"""
+    return ALGORITHMS[hash_type]()
+
+
+def hash_file(file, hash_type=HASH_TYPE):
+    """
+    Return the hex digest of an uploaded file.
+
+    Files parsed by ``HashingUploadHandlerMixin`` already carry their digest,
+    so the bytes are only read a second time for files that arrived some other way.
+    """
+    precomputed = getattr(file, "hash_value", None)
+    if precomputed and getattr(file, "hash_type", None) == hash_type:
+        return precomputed
+
+    hasher = new_hasher(hash_type)
+    for chunk in file.chunks():  # efficient for big files
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def fingerprint(file, size):
+    """
+    A cheap stand-in for the content hash: the size and samples of the start,
+    middle and end of the file. Different fingerprints prove different
+    content, equal ones only make a duplicate worth a full hash.
+    """
+    hasher = hashlib.blake2b(str(size).encode(), digest_size=16)
+    offsets = {0, max(0, size // 2 - FINGERPRINT_SAMPLE_SIZE // 2), max(0, size - FINGERPRINT_SAMPLE_SIZE)}
+    for offset in sorted(offsets):
+        file.seek(offset)
+        hasher.update(file.read(FINGERPRINT_SAMPLE_SIZE))
+    file.seek(0)
+    return hasher.hexdigest()
+
+
+def hash_path(path, hash_type=HASH_TYPE, block_size=1024 * 1024):
+    """``(size, hash, fingerprint)`` of the file at ``path``"""
+    hasher = new_hasher(hash_type)
+    with open(path, "rb") as source:
+        size = os.fstat(source.fileno()).st_size
+        while block := source.read(block_size):
+            hasher.update(block)
+        return size, hasher.hexdigest(), fingerprint(source, size)
+
+
+def hash_paths(paths, hash_type=HASH_TYPE):
+    """
+    ``hash_path`` of many files, in a worker process of the importer (only
+    this module is needed there). A file that cannot be read gives its error.
+    """
+    results = []
+    for path in paths:
+        try:
+            results.append(hash_path(path, hash_type))
+        except OSError as error:
+            results.append(error)
+    return results
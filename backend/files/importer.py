@@ -0,0 +1,232 @@
+import json
+import mimetypes
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from common.utils import format_bytes
+from django.core.files import File as DjangoFile
+from django.utils import timezone
+
+from files.bulk import BulkIngest, BulkItem
+from files.hashing import HASH_TYPE, hash_paths
+from files.storage import blob_path
+
+# Paths hashed per task sent to a worker process
+HASH_TASK_SIZE = 64
+
+# Batches hashed ahead of the one being stored
+BATCHES_AHEAD = 2
+
+ENTRY_NAME_MAX_LENGTH = 255
+
+
+class ImportedFile(DjangoFile):
+    """A file of the imported tree, hashed already and only opened if its blob is written through the storage"""
+
+    def __init__(self, path, size, hash_value, fingerprint):
+        super().__init__(None, name=os.path.basename(path))
+        self.path = path
+        self.size = size
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.hash_type = HASH_TYPE
+        self.hash_value = hash_value
+        self.fingerprint = fingerprint
+
+
+class TreeImport(BulkIngest):
+    """
+    ``BulkIngest`` for files hashed by the importer's process pool: blobs are
+    linked, cloned or copied into storage straight from their path.
+    """
+
+    # Imports are covered by the scrubber, a job per file would double the reads
+    verify = False
+
+    def __init__(self, mode="copy", workers=None):
+        super().__init__(workers)
+        self.mode = mode
+
+    def hash_item(self, item):
+        item.hash_value = item.upload.hash_value
+        item.fingerprint = item.upload.fingerprint
+        return item
+
+    def write_blob(self, item):
+        item.blob_name = self.storage.import_file(blob_path(item.hash_value), item.upload.path, self.mode)
+        return item
+
+
+def walk(directory, after=(), parts=()):
+    """
+    Yield ``(path, relative path)`` for the regular files below
+    ``directory``, depth first with the names of every directory sorted, so
+    the order matches the order of the path components and a walk can start
+    after the relative path ``after`` (a tuple of components) skipping whole
+    directories. Symlinks are not followed.
+    """
+    with os.scandir(directory) as scan:
+        entries = sorted(scan, key=lambda entry: entry.name)
+    for entry in entries:
+        current = parts + (entry.name,)
+        if entry.is_dir(follow_symlinks=False):
+            # Entirely before the checkpoint
+            if current < after[: len(current)]:
+                continue
+            yield from walk(entry.path, after, current)
+        elif entry.is_file(follow_symlinks=False) and current > after:
+            yield entry.path, "/".join(current)
+
+
+class Journal:
+    """
+    Append-only record of an import, one JSON line per stored batch holding
+    the relative path of its last file: everything up to there is in the
+    vault, a resumed import walks on from it. Lines are fsynced, a line cut
+    short by a crash is dropped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def last(self):
+        """The latest checkpoint, None for an import that never stored a batch"""
+        checkpoint = None
+        try:
+            with open(self.path, "r+b") as journal:
+                for line in journal:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError
+                        checkpoint = json.loads(line)
+                    except ValueError:
+                        break
+                    end = journal.tell()
+                else:
+                    return checkpoint
+                # Cut short by a crash, records are appended after the last whole line
+                journal.truncate(end if checkpoint else 0)
+        except FileNotFoundError:
+            pass
+        return checkpoint
+
+    def record(self, checkpoint):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as journal:
+            journal.write(json.dumps(checkpoint) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+
+
+class TreeImporter:
+    """
+    Imports the files below ``root``: the tree is walked with ``os.scandir``
+    in batches of ``batch_size`` files, hashed on ``processes`` worker
+    processes while the previous batch is stored, and every batch is
+    deduplicated and inserted by ``TreeImport`` in one transaction before
+    the journal records it.
+    """
+
+    def __init__(self, root, journal, mode="copy", processes=None, batch_size=1000, interval=5, log=print):
+        self.root = os.path.abspath(root)
+        self.journal = journal
+        self.ingest = TreeImport(mode)
+        self.processes = processes or os.cpu_count()
+        self.batch_size = batch_size
+        self.interval = interval
+        self.log = log
+        self.counts = {BulkItem.CREATED: 0, BulkItem.DEDUPLICATED: 0, BulkItem.FAILED: 0}
+        self.bytes = 0
+        self.last = ()
+        # Files and bytes imported by an earlier run, not counted in the rates
+        self.resumed = (0, 0)
+        self.started = self.reported = time.monotonic()
+
+    @property
+    def files(self):
+        return sum(self.counts.values())
+
+    def resume(self):
+        """Continue after the journal's checkpoint, returns the files imported before"""
+        checkpoint = self.journal.last()
+        if checkpoint is None:
+            return 0
+        if checkpoint["root"] != self.root:
+            raise ValueError(f"The journal {self.journal.path} belongs to an import of {checkpoint['root']}")
+        self.last = tuple(checkpoint["last"].split("/"))
+        self.counts.update(checkpoint["counts"])
+        self.bytes = checkpoint["bytes"]
+        self.resumed = (self.files, self.bytes)
+        return self.files
+
+    def batches(self):
+        batch = []
+        for path, relative in walk(self.root, self.last):
+            if path == self.journal.path:
+                continue
+            batch.append((path, relative))
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def run(self):
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=self.processes) as pool:
+            for batch in self.batches():
+                paths = [path for path, _ in batch]
+                tasks = [
+                    pool.submit(hash_paths, paths[start : start + HASH_TASK_SIZE], HASH_TYPE)
+                    for start in range(0, len(paths), HASH_TASK_SIZE)
+                ]
+                pending.append((batch, tasks))
+                if len(pending) > BATCHES_AHEAD:
+                    self.store(*pending.popleft())
+            while pending:
+                self.store(*pending.popleft())
+        self.report()
+
+    def store(self, batch, tasks):
+        results = [result for task in tasks for result in task.result()]
+        items = []
+        for (path, relative), result in zip(batch, results):
+            if isinstance(result, OSError):
+                self.counts[BulkItem.FAILED] += 1
+                self.log(f"Failed to read {path}: {result}")
+                continue
+            size, hash_value, fingerprint = result
+            # The relative path names the entry, unless too long for it
+            name = relative if len(relative) <= ENTRY_NAME_MAX_LENGTH else os.path.basename(relative)
+            items.append(BulkItem(ImportedFile(path, size, hash_value, fingerprint), name[:ENTRY_NAME_MAX_LENGTH]))
+
+        self.ingest.ingest(items)
+        for item in items:
+            self.counts[item.status] += 1
+            if item.status == BulkItem.FAILED:
+                self.log(f"Failed to store {item.upload.path}")
+            else:
+                self.bytes += item.upload.size
+
+        self.journal.record(
+            {
+                "root": self.root,
+                "last": batch[-1][1],
+                "counts": self.counts,
+                "bytes": self.bytes,
+                "at": timezone.now().isoformat(),
+            }
+        )
+        if time.monotonic() - self.reported >= self.interval:
+            self.report()
+
+    def report(self):
+        self.reported = time.monotonic()
+        elapsed = max(self.reported - self.started, 1e-3)
+        files, size = self.files - self.resumed[0], self.bytes - self.resumed[1]
+        self.log(
+            f"{self.files} files ({format_bytes(self.bytes)}): {self.counts[BulkItem.CREATED]} created, "
+            f"{self.counts[BulkItem.DEDUPLICATED]} deduplicated, {self.counts[BulkItem.FAILED]} failed; "
+            f"{files / elapsed:.0f} files/s, {format_bytes(size / elapsed)}/s"
+        )
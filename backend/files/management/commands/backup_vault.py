@@ -0,0 +1,39 @@
+from common.utils import format_bytes
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from files.backup import VaultBackup
+
+
+class Command(BaseCommand):
+    help = (
+        "Back up the database and blobs to a directory: a consistent online snapshot of the database, "
+        "the blobs it references that earlier backups there do not have, and a manifest"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("destination", help="Backup directory, reused by every backup")
+        parser.add_argument(
+            "--workers", type=int, default=settings.FILES_BACKUP_WORKERS, help="Blobs copied at once"
+        )
+        parser.add_argument(
+            "--full", action="store_true",
+            help="Check every referenced blob, not only those new since the last backup, and copy what is missing",
+        )
+
+    def handle(self, *args, **options):
+        backup = VaultBackup(options["destination"], workers=options["workers"], log=self.stderr.write)
+        snapshot, manifest = backup.run(full=options["full"])
+
+        blobs = manifest["blobs"]
+        if blobs["missing"]:
+            self.stderr.write(
+                self.style.WARNING(f"{len(blobs['missing'])} referenced blobs are missing from storage")
+            )
+        since = f"since {manifest['previous']}" if manifest["previous"] else "(full)"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Snapshot {snapshot}: database {format_bytes(manifest['database']['size'])}, "
+                f"{blobs['copied']} blobs ({format_bytes(blobs['copied_bytes'])}) copied of "
+                f"{blobs['checked']} checked {since}"
+            )
+        )
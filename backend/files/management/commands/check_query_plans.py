@@ -0,0 +1,122 @@
+import itertools
+import re
+from urllib.parse import urlencode
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from files.cache import response_cache
+from files.views import EntryViewSet
+
+# A value for every list filter, checked alone and in pairs
+FILTERS = {
+    "search": "report",
+    "name": "report.pdf",
+    "file_type": "pdf",
+    "category": "document",
+    "min_size": "1024",
+    "max_size": "1048576",
+    "uploaded_after": "2024-01-01T00:00:00Z",
+    "uploaded_before": "2025-01-01T00:00:00Z",
+}
+
+ENDPOINTS = {
+    "list": ({"get": "list"}, {}),
+    "cursor": ({"get": "list"}, {"pagination": "cursor"}),
+    "facets": ({"get": "facets"}, {}),
+}
+
+# A table read from end to end, directly or through one of its indexes (a
+# scan "USING INDEX" still visits every row), only a SEARCH narrows the rows
+# down; virtual tables (the FTS5 search index) report their own index use
+FULL_SCAN = re.compile(r"^SCAN (?!CONSTANT ROW)(\S+)(?!.*\bVIRTUAL TABLE\b)")
+TEMP_SORT = "USE TEMP B-TREE"
+
+# Requests answered from every entry, their scans are expected as long as
+# they stay on a covering index
+EVERY_ENTRY = {("facets", ())}
+
+
+def is_index_walk(sql, plan):
+    """
+    Whether the scans of ``plan`` stop at the LIMIT of ``sql``: an unfiltered
+    query reading an index in its ORDER BY order reads no more rows than it
+    returns, the first page of the list does that
+    """
+    scans = [line for line in plan if FULL_SCAN.match(line)]
+    return (
+        " WHERE " not in sql
+        and " LIMIT " in sql
+        and not any(line.startswith(TEMP_SORT) for line in plan)
+        and all(" USING " in line for line in scans)
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the files list and facets queries for every filter and pair of filters through "
+        "EXPLAIN QUERY PLAN and fail if any of them scans a table or a whole index. Queries only run "
+        "when the previous ones found rows (e.g. a page after its count), so check a database holding "
+        "an entry that matches every filter"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verbose-plans", action="store_true", help="Print the plan of every query")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("Query plans are only checked on SQLite")
+
+        combinations = [()] + [
+            combination for size in (1, 2) for combination in itertools.combinations(FILTERS, size)
+        ]
+        failures = 0
+        for combination in combinations:
+            for endpoint, (actions, extra) in ENDPOINTS.items():
+                params = {**{key: FILTERS[key] for key in combination}, **extra}
+                label = f"{endpoint} {', '.join(combination) or '(no filter)'}"
+                for sql, plan in self.plans(actions, params):
+                    scans = [match.group(1) for line in plan if (match := FULL_SCAN.match(line))]
+                    if is_index_walk(sql, plan):
+                        scans = []
+                    elif (endpoint, combination) in EVERY_ENTRY:
+                        scans = [line.split()[1] for line in plan if FULL_SCAN.match(line) and "COVERING" not in line]
+                    sorted_ = any(line.startswith(TEMP_SORT) for line in plan)
+                    if scans:
+                        failures += 1
+                        self.stdout.write(self.style.ERROR(f"FULL SCAN of {', '.join(scans)}: {label}"))
+                    elif options["verbose_plans"]:
+                        note = " (sorted in a temporary b-tree)" if sorted_ else ""
+                        self.stdout.write(f"ok{note}: {label}")
+                    if scans or options["verbose_plans"]:
+                        self.stdout.write(f"  {sql}")
+                        for line in plan:
+                            self.stdout.write(f"    {line}")
+
+        if failures:
+            raise CommandError(f"{failures} queries read a table without an index")
+        self.stdout.write(
+            self.style.SUCCESS(f"{len(combinations) * len(ENDPOINTS)} requests checked, every query uses an index")
+        )
+
+    def plans(self, actions, params):
+        """The SELECTs a request runs with their query plans"""
+        queries = []
+
+        def capture(execute, sql, sql_params, many, context):
+            if sql.lstrip().upper().startswith("SELECT"):
+                queries.append((sql, sql_params))
+            return execute(sql, sql_params, many, context)
+
+        # Cached responses would skip the queries
+        response_cache.bump()
+        request = RequestFactory().get(f"/api/files/?{urlencode(params)}")
+        with connection.execute_wrapper(capture):
+            response = EntryViewSet.as_view(actions)(request)
+        if response.status_code != 200:
+            raise CommandError(f"/api/files/?{urlencode(params)} answered {response.status_code}")
+
+        with connection.cursor() as cursor:
+            for sql, sql_params in queries:
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}", sql_params)
+                yield sql, [row[3] for row in cursor.fetchall()]
@@ -0,0 +1,46 @@
+import time
+
+from common.utils import format_bytes
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from files.gc import GarbageCollector
+
+
+class Command(BaseCommand):
+    help = "Delete files no entry references any more and reconcile stored blobs with the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace", type=int, default=settings.FILES_GC_GRACE_PERIOD,
+            help="Leave files and blobs used within this many seconds alone",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--max-rate", type=float, help="Maximum files or blobs processed per second")
+        parser.add_argument("--reconcile", action="store_true", help="Also compare the storage directory with the database")
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted")
+        parser.add_argument("--interval", type=int, help="Keep running, sweeping every this many seconds")
+
+    def handle(self, *args, **options):
+        collector = GarbageCollector(
+            grace=options["grace"],
+            batch_size=options["batch_size"],
+            max_rate=options["max_rate"],
+            dry_run=options["dry_run"],
+            log=self.stderr.write,
+        )
+        while True:
+            self.sweep(collector, options["reconcile"])
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
+
+    def sweep(self, collector, reconcile):
+        verb = "Would collect" if collector.dry_run else "Collected"
+        files, freed = collector.collect_files()
+        self.stdout.write(self.style.SUCCESS(f"{verb} {files} orphaned files ({format_bytes(freed)})"))
+
+        if reconcile:
+            for kind, (deleted, missing) in collector.reconcile().items():
+                self.stdout.write(
+                    self.style.SUCCESS(f"{verb} {deleted} unreferenced {kind}, {missing} {kind} missing from storage")
+                )
@@ -0,0 +1,48 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from files.sessions import SessionCollector
+
+
+class Command(BaseCommand):
+    help = "Delete abandoned upload sessions with their part files and reopen sessions a crashed request left finalizing"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ttl", type=int, default=settings.FILE_UPLOAD_SESSION_TTL,
+            help="Remove sessions without a chunk for this many seconds",
+        )
+        parser.add_argument(
+            "--finalize-timeout", type=int, default=settings.FILE_UPLOAD_FINALIZE_TIMEOUT,
+            help="Reopen sessions finalizing for this many seconds",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be done")
+        parser.add_argument("--interval", type=int, help="Keep running, sweeping every this many seconds")
+
+    def handle(self, *args, **options):
+        collector = SessionCollector(
+            ttl=options["ttl"],
+            finalize_timeout=options["finalize_timeout"],
+            batch_size=options["batch_size"],
+            dry_run=options["dry_run"],
+            log=self.stderr.write,
+        )
+        while True:
+            self.sweep(collector)
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
+
+    def sweep(self, collector):
+        prefix = "Would have " if collector.dry_run else ""
+        reopened, deleted = collector.reclaim_stalled()
+        expired = collector.collect_expired()
+        parts = collector.collect_parts()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{prefix}{reopened} stalled sessions reopened, {deleted + expired} sessions and "
+                f"{parts} orphaned part files removed"
+            )
+        )
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from files.cache import response_cache
+from files.detection import SNIFF_SIZE, detect_type
+from files.models import Entry, File
+
+
+class Command(BaseCommand):
+    help = "Detect the MIME type and category of stored files from the leading bytes of their blobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        storage = File._meta.get_field("file").storage
+        checked = changed = missing = 0
+        last_pk = None
+
+        while True:
+            queryset = File.objects.order_by("pk").only(
+                "pk", "file", "codec", "original_filename", "file_type", "mime_type", "category"
+            )
+            if last_pk is not None:
+                queryset = queryset.filter(pk__gt=last_pk)
+            batch = list(queryset[: options["batch_size"]])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            updated = []
+            for file in batch:
+                checked += 1
+                try:
+                    with storage.open_blob(file.file.name, file.codec) as blob:
+                        head = blob.read(SNIFF_SIZE)
+                except FileNotFoundError:
+                    missing += 1
+                    self.stderr.write(f"Blob missing for file {file.pk}: {file.file.name}")
+                    continue
+                detected = detect_type(head, file.original_filename, file.file_type)
+                if detected != (file.mime_type, file.category):
+                    file.mime_type, file.category = detected
+                    updated.append(file)
+            with transaction.atomic():
+                File.objects.bulk_update(updated, ["mime_type", "category"])
+                # Entries keep a copy of the type for their filters
+                for file in updated:
+                    Entry.objects.filter(file=file).update(mime_type=file.mime_type, category=file.category)
+            changed += len(updated)
+
+        if changed:
+            response_cache.bump()
+        self.stdout.write(
+            self.style.SUCCESS(f"Checked {checked} files, {changed} types updated, {missing} blobs missing")
+        )
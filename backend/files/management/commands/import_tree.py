@@ -0,0 +1,73 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from files.importer import Journal, TreeImporter
+from files.models import File
+from files.storage import IMPORT_MODES
+
+
+class Command(BaseCommand):
+    help = (
+        "Import every regular file below a directory, hashed on a process pool and stored in batches; "
+        "entries are named after the relative path and an interrupted import resumes from its journal"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", help="Root of the tree to import")
+        parser.add_argument(
+            "--link", choices=IMPORT_MODES, default="copy",
+            help="How blobs get into storage: copy, hardlink (same filesystem, the source files must "
+            "never change afterwards) or reflink (cloned on btrfs/XFS, copied elsewhere)",
+        )
+        parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Processes hashing files")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Files stored per transaction")
+        parser.add_argument("--journal", help="Resume journal, by default one per directory under data/imports")
+        parser.add_argument("--restart", action="store_true", help="Ignore the journal and start over")
+        parser.add_argument("--interval", type=int, default=5, help="Seconds between progress reports")
+
+    def handle(self, *args, **options):
+        root = os.path.abspath(options["directory"])
+        if not os.path.isdir(root):
+            raise CommandError(f"{root} is not a directory")
+
+        storage = File._meta.get_field("file").storage
+        if options["link"] != "copy" and not storage.links_imports:
+            self.stderr.write(f"{type(storage).__name__} cannot link blobs in, files are copied")
+        elif options["link"] == "hardlink":
+            os.makedirs(storage.location, exist_ok=True)
+            if os.stat(root).st_dev != os.stat(storage.location).st_dev:
+                raise CommandError(f"{root} and {storage.location} are on different filesystems, hardlinks are impossible")
+
+        journal_path = options["journal"] or os.path.join(
+            settings.BASE_DIR, "data", "imports", f"{hashlib.sha256(root.encode()).hexdigest()[:16]}.jsonl"
+        )
+        journal = Journal(os.path.abspath(journal_path))
+        if options["restart"] and os.path.exists(journal.path):
+            os.remove(journal.path)
+
+        importer = TreeImporter(
+            root,
+            journal,
+            mode=options["link"],
+            processes=options["processes"],
+            batch_size=options["batch_size"],
+            interval=options["interval"],
+            log=self.stderr.write,
+        )
+        try:
+            resumed = importer.resume()
+        except ValueError as error:
+            raise CommandError(error)
+        if resumed:
+            self.stderr.write(f"Resuming after {'/'.join(importer.last)} ({resumed} files imported before)")
+
+        importer.run()
+        counts = importer.counts
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {importer.files - resumed} files from {root} ({importer.files} in total): "
+                f"{counts['created']} created, {counts['deduplicated']} deduplicated, {counts['failed']} failed"
+            )
+        )
@@ -0,0 +1,69 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from files.models import File
+from files.storage import blob_path
+
+
+class Command(BaseCommand):
+    help = "Move existing blobs to the content-addressed uploads/ab/cd/<hash> layout"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would move")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        dry_run = options["dry_run"]
+        storage = File._meta.get_field("file").storage
+        verb = "Would move" if dry_run else "Moved"
+        moved = skipped = missing = 0
+        last_pk = None
+
+        # Keyset batches over the primary key; rows that already use the new
+        # layout are skipped, so an interrupted run simply picks up again
+        while True:
+            # Files stored with deferred hashing move once they are hashed
+            queryset = File.objects.filter(hash_value__isnull=False).order_by("pk").only("pk", "file", "codec", "hash_value")
+            if last_pk is not None:
+                queryset = queryset.filter(pk__gt=last_pk)
+            batch = list(queryset[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            updated = []
+            for file in batch:
+                current = file.file.name
+                # A compressed blob keeps the codec suffix it is read back by
+                target = blob_path(file.hash_value, file.codec)
+                if current == target:
+                    skipped += 1
+                    continue
+                if dry_run:
+                    moved += 1
+                    continue
+
+                if not storage.exists(target):
+                    if not storage.exists(current):
+                        missing += 1
+                        self.stderr.write(f"Blob missing for file {file.pk}: {current}")
+                        continue
+                    os.makedirs(os.path.dirname(storage.path(target)), exist_ok=True)
+                    os.replace(storage.path(current), storage.path(target))
+                elif storage.exists(current):
+                    # Moved on a previous run that stopped before the row was updated
+                    storage.delete(current)
+
+                file.file.name = target
+                updated.append(file)
+
+            with transaction.atomic():
+                File.objects.bulk_update(updated, ["file"])
+            moved += len(updated)
+            self.stdout.write(f"{verb} {moved} blobs so far ({skipped} already migrated)")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"{verb} {moved} blobs, {skipped} already migrated, {missing} missing")
+        )
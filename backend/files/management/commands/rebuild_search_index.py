@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from files.search import search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the filename search index from the entries table"
+
+    def handle(self, *args, **options):
+        indexed = search_backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} entries"))
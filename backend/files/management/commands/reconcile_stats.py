@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from files.models import StorageStats
+
+
+class Command(BaseCommand):
+    help = "Recompute the storage savings counters from the files, entries and chunks tables"
+
+    def handle(self, *args, **options):
+        stats = StorageStats.recompute()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{stats.total_files} files, {stats.total_entries} entries, {stats.total_chunks} chunks"
+            )
+        )
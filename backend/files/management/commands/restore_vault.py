@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+from files.backup import BackupError, VaultRestore
+from files.models import File
+
+
+class Command(BaseCommand):
+    help = (
+        "Restore the database and blobs from a backup directory, then re-hash every restored file in parallel "
+        "and record whether it matches its hash"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", help="Backup directory written by backup_vault")
+        parser.add_argument("--snapshot", help="Snapshot to restore, the latest completed one by default")
+        parser.add_argument(
+            "--workers", type=int, default=settings.FILES_BACKUP_WORKERS, help="Blobs copied and re-hashed at once"
+        )
+        parser.add_argument("--force", action="store_true", help="Overwrite a database that already holds files")
+        parser.add_argument("--no-verify", action="store_true", help="Skip re-hashing the restored blobs")
+
+    def handle(self, *args, **options):
+        try:
+            in_use = File.objects.exists()
+        except DatabaseError:
+            # Not migrated yet
+            in_use = False
+        if in_use and not options["force"]:
+            raise CommandError("The database already holds files, pass --force to replace it")
+
+        restore = VaultRestore(
+            options["source"], snapshot=options["snapshot"], workers=options["workers"], log=self.stderr.write
+        )
+        try:
+            snapshot, blobs, scrubber = restore.run(verify=not options["no_verify"])
+        except BackupError as error:
+            raise CommandError(error)
+
+        self.stdout.write(f"Restored snapshot {snapshot}: {blobs.copied} of {blobs.checked} blobs copied")
+        if options["no_verify"]:
+            return
+        failed = {integrity: count for integrity, count in scrubber.counts.items() if count and integrity != File.Integrity.OK}
+        if failed or blobs.missing:
+            counts = ", ".join(f"{count} {integrity}" for integrity, count in failed.items())
+            raise CommandError(f"Restored files failed verification: {counts or f'{len(blobs.missing)} blobs missing'}")
+        self.stdout.write(self.style.SUCCESS(f"Verified {scrubber.counts[File.Integrity.OK]} files, all ok"))
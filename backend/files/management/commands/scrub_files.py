@@ -0,0 +1,52 @@
+import signal
+import time
+
+from common.utils import format_bytes
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from files.scrub import Scrubber
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-hash stored blobs and record whether they still match their hash, never verified files "
+        "first; stops after the files being hashed on SIGINT or SIGTERM and resumes where it stopped"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=settings.FILES_SCRUB_WORKERS, help="Blobs hashed at once")
+        parser.add_argument(
+            "--max-rate", type=int, default=settings.FILES_SCRUB_MAX_RATE,
+            help="Bytes read per second by all workers together, 0 for no limit",
+        )
+        parser.add_argument(
+            "--max-age", type=int, default=settings.FILES_SCRUB_MAX_AGE,
+            help="Verify again files last verified more than this many seconds ago",
+        )
+        parser.add_argument("--limit", type=int, help="Stop after this many files")
+        parser.add_argument("--interval", type=int, help="Keep running, looking for due files every this many seconds")
+
+    def handle(self, *args, **options):
+        scrubber = Scrubber(
+            workers=options["workers"],
+            max_rate=options["max_rate"],
+            max_age=options["max_age"],
+            log=self.stderr.write,
+        )
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: scrubber.stop())
+
+        started = time.monotonic()
+        while True:
+            scrubber.run(limit=options["limit"])
+            if not options["interval"] or options["limit"] or scrubber.stopping.wait(options["interval"]):
+                break
+
+        counts = ", ".join(f"{count} {integrity}" for integrity, count in scrubber.counts.items() if count)
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Verified {sum(scrubber.counts.values())} files ({format_bytes(scrubber.bytes)}) "
+                f"in {elapsed:.0f}s: {counts or 'nothing due'}"
+            )
+        )
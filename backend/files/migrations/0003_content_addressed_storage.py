@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:40
+
+from django.db import migrations, models
+import files.models
+import files.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0002_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='file',
+            name='file',
+            field=models.FileField(storage=files.storage.get_blob_storage, upload_to=files.models.file_upload_path),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0004_chunk_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='referenced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:44
+
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+
+
+def seed_storage_stats(apps, schema_editor):
+    File = apps.get_model("files", "File")
+    Chunk = apps.get_model("files", "Chunk")
+    StorageStats = apps.get_model("files", "StorageStats")
+
+    files = File.objects.annotate(reference_count=Count("entries")).aggregate(
+        actual_space=Sum("size"),
+        would_be_space=Sum(F("size") * F("reference_count")),
+        total_files=Count("id"),
+        total_entries=Sum("reference_count"),
+    )
+    chunks = Chunk.objects.aggregate(
+        chunk_stored_space=Sum("size"),
+        chunk_referenced_space=Sum(F("size") * F("ref_count")),
+        total_chunks=Count("id"),
+    )
+    totals = {field: value or 0 for field, value in {**files, **chunks}.items()}
+    StorageStats.objects.update_or_create(pk=1, defaults=totals)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0005_file_referenced_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('actual_space', models.BigIntegerField(default=0)),
+                ('would_be_space', models.BigIntegerField(default=0)),
+                ('total_files', models.BigIntegerField(default=0)),
+                ('total_entries', models.BigIntegerField(default=0)),
+                ('chunk_stored_space', models.BigIntegerField(default=0)),
+                ('chunk_referenced_space', models.BigIntegerField(default=0)),
+                ('total_chunks', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_storage_stats, migrations.RunPython.noop),
+    ]
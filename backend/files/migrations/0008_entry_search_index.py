@@ -0,0 +1,12 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # The filename search index is not a migration: files.search creates it,
+    # and its triggers, after every migrate run (install_search_index)
+
+    dependencies = [
+        ('files', '0007_entry_keyset_index'),
+    ]
+
+    operations = []
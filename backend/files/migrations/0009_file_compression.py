@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:59
+
+from django.db import migrations, models
+from django.db.models import F
+import files.models
+import files.storage
+
+
+def seed_stored_sizes(apps, schema_editor):
+    # Blobs written so far are raw, they take exactly their size on disk
+    File = apps.get_model("files", "File")
+    StorageStats = apps.get_model("files", "StorageStats")
+    File.objects.update(stored_size=F("size"))
+    StorageStats.objects.update(stored_space=F("actual_space"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0008_entry_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='codec',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='stored_size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='storagestats',
+            name='stored_space',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='file',
+            field=files.models.BlobField(storage=files.storage.get_blob_storage, upload_to=files.models.file_upload_path),
+        ),
+        migrations.RunPython(seed_stored_sizes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:06
+
+import mimetypes
+
+from django.db import migrations, models
+
+# Frozen here rather than imported from files.detection, which keeps changing
+CATEGORY_TYPES = {
+    "application/pdf": "document",
+    "application/msword": "document",
+    "application/rtf": "document",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": "document",
+    "text/csv": "spreadsheet",
+    "application/vnd.ms-excel": "spreadsheet",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": "spreadsheet",
+    "application/vnd.ms-powerpoint": "presentation",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation": "presentation",
+    "application/zip": "archive",
+    "application/gzip": "archive",
+    "application/x-tar": "archive",
+    "application/x-7z-compressed": "archive",
+    "application/vnd.rar": "archive",
+    "application/json": "code",
+    "application/xml": "code",
+    "text/html": "code",
+    "text/css": "code",
+    "text/javascript": "code",
+    "application/x-executable": "executable",
+    "application/x-msdownload": "executable",
+}
+PREFIX_CATEGORIES = {"image": "image", "video": "video", "audio": "audio", "font": "font", "text": "text"}
+
+
+def guess_type(filename, declared):
+    mime = (declared or "").split(";")[0].strip().lower()
+    if "/" not in mime:
+        mime = (mimetypes.guess_type(filename, strict=False)[0] or "application/octet-stream").lower()
+    return mime, CATEGORY_TYPES.get(mime) or PREFIX_CATEGORIES.get(mime.split("/")[0], "other")
+
+
+def seed_types(apps, schema_editor):
+    # Guessed from the declared type and the filename only, reading every blob
+    # here would stall the migration, python manage.py detect_file_types
+    # re-detects them from their content afterwards
+    File = apps.get_model("files", "File")
+    batch = []
+    for file in File.objects.only("pk", "original_filename", "file_type").iterator(chunk_size=1000):
+        file.mime_type, file.category = guess_type(file.original_filename, file.file_type)
+        batch.append(file)
+        if len(batch) == 1000:
+            File.objects.bulk_update(batch, ["mime_type", "category"])
+            batch = []
+    File.objects.bulk_update(batch, ["mime_type", "category"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0009_file_compression'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='category',
+            field=models.CharField(choices=[('image', 'image'), ('video', 'video'), ('audio', 'audio'), ('document', 'document'), ('spreadsheet', 'spreadsheet'), ('presentation', 'presentation'), ('archive', 'archive'), ('text', 'text'), ('code', 'code'), ('font', 'font'), ('executable', 'executable'), ('other', 'other')], default='other', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='mime_type',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['mime_type', 'created_at'], name='files_file_mime_ty_c57df8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['category', 'mime_type', 'size'], name='files_file_categor_88fe3d_idx'),
+        ),
+        migrations.RunPython(seed_types, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:08
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+import files.models
+
+
+def copy_file_attributes(apps, schema_editor):
+    Entry = apps.get_model("files", "Entry")
+    File = apps.get_model("files", "File")
+    file = File.objects.filter(pk=OuterRef("file_id"))
+    Entry.objects.update(
+        size=Subquery(file.values("size")[:1]),
+        mime_type=Subquery(file.values("mime_type")[:1]),
+        category=Subquery(file.values("category")[:1]),
+        uploaded_at=Subquery(file.values("created_at")[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0010_file_type_detection'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entry',
+            name='category',
+            field=models.CharField(choices=[('image', 'image'), ('video', 'video'), ('audio', 'audio'), ('document', 'document'), ('spreadsheet', 'spreadsheet'), ('presentation', 'presentation'), ('archive', 'archive'), ('text', 'text'), ('code', 'code'), ('font', 'font'), ('executable', 'executable'), ('other', 'other')], default='other', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='entry',
+            name='mime_type',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='entry',
+            name='size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='entry',
+            name='uploaded_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='entry',
+            name='file',
+            field=files.models.FileForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='files.file'),
+        ),
+        migrations.AddIndex(
+            model_name='entry',
+            index=models.Index(fields=['mime_type', 'created_at', 'id'], name='files_entry_mime_ty_487cce_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='entry',
+            index=models.Index(fields=['category', 'created_at', 'id'], name='files_entry_categor_2cb941_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='entry',
+            index=models.Index(fields=['name', 'created_at', 'id'], name='files_entry_name_23674f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='entry',
+            index=models.Index(fields=['size', 'created_at'], name='files_entry_size_0853be_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='entry',
+            index=models.Index(fields=['uploaded_at', 'created_at'], name='files_entry_uploade_d79e85_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='entry',
+            index=models.Index(fields=['category', 'mime_type', 'size'], name='files_entry_categor_d031c0_idx'),
+        ),
+        migrations.RunPython(copy_file_attributes, migrations.RunPython.noop),
+    ]
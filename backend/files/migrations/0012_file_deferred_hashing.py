@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0011_entry_file_attributes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='hash_type',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='hash_value',
+            field=models.CharField(max_length=150, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['size', 'fingerprint'], name='files_file_size_4060fe_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0012_file_deferred_hashing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='integrity',
+            field=models.CharField(choices=[('unverified', 'Unverified'), ('ok', 'Ok'), ('corrupt', 'Corrupt'), ('missing', 'Missing')], default='unverified', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='last_verified_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['last_verified_at', 'id'], name='files_file_last_ve_baa56b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['integrity', 'last_verified_at'], name='files_file_integri_22f5eb_idx'),
+        ),
+    ]
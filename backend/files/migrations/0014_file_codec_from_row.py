@@ -0,0 +1,36 @@
+import re
+
+from django.db import migrations
+
+# Unhashed blobs used to be named "uploads/<uuid>.<uploaded extension>", the
+# storage appends its codec suffix after that. A single extension is the
+# uploader's: such a blob is raw whatever the extension (e.g. "logs.gz").
+UPLOADED_EXTENSION = re.compile(r"^uploads/[0-9a-f-]{36}\.[^./]+$")
+
+
+def reset_misread_codecs(apps, schema_editor):
+    File = apps.get_model("files", "File")
+    Job = apps.get_model("jobs", "Job")
+    misread = [
+        file
+        for file in File.objects.exclude(codec="").only("pk", "file", "hash_value").iterator()
+        if UPLOADED_EXTENSION.match(file.file.name)
+    ]
+    for file in misread:
+        # The hash was taken of the decoded bytes, the job hashes the blob again
+        File.objects.filter(pk=file.pk).update(
+            codec="", hash_value=None, hash_type="", integrity="unverified", last_verified_at=None
+        )
+    Job.objects.bulk_create(Job(name="files.hash_blob", payload={"file_id": str(file.pk)}) for file in misread)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0013_file_integrity'),
+        ('jobs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(reset_misread_codecs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0014_file_codec_from_row'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storagestats',
+            name='catalog_version',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
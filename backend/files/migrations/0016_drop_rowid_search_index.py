@@ -0,0 +1,30 @@
+from django.db import migrations
+
+# The index created by migration 0008 was keyed on files_entry's implicit
+# rowid, which table rebuilds renumber. Its replacement is created after
+# migrate by files.search.install_search_index.
+DROP_SEARCH_INDEX = [
+    "DROP TRIGGER IF EXISTS files_file_search_update",
+    "DROP TRIGGER IF EXISTS files_entry_search_update",
+    "DROP TRIGGER IF EXISTS files_entry_search_delete",
+    "DROP TRIGGER IF EXISTS files_entry_search_insert",
+    "DROP TABLE IF EXISTS files_entry_search",
+]
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for statement in DROP_SEARCH_INDEX:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0015_storagestats_catalog_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_search_index, migrations.RunPython.noop),
+    ]
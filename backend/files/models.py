@@ -1,14 +1,66 @@
 import uuid
 import os
-from django.db import models
+import time
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models.fields.files import FieldFile
+from django.db.models import Count, F, Sum, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
 from common.models import BaseModel, BaseImmutableModel
+from files.detection import SNIFF_SIZE, Category, detect_type
+from files.storage import blob_path, get_blob_storage
 
 
 def file_upload_path(instance, filename):
-    """Generate file path for new file upload"""
-    ext = filename.split(".")[-1]
-    filename = f"{uuid.uuid4()}.{ext}"
-    return os.path.join("uploads", filename)
+    """Generate file path for new file upload, blobs are addressed by their hash"""
+    if instance.hash_value:
+        return blob_path(instance.hash_value)
+    # No extension: the storage appends a codec suffix to compressed blobs,
+    # an uploaded "logs.gz" must not pass for one
+    return os.path.join("uploads", str(uuid.uuid4()))
+
+
+class BlobFieldFile(FieldFile):
+    """A blob opened through ``File.file`` is decoded with the codec recorded on the row"""
+
+    def _get_file(self):
+        self._require_file()
+        if getattr(self, "_file", None) is None:
+            self._file = self.storage.open_blob(self.name, self.instance.codec)
+        return self._file
+
+    file = property(_get_file, FieldFile._set_file, FieldFile._del_file)
+
+    def open(self, mode="rb"):
+        self._require_file()
+        if getattr(self, "_file", None) is None:
+            self.file = self.storage.open_blob(self.name, self.instance.codec)
+        else:
+            self.file.open(mode)
+        return self
+
+
+class BlobField(models.FileField):
+    """
+    ``FileField`` that records how the storage keeps a new blob, see
+    ``File.codec``, and what the blob holds, see ``File.mime_type``
+    """
+
+    attr_class = BlobFieldFile
+
+    def pre_save(self, model_instance, add):
+        file = super().pre_save(model_instance, add)
+        # Runs for bulk_create too, and before the columns declared after it are read
+        if add and file:
+            model_instance.codec, model_instance.stored_size = file.storage.describe(file.name)
+            if not model_instance.mime_type:
+                with file.storage.open_blob(file.name, model_instance.codec) as blob:
+                    head = blob.read(SNIFF_SIZE)
+                model_instance.mime_type, model_instance.category = detect_type(
+                    head, model_instance.original_filename, model_instance.file_type
+                )
+        return file
 
 
 # class File(models.Model):
@@ -40,12 +92,37 @@ def file_upload_path(instance, filename):
 
 # This is better
 class File(BaseImmutableModel):
-    file = models.FileField(upload_to=file_upload_path)
+    class Integrity(models.TextChoices):
+        UNVERIFIED = "unverified"
+        OK = "ok"
+        CORRUPT = "corrupt"
+        MISSING = "missing"
+
+    file = BlobField(upload_to=file_upload_path, storage=get_blob_storage)
     original_filename = models.CharField(max_length=255)
     file_type = models.CharField(max_length=100)
     size = models.BigIntegerField()
-    hash_value = models.CharField(max_length=150, unique=True)
-    hash_type = models.CharField(max_length=50)
+    # Null (and hash_type empty) until the background job hashed a file
+    # stored with deferred hashing, see files.dedup
+    hash_value = models.CharField(max_length=150, unique=True, null=True)
+    hash_type = models.CharField(max_length=50, blank=True)
+    # Size and sampled content, see files.hashing.fingerprint ("" for files
+    # stored before fingerprints were taken)
+    fingerprint = models.CharField(max_length=32, blank=True, default="")
+    # Last time a deduplicated upload reused this file, see files.gc
+    referenced_at = models.DateTimeField(null=True, blank=True)
+    # Compression of the blob at rest ("" for raw) and its size on disk
+    codec = models.CharField(max_length=10, blank=True, default="")
+    stored_size = models.BigIntegerField(default=0)
+    # Type detected from the content, in canonical lower case (file_type is
+    # whatever the client declared), and the broad kind of file it is
+    mime_type = models.CharField(max_length=100, blank=True, default="")
+    category = models.CharField(
+        max_length=20, choices=[(value, value) for value in Category.choices], default=Category.OTHER
+    )
+    # Outcome of the last time the blob was re-hashed, see files.scrub
+    integrity = models.CharField(max_length=20, choices=Integrity.choices, default=Integrity.UNVERIFIED)
+    last_verified_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ["-created_at"]
@@ -58,19 +135,223 @@ class File(BaseImmutableModel):
             # Composite indexes for common filter combinations
             models.Index(fields=["file_type", "created_at"]),  # Very common combo
             models.Index(fields=["size", "created_at"]),  # Size + date filtering
+            models.Index(fields=["size", "fingerprint"]),  # Dedup candidates
+            # Type filters and facets, exact matches on canonical values
+            models.Index(fields=["mime_type", "created_at"]),
+            models.Index(fields=["category", "mime_type", "size"]),
+            # Scrubbing order (never verified first) and the integrity summary
+            models.Index(fields=["last_verified_at", "id"]),
+            models.Index(fields=["integrity", "last_verified_at"]),
         ]
 
     def __str__(self):
         return self.original_filename
 
+    def touch(self):
+        """Claim the file for a new entry, False if it was garbage collected meanwhile"""
+        return File.objects.filter(pk=self.pk).update(referenced_at=timezone.now()) == 1
+
+
+class Chunk(BaseImmutableModel):
+    """A unique piece of content stored once by the chunked blob storage"""
+
+    hash_value = models.CharField(max_length=150, unique=True)
+    size = models.IntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.hash_value
+
+
+class FileForeignKey(models.ForeignKey):
+    """``ForeignKey`` to ``File`` that copies the file's filterable attributes onto a new entry"""
+
+    def pre_save(self, model_instance, add):
+        # Runs for bulk_create too, and before the columns declared after it are read
+        if add:
+            file = getattr(model_instance, self.name)
+            for field in Entry.FILE_ATTRIBUTES:
+                setattr(model_instance, Entry.FILE_ATTRIBUTES[field], getattr(file, field))
+        return super().pre_save(model_instance, add)
+
 
 class Entry(BaseModel):
+    # Entry columns holding a copy of these File columns, files never change
+    # after upload (bar re-detection of their type, which updates both)
+    FILE_ATTRIBUTES = {
+        "size": "size",
+        "mime_type": "mime_type",
+        "category": "category",
+        "created_at": "uploaded_at",
+    }
+
     name = models.CharField(max_length=255, blank=True)
     # description = models.TextField(blank=True)
-    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name="entries")
+    file = FileForeignKey(File, on_delete=models.CASCADE, related_name="entries")
+    # Copies of the file's attributes, so the list filters and its ordering
+    # are served by indexes of this table without joining files
+    size = models.BigIntegerField(default=0)
+    mime_type = models.CharField(max_length=100, blank=True, default="")
+    category = models.CharField(
+        max_length=20, choices=[(value, value) for value in Category.choices], default=Category.OTHER
+    )
+    uploaded_at = models.DateTimeField(null=True)
 
     class Meta:
         ordering = ["-created_at"]
-        
+        indexes = [
+            # Keyset pagination of the files list
+            models.Index(fields=["created_at", "id"]),
+            # Equality filters followed by the list ordering
+            models.Index(fields=["mime_type", "created_at", "id"]),
+            models.Index(fields=["category", "created_at", "id"]),
+            models.Index(fields=["name", "created_at", "id"]),
+            # Range filters
+            models.Index(fields=["size", "created_at"]),
+            models.Index(fields=["uploaded_at", "created_at"]),
+            # Facets of the filter sidebar, read from the index alone
+            models.Index(fields=["category", "mime_type", "size"]),
+        ]
+
     def __str__(self):
         return self.name
+
+
+def next_catalog_version():
+    # Never behind the clock, so a recreated or restored row never hands out
+    # a version (and ETag) clients may still hold
+    return Greatest(F("catalog_version") + 1, Value(time.time_ns()))
+
+
+class StorageStats(models.Model):
+    """
+    Running storage totals behind ``FileSavingsAPIView``. A single row that is
+    adjusted in the same transaction as every change it accounts for, so the
+    stats endpoint is one primary-key read however big the catalog grows.
+    """
+
+    SINGLETON_ID = 1
+
+    actual_space = models.BigIntegerField(default=0)
+    would_be_space = models.BigIntegerField(default=0)
+    total_files = models.BigIntegerField(default=0)
+    total_entries = models.BigIntegerField(default=0)
+    chunk_stored_space = models.BigIntegerField(default=0)
+    chunk_referenced_space = models.BigIntegerField(default=0)
+    total_chunks = models.BigIntegerField(default=0)
+    # Bytes the unique files take on disk after compression at rest
+    stored_space = models.BigIntegerField(default=0)
+    # Version of the catalog cached responses belong to, moved on in the same
+    # transaction as every change so all processes see it, see files.cache
+    catalog_version = models.BigIntegerField(default=0)
+
+    @classmethod
+    def load(cls):
+        stats = cls.objects.filter(pk=cls.SINGLETON_ID).first()
+        return stats or cls.recompute()
+
+    @classmethod
+    def record(cls, **deltas):
+        """Add ``deltas`` to the counters, e.g. ``record(total_entries=1, would_be_space=size)``"""
+        changes = {field: F(field) + delta for field, delta in deltas.items() if delta}
+        if not changes:
+            return
+        # Cached list and stats responses are stale once this commits
+        if not cls.objects.filter(pk=cls.SINGLETON_ID).update(**changes, catalog_version=next_catalog_version()):
+            cls.recompute()
+
+    @classmethod
+    def bump(cls):
+        """Move the catalog version on for a change the counters do not see, in the caller's transaction"""
+        if not cls.objects.filter(pk=cls.SINGLETON_ID).update(catalog_version=next_catalog_version()):
+            cls.recompute()
+
+    @classmethod
+    def current_version(cls):
+        version = cls.objects.filter(pk=cls.SINGLETON_ID).values_list("catalog_version", flat=True).first()
+        return version if version is not None else cls.recompute().catalog_version
+
+    @classmethod
+    def recompute(cls):
+        """Rebuild the counters from the catalog itself"""
+        files = File.objects.annotate(reference_count=Count("entries")).aggregate(
+            actual_space=Sum("size"),
+            would_be_space=Sum(F("size") * F("reference_count")),
+            total_files=Count("id"),
+            total_entries=Sum("reference_count"),
+            stored_space=Sum("stored_size"),
+        )
+        chunks = Chunk.objects.aggregate(
+            chunk_stored_space=Sum("size"),
+            chunk_referenced_space=Sum(F("size") * F("ref_count")),
+            total_chunks=Count("id"),
+        )
+        totals = {field: value or 0 for field, value in {**files, **chunks}.items()}
+        stats, _ = cls.objects.update_or_create(pk=cls.SINGLETON_ID, defaults=totals)
+        cls.objects.filter(pk=cls.SINGLETON_ID).update(catalog_version=next_catalog_version())
+        stats.refresh_from_db(fields=["catalog_version"])
+        return stats
+
+
+class UploadSession(BaseModel):
+    """
+    A resumable upload, chunks are written straight into a preallocated part
+    file at their offset so they can arrive in any order or in parallel.
+    """
+
+    class Status(models.TextChoices):
+        OPEN = "open"
+        FINALIZING = "finalizing"
+        COMPLETE = "complete"
+
+    name = models.CharField(max_length=255, blank=True)
+    original_filename = models.CharField(max_length=255)
+    file_type = models.CharField(max_length=100)
+    size = models.BigIntegerField()
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.OPEN)
+    entry = models.ForeignKey(
+        Entry, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return self.original_filename
+
+    @property
+    def part_path(self):
+        return os.path.join(settings.FILE_UPLOAD_SESSION_ROOT, f"{self.id}.part")
+
+    def received_ranges(self):
+        """Merge the stored chunks into sorted, non-overlapping [start, end) ranges"""
+        ranges = []
+        for offset, size in self.chunks.order_by("offset").values_list("offset", "size"):
+            end = offset + size
+            if ranges and offset <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges.append([offset, end])
+        return ranges
+
+    def missing_ranges(self):
+        missing = []
+        position = 0
+        for start, end in self.received_ranges():
+            if start > position:
+                missing.append([position, start])
+            position = max(position, end)
+        if position < self.size:
+            missing.append([position, self.size])
+        return missing
+
+
+class UploadChunk(BaseImmutableModel):
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name="chunks")
+    offset = models.BigIntegerField()
+    size = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["session", "offset"], name="unique_session_chunk_offset"),
+        ]
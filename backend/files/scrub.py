@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+from files.compression import DECODE_ERRORS
+from files.hashing import ALGORITHMS, new_hasher
+from files.models import File
+
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+class RateLimiter:
+    """
+    Byte budget shared by threads. ``consume`` books the bytes right away and
+    sleeps off whatever exceeds the budget, so readers together never go
+    faster than ``rate`` bytes per second averaged over a second.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate) - amount
+            self.updated = now
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+
+def read_blob(blob, limiter=None, block_size=READ_BLOCK_SIZE):
+    """
+    Yield the content of a stored blob block by block. Raw blobs are read
+    straight from disk and dropped from the page cache afterwards, so a
+    scrub does not evict what downloads are serving.
+    """
+    storage, codec = blob.storage, blob.instance.codec
+    advise = storage.is_raw(codec) and hasattr(os, "posix_fadvise")
+    fileobj = open(storage.path(blob.name), "rb") if advise else storage.open_blob(blob.name, codec)
+    with fileobj:
+        if advise:
+            os.posix_fadvise(fileobj.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while block := fileobj.read(block_size):
+            if limiter:
+                limiter.consume(len(block))
+            yield block
+        if advise:
+            os.posix_fadvise(fileobj.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def verify_file(file, limiter=None):
+    """Re-hash the blob of ``file``, returns its ``File.Integrity``"""
+    hasher = new_hasher(file.hash_type)
+    try:
+        for block in read_blob(file.file, limiter):
+            hasher.update(block)
+    except FileNotFoundError:
+        return File.Integrity.MISSING
+    except (*DECODE_ERRORS, ValueError):
+        # A compressed or chunked blob too damaged to be decoded
+        return File.Integrity.CORRUPT
+    return File.Integrity.OK if hasher.hexdigest() == file.hash_value else File.Integrity.CORRUPT
+
+
+def record(file, integrity):
+    File.objects.filter(pk=file.pk).update(integrity=integrity, last_verified_at=timezone.now())
+
+
+class Scrubber:
+    """
+    Re-hashes stored blobs on ``workers`` threads within a shared budget of
+    ``max_rate`` bytes per second. Files never verified go first, then the
+    ones verified longest ago, up to those verified within ``max_age``
+    seconds. The outcome is recorded on every file as soon as it is known,
+    so that is the checkpoint: a restarted scrubber picks up where the last
+    one stopped, only the files it was in the middle of are hashed again.
+    """
+
+    def __init__(self, workers=2, max_rate=None, max_age=30 * 24 * 3600, log=print):
+        self.workers = workers
+        self.limiter = RateLimiter(max_rate) if max_rate else None
+        self.max_age = max_age
+        self.log = log
+        self.stopping = threading.Event()
+        self.counts = {integrity: 0 for integrity in File.Integrity.values}
+        self.bytes = 0
+
+    def stop(self):
+        """Stop picking files, the ones being hashed are finished first"""
+        self.stopping.set()
+
+    def due(self, now=None):
+        cutoff = (now or timezone.now()) - timedelta(seconds=self.max_age)
+        return (
+            # Files waiting for their hash, or hashed with an algorithm no longer installed, are skipped
+            File.objects.filter(hash_value__isnull=False, hash_type__in=list(ALGORITHMS))
+            .filter(Q(last_verified_at__isnull=True) | Q(last_verified_at__lt=cutoff))
+            .order_by(F("last_verified_at").asc(nulls_first=True), "pk")
+            .only("pk", "file", "codec", "size", "hash_value", "hash_type")
+        )
+
+    def check(self, file):
+        close_old_connections()
+        try:
+            integrity = verify_file(file, self.limiter)
+            record(file, integrity)
+            return integrity
+        finally:
+            close_old_connections()
+
+    def collect(self, done, running):
+        for future in done:
+            file = running.pop(future)
+            integrity = future.result()
+            self.counts[integrity] += 1
+            self.bytes += file.size
+            if integrity != File.Integrity.OK:
+                self.log(f"Blob {integrity} for file {file.pk}: {file.file.name}")
+
+    def run(self, limit=None):
+        """Verify due files until none is left, ``limit`` were checked or stopped, returns how many"""
+        checked = 0
+        running = {}
+        # Files verified during this run are not due again before it ends
+        started = timezone.now()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scrub") as executor:
+            while not self.stopping.is_set():
+                # A couple of files queued per thread, the rest is picked
+                # again later since finished files drop out of the due ones
+                wanted = self.workers * 2 - len(running)
+                if limit is not None:
+                    wanted = min(wanted, limit - checked)
+                if wanted > 0:
+                    in_flight = [file.pk for file in running.values()]
+                    for file in self.due(started).exclude(pk__in=in_flight)[:wanted]:
+                        running[executor.submit(self.check, file)] = file
+                        checked += 1
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                self.collect(done, running)
+
+            done, _ = wait(running)
+            self.collect(done, running)
+        return checked
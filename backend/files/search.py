@@ -0,0 +1,187 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+
+SEARCH_TABLE = "files_entry_fts"
+SEARCH_KEY_TABLE = "files_entry_fts_key"
+
+# The FTS5 index is keyed on the INTEGER PRIMARY KEY of a key table holding
+# the entry id: entries have a UUID primary key, and SQLite keeps the
+# implicit rowid of such a table neither across VACUUM nor across the table
+# rebuilds migrations do. Triggers keep both tables in sync with files_entry
+# and files_file. SQLite cannot rebuild a table other triggers refer to, so
+# the triggers are dropped before every migrate run and created again after
+# it, with what changed in between indexed then; no migration has to care.
+SEARCH_SCHEMA = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {SEARCH_KEY_TABLE} (
+        id INTEGER PRIMARY KEY,
+        entry_id char(32) NOT NULL UNIQUE
+    )
+    """,
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE}
+    USING fts5(name, original_filename, file_type, tokenize = 'trigram')
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS files_entry_fts_insert AFTER INSERT ON files_entry BEGIN
+        INSERT INTO {SEARCH_KEY_TABLE} (entry_id) VALUES (new.id);
+        INSERT INTO {SEARCH_TABLE} (rowid, name, original_filename, file_type)
+        SELECT k.id, new.name, f.original_filename, f.file_type
+        FROM {SEARCH_KEY_TABLE} k, files_file f WHERE k.entry_id = new.id AND f.id = new.file_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS files_entry_fts_delete AFTER DELETE ON files_entry BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = (SELECT id FROM {SEARCH_KEY_TABLE} WHERE entry_id = old.id);
+        DELETE FROM {SEARCH_KEY_TABLE} WHERE entry_id = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS files_entry_fts_update AFTER UPDATE OF name, file_id ON files_entry BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = (SELECT id FROM {SEARCH_KEY_TABLE} WHERE entry_id = new.id);
+        INSERT INTO {SEARCH_TABLE} (rowid, name, original_filename, file_type)
+        SELECT k.id, new.name, f.original_filename, f.file_type
+        FROM {SEARCH_KEY_TABLE} k, files_file f WHERE k.entry_id = new.id AND f.id = new.file_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS files_file_fts_update AFTER UPDATE OF original_filename, file_type ON files_file BEGIN
+        UPDATE {SEARCH_TABLE}
+        SET original_filename = new.original_filename, file_type = new.file_type
+        WHERE rowid IN (
+            SELECT k.id FROM {SEARCH_KEY_TABLE} k JOIN files_entry e ON e.id = k.entry_id WHERE e.file_id = new.id
+        );
+    END
+    """,
+]
+
+# Brings the index in line with files_entry: changes made while the
+# triggers were missing, or a full rebuild once both tables are emptied
+SEARCH_CATCH_UP = [
+    f"""
+    DELETE FROM {SEARCH_TABLE} WHERE rowid IN (
+        SELECT id FROM {SEARCH_KEY_TABLE} WHERE entry_id NOT IN (SELECT id FROM files_entry)
+    )
+    """,
+    f"DELETE FROM {SEARCH_KEY_TABLE} WHERE entry_id NOT IN (SELECT id FROM files_entry)",
+    f"""
+    INSERT INTO {SEARCH_KEY_TABLE} (entry_id)
+    SELECT id FROM files_entry WHERE id NOT IN (SELECT entry_id FROM {SEARCH_KEY_TABLE})
+    """,
+    f"""
+    INSERT INTO {SEARCH_TABLE} (rowid, name, original_filename, file_type)
+    SELECT k.id, e.name, f.original_filename, f.file_type
+    FROM {SEARCH_KEY_TABLE} k JOIN files_entry e ON e.id = k.entry_id JOIN files_file f ON f.id = e.file_id
+    WHERE k.id NOT IN (SELECT rowid FROM {SEARCH_TABLE})
+    """,
+]
+
+
+SEARCH_TRIGGERS = ["files_entry_fts_insert", "files_entry_fts_delete", "files_entry_fts_update", "files_file_fts_update"]
+
+
+def drop_search_triggers(using=DEFAULT_DB_ALIAS, **kwargs):
+    """Connected to ``pre_migrate``, the index tables and their rows are kept"""
+    db = connections[using]
+    if db.vendor != "sqlite":
+        return
+    with db.cursor() as cursor:
+        for trigger in SEARCH_TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+
+def install_search_index(using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Create the search index and its triggers where missing, then index what
+    changed without them. Connected to ``post_migrate``.
+    """
+    db = connections[using]
+    # FTS5 is SQLite only, other databases use the LIKE search backend
+    if db.vendor != "sqlite" or not {"files_entry", "files_file"} <= set(db.introspection.table_names()):
+        return
+    with transaction.atomic(using=using), db.cursor() as cursor:
+        for statement in SEARCH_SCHEMA + SEARCH_CATCH_UP:
+            cursor.execute(statement)
+
+
+# Searchable columns and the Entry lookups they correspond to
+SEARCH_FIELDS = {
+    "name": "name",
+    "original_filename": "file__original_filename",
+    "file_type": "file__file_type",
+}
+
+
+class ContainsSearchBackend:
+    """Case-insensitive substring search with LIKE, works on every database but scans"""
+
+    def search(self, queryset, term, fields, ranked=False):
+        condition = Q()
+        for field in fields:
+            condition |= Q(**{f"{SEARCH_FIELDS[field]}__icontains": term})
+        return queryset.filter(condition)
+
+    def rebuild(self):
+        return 0
+
+
+class FTS5SearchBackend(ContainsSearchBackend):
+    """
+    Substring search through an SQLite FTS5 table with the trigram tokenizer,
+    kept in sync with ``files_entry`` and ``files_file`` by triggers (see
+    ``SEARCH_SCHEMA``). Lookups are index probes instead of table scans and
+    matches can be ranked with bm25. Terms shorter than a trigram, or other
+    databases, fall back to ``ContainsSearchBackend``.
+    """
+
+    min_term_length = 3
+
+    def match_expression(self, term, fields):
+        phrase = '"' + term.replace('"', '""') + '"'
+        return "{%s} : %s" % (" ".join(fields), phrase)
+
+    def search(self, queryset, term, fields, ranked=False):
+        if connection.vendor != "sqlite" or len(term) < self.min_term_length:
+            return super().search(queryset, term, fields, ranked)
+
+        match = self.match_expression(term, fields)
+        table = queryset.model._meta.db_table
+        # Matched on the primary key rather than the outer table's rowid, so
+        # the filter still holds when the queryset is nested as a subquery
+        queryset = queryset.filter(
+            pk__in=RawSQL(
+                f"SELECT k.entry_id FROM {SEARCH_KEY_TABLE} k WHERE k.id IN "
+                f"(SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s)",
+                [match],
+            )
+        )
+        if ranked:
+            # bm25 scores are negative, lower is a better match
+            queryset = queryset.annotate(
+                search_rank=RawSQL(
+                    f"(SELECT rank FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s AND rowid = "
+                    f"(SELECT id FROM {SEARCH_KEY_TABLE} WHERE entry_id = {table}.id))",
+                    [match],
+                    output_field=FloatField(),
+                )
+            ).order_by("search_rank", "-created_at")
+        return queryset
+
+    def rebuild(self):
+        """Repopulate the index from scratch, returns the number of entries indexed"""
+        install_search_index(connection.alias)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+            cursor.execute(f"DELETE FROM {SEARCH_KEY_TABLE}")
+            for statement in SEARCH_CATCH_UP:
+                cursor.execute(statement)
+            indexed = cursor.rowcount
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+        return indexed
+
+
+search_backend = SimpleLazyObject(lambda: import_string(settings.FILES_SEARCH_BACKEND)())
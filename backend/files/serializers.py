@@ -1,36 +1,24 @@
-import hashlib
+from django.db import transaction
 from rest_framework import serializers
-from files.models import File, Entry
+from files.dedup import get_or_create_file
+from files.models import File, Entry, StorageStats, UploadSession
 from common.exceptions import BadRequestError
 from common.constants import ErrorMessages
+from jobs.queue import enqueue
 
 
 class FileSerializer(serializers.ModelSerializer):
     class Meta:
         model = File
-        fields = ["id", "file", "original_filename", "file_type", "size", "created_at"]
-        read_only_fields = ["id", "hash_value", "hash_type", "created_at"]
+        fields = ["id", "file", "original_filename", "file_type", "mime_type", "category", "size", "created_at"]
+        read_only_fields = ["id", "hash_value", "hash_type", "mime_type", "category", "created_at"]
 
     def create(self, validated_data):
         file = validated_data.get("file")
-        # Hash the file to store the exact info about the file
-        sha256 = hashlib.sha256()
-        for chunk in file.chunks():  # efficient for big files
-            sha256.update(chunk)
-
-        hashed = sha256.hexdigest()
-        # inject the hash value into the validated_data
-        validated_data["hash_value"] = sha256.hexdigest()
-        validated_data["hash_type"] = "sha256"
-
-        existing = File.objects.filter(hash_value=hashed).first()
-        if existing:
-            return existing
-            # existing.upload_count += 1
-            # existing.save()
-            # raise BadRequestError(ErrorMessages.FileAlreadyStored)
-
-        return super().create(validated_data)
+        # Deduplicated by size and fingerprint first, the file is only hashed
+        # here when it is likely a duplicate or hashing is not deferred
+        file, _ = get_or_create_file(file, validated_data)
+        return file
 
 
 class EntrySerializer(serializers.ModelSerializer):
@@ -44,10 +32,126 @@ class EntrySerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         file_data = validated_data.pop("file")
         
-        # Create file using FileSerializer
+        # Create file using FileSerializer, outside the entry's transaction so
+        # the blob write never holds the database lock (the collector leaves
+        # a file that has no entry yet alone, see files.gc)
         file_serializer = FileSerializer(data=file_data)
         file_serializer.is_valid(raise_exception=True)
         file = file_serializer.save()
         
-        entry = Entry.objects.create(file=file, **validated_data)
+        with transaction.atomic():
+            entry = Entry.objects.create(file=file, **validated_data)
+            StorageStats.record(total_entries=1, would_be_space=file.size)
+            # Stored with deferred hashing, only hashed once it has its entry
+            # since a duplicate found by the job hands its entries over
+            if file.hash_value is None:
+                enqueue("files.hash_blob", {"file_id": str(file.pk)})
         return entry
+
+
+class EntryListProjection:
+    """
+    Read-only fast path for listing entries. It renders the exact JSON of
+    ``EntrySerializer(many=True)`` from a ``values()`` query over the joined
+    tables, skipping model instantiation and per-field serializer overhead.
+    """
+
+    fields = [
+        "id",
+        "name",
+        "created_at",
+        "updated_at",
+        "size",
+        "mime_type",
+        "category",
+        "uploaded_at",
+        "file__id",
+        "file__file",
+        "file__original_filename",
+        "file__file_type",
+        "file__mime_type",
+        "file__category",
+        "file__size",
+        "file__created_at",
+    ]
+
+    def __init__(self, request=None):
+        self.request = request
+        self.storage = File._meta.get_field("file").storage
+        self.datetime_field = serializers.DateTimeField()
+
+    def project(self, queryset):
+        return queryset.values(*self.fields)
+
+    def format_datetime(self, value):
+        return self.datetime_field.to_representation(value) if value is not None else None
+
+    def file_url(self, name):
+        if not name:
+            return None
+        url = self.storage.url(name)
+        return self.request.build_absolute_uri(url) if self.request is not None else url
+
+    def represent(self, row):
+        return {
+            "id": str(row["id"]),
+            "file": {
+                "id": str(row["file__id"]),
+                "file": self.file_url(row["file__file"]),
+                "original_filename": row["file__original_filename"],
+                "file_type": row["file__file_type"],
+                "mime_type": row["file__mime_type"],
+                "category": row["file__category"],
+                "size": row["file__size"],
+                "created_at": self.format_datetime(row["file__created_at"]),
+            },
+            "created_at": self.format_datetime(row["created_at"]),
+            "updated_at": self.format_datetime(row["updated_at"]),
+            "name": row["name"],
+            "size": row["size"],
+            "mime_type": row["mime_type"],
+            "category": row["category"],
+            "uploaded_at": self.format_datetime(row["uploaded_at"]),
+        }
+
+    def to_representation(self, rows):
+        return [self.represent(row) for row in rows]
+
+
+class ProbeItemSerializer(serializers.Serializer):
+    sha256 = serializers.RegexField(r"^[0-9a-fA-F]{64}$")
+    size = serializers.IntegerField(min_value=0)
+    name = serializers.CharField(max_length=255, required=False, allow_blank=True)
+
+    def validate_sha256(self, value):
+        return value.lower()
+
+
+class EntrySelectionSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.UUIDField(), required=False, allow_empty=False, max_length=10000)
+    filters = serializers.DictField(required=False, allow_empty=False)
+
+    def validate(self, attrs):
+        # An empty request must never mean "everything"
+        if "ids" not in attrs and "filters" not in attrs:
+            raise serializers.ValidationError("Either ids or filters is required.")
+        return attrs
+
+
+class BatchDeleteSerializer(EntrySelectionSerializer):
+    dry_run = serializers.BooleanField(default=False)
+    batch_size = serializers.IntegerField(min_value=1, max_value=5000, default=1000)
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    file_type = serializers.CharField(max_length=100, required=False, default="application/octet-stream")
+    size = serializers.IntegerField(min_value=1)
+    missing = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = ["id", "name", "original_filename", "file_type", "size", "status", "missing", "entry", "created_at"]
+        read_only_fields = ["id", "status", "missing", "entry", "created_at"]
+
+    def get_missing(self, obj):
+        return obj.missing_ranges()
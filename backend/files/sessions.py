@@ -0,0 +1,182 @@
+import os
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from files.models import UploadChunk, UploadSession
+
+# Bytes copied from the request body to the part file per write
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class AssembledFile(DjangoFile):
+    """
+    The finished part file of an upload session. Exposing
+    ``temporary_file_path`` lets ``FileSystemStorage`` move it into place
+    instead of copying the bytes again.
+    """
+
+    def __init__(self, path, name, content_type):
+        super().__init__(open(path, "rb"), name=name)
+        self.path = path
+        self.content_type = content_type
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def allocate_part(session):
+    """Create the (sparse) part file chunks are written into"""
+    os.makedirs(os.path.dirname(session.part_path), exist_ok=True)
+    with open(session.part_path, "wb") as part:
+        part.truncate(session.size)
+
+
+def write_chunk(session, offset, stream, length):
+    """
+    Copy ``length`` bytes from ``stream`` into the part file at ``offset``.
+    ``pwrite`` never moves a shared file position, so concurrent chunks of the
+    same session can be written by different workers at the same time.
+    """
+    fd = os.open(session.part_path, os.O_WRONLY)
+    try:
+        written = 0
+        while written < length:
+            data = stream.read(min(COPY_BUFFER_SIZE, length - written))
+            if not data:
+                break
+            view = memoryview(data)
+            while view:
+                count = os.pwrite(fd, view, offset + written)
+                view = view[count:]
+                written += count
+        return written
+    finally:
+        os.close(fd)
+
+
+def remove_part(session):
+    try:
+        os.remove(session.part_path)
+    except FileNotFoundError:
+        pass
+
+
+def claim_for_completion(session, timeout=None):
+    """
+    Mark ``session`` as finalizing, returns False when another request holds
+    it. A session left finalizing for ``timeout`` seconds belongs to a request
+    that died midway and is claimed again.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.FILE_UPLOAD_FINALIZE_TIMEOUT if timeout is None else timeout)
+    return bool(
+        UploadSession.objects.filter(
+            Q(status=UploadSession.Status.OPEN)
+            | Q(status=UploadSession.Status.FINALIZING, updated_at__lt=cutoff),
+            pk=session.pk,
+        ).update(status=UploadSession.Status.FINALIZING, updated_at=timezone.now())
+    )
+
+
+class SessionCollector:
+    """
+    Removes upload sessions nobody touched for ``ttl`` seconds together with
+    their part files, and reopens sessions left finalizing for
+    ``finalize_timeout`` seconds by a request that crashed, so the client can
+    complete them again. A chunk written counts as a touch.
+    """
+
+    def __init__(self, ttl=None, finalize_timeout=None, batch_size=500, dry_run=False, log=print):
+        self.ttl = settings.FILE_UPLOAD_SESSION_TTL if ttl is None else ttl
+        self.finalize_timeout = settings.FILE_UPLOAD_FINALIZE_TIMEOUT if finalize_timeout is None else finalize_timeout
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.log = log
+
+    def expired_sessions(self):
+        cutoff = timezone.now() - timedelta(seconds=self.ttl)
+        return UploadSession.objects.filter(
+            Q(updated_at__lt=cutoff) | Q(updated_at__isnull=True, created_at__lt=cutoff),
+            ~Exists(UploadChunk.objects.filter(session=OuterRef("pk"), created_at__gte=cutoff)),
+            status__in=[UploadSession.Status.OPEN, UploadSession.Status.COMPLETE],
+        )
+
+    def stalled_sessions(self):
+        cutoff = timezone.now() - timedelta(seconds=self.finalize_timeout)
+        return UploadSession.objects.filter(status=UploadSession.Status.FINALIZING, updated_at__lt=cutoff)
+
+    def collect_expired(self):
+        """Delete the expired sessions and their part files, returns how many"""
+        if self.dry_run:
+            return self.expired_sessions().count()
+        removed = 0
+        while True:
+            # Selected again under the write lock, a chunk may have arrived since
+            with transaction.atomic():
+                sessions = list(self.expired_sessions()[: self.batch_size])
+                UploadSession.objects.filter(pk__in=[session.pk for session in sessions]).delete()
+            for session in sessions:
+                remove_part(session)
+            removed += len(sessions)
+            if len(sessions) < self.batch_size:
+                return removed
+
+    def reclaim_stalled(self):
+        """
+        Reopen the stalled sessions whose part file is still there. Without it
+        the crashed request already moved the bytes into storage and the
+        session cannot be completed again, it is deleted. Returns the counts
+        of sessions reopened and deleted.
+        """
+        reopened = deleted = 0
+        for session in self.stalled_sessions():
+            if os.path.exists(session.part_path):
+                reopened += 1
+                if not self.dry_run:
+                    self.stalled_sessions().filter(pk=session.pk).update(
+                        status=UploadSession.Status.OPEN, updated_at=timezone.now()
+                    )
+            else:
+                deleted += 1
+                if not self.dry_run:
+                    self.stalled_sessions().filter(pk=session.pk).delete()
+        return reopened, deleted
+
+    def collect_parts(self):
+        """Delete part files older than the TTL that no session owns, left by a crash in between"""
+        try:
+            names = os.listdir(settings.FILE_UPLOAD_SESSION_ROOT)
+        except FileNotFoundError:
+            return 0
+        cutoff = time.time() - self.ttl
+        candidates = {}
+        for name in names:
+            path = os.path.join(settings.FILE_UPLOAD_SESSION_ROOT, name)
+            stem, extension = os.path.splitext(name)
+            try:
+                uuid.UUID(stem)
+                if extension == ".part" and os.path.getmtime(path) < cutoff:
+                    candidates[stem] = path
+            except (ValueError, FileNotFoundError):
+                pass
+
+        removed = 0
+        stems = list(candidates)
+        for start in range(0, len(stems), self.batch_size):
+            batch = stems[start : start + self.batch_size]
+            owned = {str(pk) for pk in UploadSession.objects.filter(pk__in=batch).values_list("pk", flat=True)}
+            for stem in batch:
+                if stem in owned:
+                    continue
+                removed += 1
+                if not self.dry_run:
+                    try:
+                        os.remove(candidates[stem])
+                    except FileNotFoundError:
+                        pass
+        return removed
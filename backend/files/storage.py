@@ -0,0 +1,214 @@
+import os
+import shutil
+import time
+import uuid
+
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.core.files.storage import FileSystemStorage
+from django.utils.module_loading import import_string
+from files.compression import CODECS, codec_for_name, get_codec, is_worth_compressing
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, reflinks are copies there
+    fcntl = None
+
+BLOB_ROOT = "uploads"
+
+# ioctl cloning a file's extents into another (linux/fs.h)
+FICLONE = 0x40049409
+
+# How import_file brings a file into storage
+IMPORT_MODES = ("copy", "hardlink", "reflink")
+
+
+def reflink(source, target):
+    """Clone ``source`` into a new ``target`` sharing its extents, a plain copy where the filesystem cannot"""
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        try:
+            if fcntl is None:
+                raise OSError("reflinks need fcntl")
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+
+
+def blob_path(hash_value, codec=""):
+    """Sharded location of a blob, e.g. ``uploads/ab/cd/abcd...``, with the suffix of the codec it is stored with"""
+    suffix = CODECS[codec].suffix if codec else ""
+    return os.path.join(BLOB_ROOT, hash_value[:2], hash_value[2:4], hash_value + suffix)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Filesystem storage for blobs named after their own hash. Two directory
+    levels keep every directory small however big the vault gets, and since a
+    name always maps to the same bytes, saving an existing name is a no-op.
+    """
+
+    # The file at ``path(name)`` holds the content byte for byte
+    raw_blobs = True
+
+    # ``import_file`` can hardlink or reflink a file in
+    links_imports = True
+
+    def get_available_name(self, name, max_length=None):
+        # Never suffix the name, an existing blob already holds this content
+        return name
+
+    def _private_name(self, name, suffix):
+        directory, basename = os.path.split(name)
+        return os.path.join(directory, f".{basename}.{uuid.uuid4().hex}.{suffix}")
+
+    def touch(self, name):
+        """
+        Mark an existing blob as just used, returns False if it is not there.
+        Reusing a blob always goes through here so the garbage collector's
+        grace period also covers blobs that are about to get a new row.
+        """
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def link(self, name, target):
+        """
+        Make blob ``name`` readable as ``target`` too, by hard link so the
+        row can be switched to the new name before the old one is deleted.
+        An existing ``target`` holds the same content and is kept.
+        """
+        os.makedirs(os.path.dirname(self.path(target)), exist_ok=True)
+        try:
+            os.link(self.path(name), self.path(target))
+        except FileExistsError:
+            self.touch(target)
+
+    def is_raw(self, codec=""):
+        """Whether the file of a blob stored with ``codec`` (``File.codec``) holds its content byte for byte"""
+        return self.raw_blobs and not codec
+
+    def describe(self, name):
+        """
+        ``(codec, stored size)`` of a blob just written, recorded on its
+        ``File`` row. Blob names are generated, never taken from the upload,
+        so a codec suffix can only have been appended by the storage itself.
+        """
+        codec = codec_for_name(name)
+        return (codec.name if codec else ""), self.size(name)
+
+    def open_blob(self, name, codec=""):
+        """
+        Open a blob to read its content, decoded with ``codec`` as recorded in
+        ``File.codec``. The row decides, a blob name is never trusted to say
+        whether its bytes are compressed.
+        """
+        if not codec:
+            return self.open(name, "rb")
+        return DjangoFile(CODECS[codec]().reader(open(self.path(name), "rb")), name=name)
+
+    def _save(self, name, content):
+        if self.touch(name):
+            return name
+
+        # Write under a private name and rename, so a concurrent writer of the
+        # same blob or a crash never leaves a partial file at the final path
+        temp_name = super()._save(self._private_name(name, "tmp"), content)
+        os.replace(self.path(temp_name), self.path(name))
+        return name
+
+    def save_path(self, name, path):
+        """Store the file at ``path`` as blob ``name`` the way uploads are stored"""
+        with open(path, "rb") as source:
+            return self.save(name, DjangoFile(source))
+
+    def import_file(self, name, path, mode="copy"):
+        """
+        Store the file at ``path`` as blob ``name`` without streaming it
+        through Python. ``hardlink`` shares the file's inode, so it must never
+        be modified in place afterwards (the scrubber would report the blob
+        corrupt), ``reflink`` clones its extents on filesystems that can
+        (btrfs, XFS) and copies elsewhere, ``copy`` lets the kernel copy it.
+        """
+        if self.touch(name):
+            return name
+
+        temp_path = self.path(self._private_name(name, "tmp"))
+        os.makedirs(os.path.dirname(temp_path), exist_ok=True)
+        if mode == "hardlink":
+            os.link(path, temp_path)
+        elif mode == "reflink":
+            reflink(path, temp_path)
+        else:
+            shutil.copyfile(path, temp_path)
+        os.replace(temp_path, self.path(name))
+        return name
+
+    def delete_if_unreferenced(self, name, is_referenced, grace=0, discard=os.remove):
+        """
+        Delete a blob unless ``is_referenced()`` says a row still points at it
+        or it was written or reused within the last ``grace`` seconds.
+
+        The blob is first moved aside and the checks run afterwards: a writer
+        that found the blob in place has touched it by then, so it is put back
+        instead of being lost. Any overwrite in between is harmless because
+        both copies hold the same bytes.
+        """
+        path = self.path(name)
+        trash = self.path(self._private_name(name, "trash"))
+        try:
+            os.replace(path, trash)
+        except FileNotFoundError:
+            return False
+        if time.time() - os.stat(trash).st_mtime < grace or is_referenced():
+            os.replace(trash, path)
+            return False
+        discard(trash)
+        return True
+
+
+class CompressedBlobStorage(ContentAddressedStorage):
+    """
+    Content-addressed storage that keeps compressible blobs compressed. Each
+    blob is sniffed and a sample trial-compressed, content that would not
+    shrink below ``max_ratio`` is stored raw. Compressed blobs are named with
+    the codec's suffix (``<sha256>.zst``) and decoded when opened.
+    """
+
+    sample_size = 64 * 1024
+    # Smaller blobs take a filesystem block either way
+    min_size = 1024
+    links_imports = False
+
+    def __init__(self, *args, codec=None, max_ratio=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.codec = get_codec(codec or settings.FILES_COMPRESSION_CODEC)
+        self.max_ratio = max_ratio or settings.FILES_COMPRESSION_MAX_RATIO
+
+    def import_file(self, name, path, mode="copy"):
+        # Linking would skip compression, imports are stored like uploads
+        return self.save_path(name, path)
+
+    def _save(self, name, content):
+        for candidate in [name + codec.suffix for codec in CODECS.values()] + [name]:
+            if self.touch(candidate):
+                return candidate
+
+        content.seek(0)
+        sample = content.read(self.sample_size)
+        if len(sample) < self.min_size or not is_worth_compressing(sample, self.codec, self.max_ratio):
+            return super()._save(name, content)
+
+        compressed_name = name + self.codec.suffix
+        temp_path = self.path(self._private_name(compressed_name, "tmp"))
+        os.makedirs(os.path.dirname(temp_path), exist_ok=True)
+        with open(temp_path, "wb") as raw, self.codec.writer(raw) as writer:
+            for chunk in content.chunks():
+                writer.write(chunk)
+        os.replace(temp_path, self.path(compressed_name))
+        return compressed_name
+
+
+def get_blob_storage():
+    return import_string(settings.FILES_BLOB_STORAGE)()
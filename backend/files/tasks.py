@@ -0,0 +1,31 @@
+from files.dedup import hash_deferred
+from files.hashing import ALGORITHMS
+from files.models import File
+from files.scrub import record, verify_file
+from jobs.registry import job
+
+
+class BlobCorrupted(Exception):
+    pass
+
+
+@job("files.verify_blob", concurrency=2)
+def verify_blob(file_id):
+    """Re-read a stored blob and check it still hashes to the file's ``hash_value``"""
+    file = File.objects.filter(pk=file_id).first()
+    # Collected in the meantime, not hashed yet, or hashed with an algorithm no longer installed
+    if file is None or file.hash_type not in ALGORITHMS:
+        return
+    integrity = verify_file(file)
+    record(file, integrity)
+    if integrity != File.Integrity.OK:
+        raise BlobCorrupted(f"Blob {file.file.name} is {integrity}, expected hash {file.hash_value}")
+
+
+@job("files.hash_blob", concurrency=2)
+def hash_blob(file_id):
+    """Hash a file stored with deferred hashing, see ``files.dedup.hash_deferred``"""
+    file = File.objects.filter(pk=file_id, hash_value__isnull=True).first()
+    if file is None:
+        return
+    hash_deferred(file)
@@ -0,0 +1,1070 @@
+import gzip
+import io
+import itertools
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from wsgiref.util import FileWrapper
+from datetime import datetime, timedelta, timezone
+from unittest import mock, skipIf
+
+from common.constants import ErrorMessages
+from common.utils import format_bytes
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopFutureHandlers
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import FileResponse
+from django.test import Client, SimpleTestCase, TransactionTestCase, override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from files.chunking import MAX_CHUNK_SIZE, _cut_point, _fingerprints, iter_chunks, numpy
+from files.backup import BLOBS_DIR, DATABASE_NAME, SNAPSHOTS_DIR
+from files.dedup import SingleFlight
+from files.detection import detect_type, resolve_type
+from files.gc import GarbageCollector
+from files.hashing import hash_file
+from files.importer import Journal, TreeImporter, walk
+from files.models import Entry, File, StorageStats, UploadChunk, UploadSession
+from files.scrub import RateLimiter, Scrubber
+from files.search import drop_search_triggers, install_search_index
+from files.serializers import EntrySerializer
+from files.sessions import SessionCollector
+from files.storage import CompressedBlobStorage, ContentAddressedStorage, blob_path
+from files.upload_handlers import HashingMemoryFileUploadHandler, HashingTemporaryFileUploadHandler
+from files.views import EntryViewSet
+from jobs.worker import Worker
+
+
+class VaultTestMixin:
+    """Points the blob storage and upload sessions at a temporary directory removed after each test"""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(
+            MEDIA_ROOT=self.media_root, FILE_UPLOAD_SESSION_ROOT=os.path.join(self.media_root, "sessions")
+        )
+        media.enable()
+        self.addCleanup(media.disable)
+        caches["files"].clear()
+
+    def upload(self, name, content):
+        response = self.client.post("/api/files/", {"file": SimpleUploadedFile(name, content)})
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()["data"]
+
+    def blobs(self):
+        return [
+            os.path.join(directory, name)
+            for directory, _, names in os.walk(os.path.join(self.media_root, "uploads"))
+            for name in names
+        ]
+
+    def run_jobs(self):
+        Worker(poll_interval=0.05, log=lambda message: None).run(once=True)
+
+
+@override_settings(FILES_DEFER_HASHING=False)
+class UploadHandlerTests(SimpleTestCase):
+    def parse(self, handler_class, content, chunk_size=64 * 1024):
+        handler = handler_class()
+        handler.handle_raw_input(None, {}, len(content), "boundary")
+        try:
+            handler.new_file("file", "upload.bin", "application/octet-stream", len(content))
+        except StopFutureHandlers:
+            pass
+        for start in range(0, len(content), chunk_size):
+            self.assertIsNone(handler.receive_data_chunk(content[start : start + chunk_size], start))
+        return handler.file_complete(len(content))
+
+    def test_digest_matches_hash_file(self):
+        for handler_class, content in (
+            (HashingMemoryFileUploadHandler, os.urandom(100_000)),
+            (HashingTemporaryFileUploadHandler, os.urandom(3_000_000)),
+        ):
+            with self.subTest(handler=handler_class.__name__):
+                upload = self.parse(handler_class, content)
+                self.addCleanup(upload.close)
+                self.assertEqual(upload.hash_value, hash_file(SimpleUploadedFile("upload.bin", content)))
+
+
+class ChunkingTests(SimpleTestCase):
+    def cut_points(self, data, fingerprints=None):
+        start, cuts = 0, []
+        while start < len(data):
+            start += _cut_point(data, start, len(data), fingerprints)
+            cuts.append(start)
+        return cuts
+
+    @skipIf(numpy is None, "numpy is not installed")
+    def test_fingerprints_cut_where_the_byte_loop_does(self):
+        generator = random.Random(0)
+        for data in (
+            os.urandom(2 * MAX_CHUNK_SIZE * 4),
+            bytes(MAX_CHUNK_SIZE * 2),
+            bytes(generator.getrandbits(2) for _ in range(MAX_CHUNK_SIZE * 3)),
+        ):
+            self.assertEqual(self.cut_points(data, _fingerprints(data)), self.cut_points(data))
+
+    def test_chunks_do_not_depend_on_the_blocks_read(self):
+        data = os.urandom(MAX_CHUNK_SIZE * 6)
+        expected = self.cut_points(data)
+        for block_size in (7777, 65536, len(data)):
+            blocks = (data[start : start + block_size] for start in range(0, len(data), block_size))
+            self.assertEqual(list(itertools.accumulate(map(len, iter_chunks(blocks)))), expected)
+
+
+class ResponseCacheTests(VaultTestMixin, TransactionTestCase):
+    def test_changes_made_elsewhere_move_the_etag(self):
+        self.upload("a.txt", b"a")
+        etag = self.client.get("/api/files/")["ETag"]
+        self.assertEqual(self.client.get("/api/files/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # What a job worker or management command does, in a process whose cache the server never sees
+        StorageStats.record(total_entries=0, would_be_space=1)
+        response = self.client.get("/api/files/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_etag_survives_a_cleared_cache(self):
+        self.upload("a.txt", b"a")
+        etag = self.client.get("/api/files/")["ETag"]
+        caches["files"].clear()
+        self.assertEqual(self.client.get("/api/files/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class EntryListTests(VaultTestMixin, TransactionTestCase):
+    maxDiff = None
+    def setUp(self):
+        super().setUp()
+        for index in range(12):
+            self.upload(f"{index}.txt", os.urandom(100 + index))
+
+    def list(self, page_size, **params):
+        # The view itself, the URL runs it on the I/O pool's connections
+        caches["files"].clear()
+        request = APIRequestFactory().get("/api/files/", {"page_size": page_size, **params})
+        response = EntryViewSet.as_view({"get": "list"})(request)
+        response.render()
+        return request, json.loads(response.content)["data"]["items"]
+
+    def page(self, **params):
+        caches["files"].clear()
+        response = self.client.get("/api/files/", params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()["data"]
+
+    def test_queries_do_not_grow_with_the_page(self):
+        for page_size in (2, 10):
+            with self.subTest(page_size=page_size), self.assertNumQueries(3):
+                _, items = self.list(page_size)
+            self.assertEqual(len(items), page_size)
+
+    def test_cursor_pages_take_constant_queries(self):
+        # The catalog version, the page and the total from the storage stats
+        for page_size in (2, 10):
+            with self.subTest(page_size=page_size), self.assertNumQueries(3):
+                _, items = self.list(page_size, pagination="cursor")
+            self.assertEqual(len(items), page_size)
+
+    def test_cursor_walks_forward_and_back(self):
+        expected = [str(pk) for pk in Entry.objects.order_by("-created_at", "-id").values_list("id", flat=True)]
+        pages, params = [], {"pagination": "cursor", "page_size": 5}
+        while True:
+            pages.append(self.page(**params))
+            if not pages[-1]["next_cursor"]:
+                break
+            params["cursor"] = pages[-1]["next_cursor"]
+        self.assertEqual([len(page["items"]) for page in pages], [5, 5, 2])
+        self.assertEqual([item["id"] for page in pages for item in page["items"]], expected)
+        self.assertEqual([page["has_previous"] for page in pages], [False, True, True])
+        self.assertFalse(pages[-1]["has_next"])
+
+        back = self.page(pagination="cursor", page_size=5, cursor=pages[-1]["previous_cursor"])
+        self.assertEqual(back["items"], pages[1]["items"])
+        back = self.page(pagination="cursor", page_size=5, cursor=back["previous_cursor"])
+        self.assertEqual(back["items"], pages[0]["items"])
+        self.assertFalse(back["has_previous"])
+
+        response = self.client.get("/api/files/", {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_count_modes(self):
+        self.assertEqual(self.page(pagination="cursor")["total"], 12)
+        self.assertIsNone(self.page(pagination="cursor", count="none")["total"])
+        self.assertEqual(self.page(pagination="cursor", count="estimate")["total"], 12)
+        # A filtered total is counted, there is nothing to estimate it from
+        self.assertEqual(self.page(pagination="cursor", search="1")["total"], 3)
+        self.assertIsNone(self.page(pagination="cursor", search="1", count="estimate")["total"])
+
+    def test_projection_renders_like_the_serializer(self):
+        request, items = self.list(10)
+        entries = Entry.objects.select_related("file").in_bulk([item["id"] for item in items])
+        serialized = EntrySerializer(
+            [entries[uuid.UUID(item["id"])] for item in items], many=True, context={"request": request}
+        ).data
+        # Compared as JSON text, so the key order has to match too
+        self.assertEqual(json.dumps(items), json.dumps(json.loads(JSONRenderer().render(serialized))))
+
+
+class QueryPlanTests(VaultTestMixin, TransactionTestCase):
+    def add_index(self, index):
+        with connection.schema_editor() as editor:
+            editor.add_index(Entry, index)
+
+    def test_list_queries_use_indexes(self):
+        # A page is only read once its count found rows, so an entry matches every filter
+        entry = self.upload("report.pdf", os.urandom(2048))
+        Entry.objects.filter(pk=entry["id"]).update(
+            mime_type="application/pdf", category="document", uploaded_at=datetime(2024, 6, 1, tzinfo=timezone.utc)
+        )
+        self.upload("notes.txt", os.urandom(10))
+        call_command("check_query_plans", stdout=io.StringIO())
+
+    def test_missing_index_is_reported(self):
+        entry = self.upload("report.pdf", os.urandom(2048))
+        Entry.objects.filter(pk=entry["id"]).update(uploaded_at=datetime(2024, 6, 1, tzinfo=timezone.utc))
+        index = next(index for index in Entry._meta.indexes if index.fields == ["uploaded_at", "created_at"])
+        with connection.schema_editor() as editor:
+            editor.remove_index(Entry, index)
+        self.addCleanup(self.add_index, index)
+
+        out = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command("check_query_plans", stdout=out)
+        self.assertIn("FULL SCAN of files_entry: list uploaded_after", out.getvalue())
+
+
+class DownloadTests(VaultTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.content = os.urandom(10_000)
+        self.url = f"/api/files/{self.upload('data.bin', self.content)['id']}/download/"
+
+    def body(self, response):
+        return b"".join(response.streaming_content) if response.streaming else response.content
+
+    def test_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=100-199")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 100-199/10000")
+        self.assertEqual(self.body(response), self.content[100:200])
+
+        self.assertEqual(self.body(self.client.get(self.url, HTTP_RANGE="bytes=-50")), self.content[-50:])
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9,20-29")
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response["Content-Type"].startswith("multipart/byteranges"))
+        self.assertEqual(len(self.body(response)), int(response["Content-Length"]))
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=20000-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */10000")
+
+    def test_etag(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # If-Range with another version sends the whole content
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"other"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=etag).status_code, 206)
+
+    @override_settings(FILES_DOWNLOAD_TRANSFER="files.downloads.SendfileTransfer")
+    def test_sendfile_only_under_wsgi(self):
+        response = self.client.get(self.url, **{"wsgi.file_wrapper": FileWrapper})
+        self.assertIsInstance(response, FileResponse)
+        self.assertEqual(self.body(response), self.content)
+
+        # What an ASGI server passes: no file wrapper, the blob is streamed
+        response = self.client.get(self.url)
+        self.assertNotIsInstance(response, FileResponse)
+        self.assertEqual(self.body(response), self.content)
+
+
+class SearchIndexTests(VaultTestMixin, TransactionTestCase):
+    def search(self, term):
+        caches["files"].clear()
+        response = self.client.get("/api/files/", {"search": term})
+        return sorted(item["name"] for item in response.json()["data"]["items"])
+
+    def test_matches_survive_vacuum_and_table_rebuilds(self):
+        for name in ("alpha-report.txt", "beta-notes.txt", "gamma-report.txt", "delta-notes.txt"):
+            self.upload(name, name.encode())
+        Entry.objects.filter(name="alpha-report.txt").delete()
+
+        with connection.cursor() as cursor:
+            cursor.execute("VACUUM")
+        # What a migrate run altering files_entry does, the copy renumbers its rowids
+        drop_search_triggers()
+        with connection.schema_editor() as editor:
+            editor._remake_table(Entry)
+        install_search_index()
+
+        self.assertEqual(self.search("notes"), ["beta-notes.txt", "delta-notes.txt"])
+        self.assertEqual(self.search("report"), ["gamma-report.txt"])
+        self.upload("epsilon-notes.txt", b"epsilon")
+        Entry.objects.filter(name="beta-notes.txt").update(name="beta-draft.txt")
+        self.assertEqual(self.search("notes"), ["beta-draft.txt", "delta-notes.txt", "epsilon-notes.txt"])
+        self.assertEqual(self.search("draft"), ["beta-draft.txt"])
+
+        call_command("rebuild_search_index", stdout=io.StringIO())
+        self.assertEqual(self.search("report"), ["gamma-report.txt"])
+
+
+class ArchiveUploadTests(VaultTestMixin, TransactionTestCase):
+    def archive(self, **members):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name, content in members.items():
+                archive.writestr(name, content)
+        return SimpleUploadedFile("upload.zip", buffer.getvalue(), "application/zip")
+
+    def post(self, archive):
+        return self.client.post("/api/files/bulk", {"archive": archive})
+
+    def test_content_stored_unhashed_is_deduplicated(self):
+        content = os.urandom(5000)
+        self.upload("single.bin", content)
+        self.assertIsNone(File.objects.get().hash_value)
+
+        response = self.client.post(
+            "/api/files/bulk", {"files": [SimpleUploadedFile("a.bin", content), SimpleUploadedFile("b.bin", content)]}
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()["data"]["deduplicated"], 2)
+        self.assertEqual(File.objects.count(), 1)
+        self.assertEqual(Entry.objects.count(), 3)
+        self.assertEqual(len(self.blobs()), 1)
+
+    def test_members_are_stored(self):
+        response = self.post(self.archive(a=b"a" * 1000, b=b"b" * 1000))
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Entry.objects.count(), 2)
+
+    @override_settings(FILE_UPLOAD_MAX_SIZE=1000)
+    def test_oversized_member_is_rejected(self):
+        response = self.post(self.archive(small=b"a" * 1000, large=bytes(1001)))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["message"], ErrorMessages.ArchiveTooLarge)
+        self.assertEqual(File.objects.count(), 0)
+
+    @override_settings(FILES_ARCHIVE_MAX_SIZE=10_000)
+    def test_archive_expanding_past_the_budget_is_rejected(self):
+        response = self.post(self.archive(**{f"{index}.bin": bytes(4000) for index in range(3)}))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(File.objects.count(), 0)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def call_together(self, flight, func, callers=8):
+        barrier = threading.Barrier(callers)
+        results = []
+
+        def call():
+            barrier.wait()
+            try:
+                results.append(flight.do("key", func))
+            except RuntimeError as error:
+                results.append(error)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_calls_share_one_run(self):
+        calls = []
+        release = threading.Event()
+
+        def work():
+            calls.append(1)
+            release.wait(5)
+            return "blob"
+
+        threading.Timer(0.2, release.set).start()
+        results = self.call_together(SingleFlight(), work)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False] + [True] * 7)
+        self.assertEqual({result for result, _ in results}, {"blob"})
+
+    def test_failure_is_not_shared(self):
+        calls = []
+
+        def work():
+            calls.append(1)
+            time.sleep(0.05)
+            raise RuntimeError("disk full")
+
+        results = self.call_together(SingleFlight(), work, callers=4)
+        # Every caller tried itself, one after the other
+        self.assertEqual(len(calls), 4)
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+
+
+class ConcurrentUploadTests(VaultTestMixin, TransactionTestCase):
+    uploads = 16
+
+    def upload_together(self, content):
+        barrier = threading.Barrier(self.uploads)
+        statuses, errors = [], []
+
+        def upload(index):
+            try:
+                barrier.wait()
+                response = Client().post("/api/files/", {"file": SimpleUploadedFile(f"{index}.bin", content)})
+                statuses.append(response.status_code)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=upload, args=(index,)) for index in range(self.uploads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(statuses, [201] * self.uploads)
+
+    def assert_stored_once(self):
+        self.assertEqual(File.objects.count(), 1)
+        self.assertEqual(Entry.objects.count(), self.uploads)
+        self.assertEqual(len(self.blobs()), 1)
+        stats = StorageStats.load()
+        self.assertEqual((stats.total_files, stats.total_entries), (1, self.uploads))
+
+    def test_identical_uploads_share_one_blob(self):
+        self.upload_together(os.urandom(300_000))
+        self.assert_stored_once()
+        self.run_jobs()
+        self.assert_stored_once()
+        self.assertIsNotNone(File.objects.get().hash_value)
+
+    @override_settings(FILES_DEFER_HASHING=False)
+    def test_identical_uploads_share_one_blob_hashed_inline(self):
+        self.upload_together(os.urandom(300_000))
+        self.assert_stored_once()
+
+
+class UploadSessionCleanupTests(VaultTestMixin, TransactionTestCase):
+    def open_session(self, content):
+        response = self.client.post(
+            "/api/uploads/", {"original_filename": "part.bin", "size": len(content)}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        session = UploadSession.objects.get(pk=response.json()["data"]["id"])
+        response = self.client.put(
+            f"/api/uploads/{session.pk}/chunks/?offset=0", content, content_type="application/octet-stream"
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        return session
+
+    def age(self, session, seconds, **fields):
+        past = datetime.now(timezone.utc) - timedelta(seconds=seconds)
+        UploadSession.objects.filter(pk=session.pk).update(updated_at=past, created_at=past, **fields)
+        UploadChunk.objects.filter(session=session).update(created_at=past)
+
+    def complete(self, session):
+        return self.client.post(f"/api/uploads/{session.pk}/complete/")
+
+    def test_abandoned_sessions_are_removed_with_their_part(self):
+        abandoned, active = self.open_session(b"a" * 100), self.open_session(b"b" * 100)
+        self.age(abandoned, 7200)
+        orphan = os.path.join(os.path.dirname(abandoned.part_path), f"{uuid.uuid4()}.part")
+        open(orphan, "wb").close()
+        os.utime(orphan, (0, 0))
+
+        collector = SessionCollector(ttl=3600, log=lambda message: None)
+        self.assertEqual(collector.collect_expired(), 1)
+        self.assertEqual(collector.collect_parts(), 1)
+        self.assertEqual(list(UploadSession.objects.values_list("pk", flat=True)), [active.pk])
+        self.assertFalse(os.path.exists(abandoned.part_path))
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.exists(active.part_path))
+
+    def test_chunk_keeps_a_session_alive(self):
+        session = self.open_session(b"a" * 100)
+        self.age(session, 7200)
+        UploadChunk.objects.filter(session=session).update(created_at=datetime.now(timezone.utc))
+        self.assertEqual(SessionCollector(ttl=3600, log=lambda message: None).collect_expired(), 0)
+
+    def test_session_left_finalizing_completes_after_the_timeout(self):
+        session = self.open_session(b"a" * 100)
+        UploadSession.objects.filter(pk=session.pk).update(status=UploadSession.Status.FINALIZING)
+        self.assertEqual(self.complete(session).status_code, 400)
+
+        self.age(session, 7200, status=UploadSession.Status.FINALIZING)
+        self.assertEqual(self.complete(session).status_code, 201)
+        self.assertEqual(UploadSession.objects.get(pk=session.pk).status, UploadSession.Status.COMPLETE)
+
+    def test_stalled_sessions_are_reopened(self):
+        reopened, lost = self.open_session(b"a" * 100), self.open_session(b"b" * 100)
+        for session in (reopened, lost):
+            self.age(session, 7200, status=UploadSession.Status.FINALIZING)
+        os.remove(lost.part_path)
+
+        collector = SessionCollector(finalize_timeout=3600, log=lambda message: None)
+        self.assertEqual(collector.reclaim_stalled(), (1, 1))
+        self.assertEqual(list(UploadSession.objects.values_list("pk", "status")), [(reopened.pk, "open")])
+        self.assertEqual(self.complete(reopened).status_code, 201)
+
+
+class BlobLayoutTests(VaultTestMixin, TransactionTestCase):
+    def assert_addressed(self, file, content):
+        self.assertEqual(file.file.name, blob_path(hash_file(SimpleUploadedFile("blob.bin", content)), file.codec))
+        self.assertIn(os.path.join(self.media_root, file.file.name), self.blobs())
+
+    @override_settings(FILES_DEFER_HASHING=False)
+    def test_blobs_are_named_after_their_hash(self):
+        content = os.urandom(5000)
+        self.upload("a.bin", content)
+        self.upload("b.bin", content)
+        self.assert_addressed(File.objects.get(), content)
+        self.assertEqual(len(self.blobs()), 1)
+
+    def test_deferred_blobs_move_once_hashed(self):
+        content = os.urandom(5000)
+        self.upload("a.bin", content)
+        self.assertNotEqual(File.objects.get().file.name, blob_path(hash_file(SimpleUploadedFile("a.bin", content))))
+        self.run_jobs()
+        self.assert_addressed(File.objects.get(), content)
+        self.assertEqual(len(self.blobs()), 1)
+
+    @override_settings(FILES_DEFER_HASHING=False)
+    def test_migration_moves_old_blobs_and_resumes(self):
+        contents = {"moved.bin": os.urandom(5000), "interrupted.bin": os.urandom(5000)}
+        for name, content in contents.items():
+            self.upload(name, content)
+        for file in File.objects.all():
+            legacy = os.path.join("uploads", file.original_filename)
+            if file.original_filename == "moved.bin":
+                os.rename(os.path.join(self.media_root, file.file.name), os.path.join(self.media_root, legacy))
+            else:
+                # A run that moved the blob but stopped before updating the row
+                shutil.copy(os.path.join(self.media_root, file.file.name), os.path.join(self.media_root, legacy))
+            File.objects.filter(pk=file.pk).update(file=legacy)
+
+        out = io.StringIO()
+        call_command("migrate_blob_layout", "--batch-size", "1", stdout=out)
+        self.assertIn("Moved 2 blobs, 0 already migrated, 0 missing", out.getvalue())
+        for file in File.objects.all():
+            self.assert_addressed(file, contents[file.original_filename])
+        self.assertEqual(len(self.blobs()), 2)
+
+        out = io.StringIO()
+        call_command("migrate_blob_layout", stdout=out)
+        self.assertIn("Moved 0 blobs, 2 already migrated, 0 missing", out.getvalue())
+
+
+@override_settings(FILES_DEFER_HASHING=False)
+class GarbageCollectionTests(VaultTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.kept = self.upload("kept.bin", os.urandom(5000))
+        self.deleted = self.upload("deleted.bin", os.urandom(3000))
+        self.assertEqual(self.client.delete(f"/api/files/{self.deleted['id']}/").status_code, 204)
+        self.orphan = File.objects.get(entries__isnull=True)
+
+    def age(self, name, seconds):
+        past = time.time() - seconds
+        os.utime(os.path.join(self.media_root, name), (past, past))
+
+    def collector(self, **options):
+        return GarbageCollector(grace=3600, log=lambda message: None, **options)
+
+    def test_orphans_are_collected_after_the_grace_period(self):
+        self.assertEqual(self.collector().collect_files(), (0, 0))
+
+        File.objects.filter(pk=self.orphan.pk).update(created_at=datetime.now(timezone.utc) - timedelta(hours=2))
+        self.age(self.orphan.file.name, 7200)
+        self.assertEqual(self.collector(dry_run=True).collect_files(), (1, 3000))
+        self.assertTrue(File.objects.filter(pk=self.orphan.pk).exists())
+
+        self.assertEqual(self.collector().collect_files(), (1, 3000))
+        self.assertEqual(list(File.objects.values_list("original_filename", flat=True)), ["kept.bin"])
+        self.assertEqual(len(self.blobs()), 1)
+        self.assertEqual(StorageStats.load().total_files, 1)
+
+    def test_reused_file_is_kept(self):
+        past = datetime.now(timezone.utc) - timedelta(hours=2)
+        File.objects.filter(pk=self.orphan.pk).update(created_at=past, referenced_at=datetime.now(timezone.utc))
+        self.assertEqual(self.collector().collect_files(), (0, 0))
+
+        File.objects.filter(pk=self.orphan.pk).update(referenced_at=past)
+        self.age(self.orphan.file.name, 7200)
+        self.assertEqual(self.collector().collect_files(), (1, 3000))
+
+    def test_reconcile_removes_stray_blobs_and_reports_missing_ones(self):
+        stray, fresh = blob_path("ab" * 32), blob_path("cd" * 32)
+        for name in (stray, fresh):
+            os.makedirs(os.path.dirname(os.path.join(self.media_root, name)), exist_ok=True)
+            with open(os.path.join(self.media_root, name), "wb") as blob:
+                blob.write(b"stray")
+        self.age(stray, 7200)
+        os.remove(os.path.join(self.media_root, File.objects.get(original_filename="kept.bin").file.name))
+
+        out = io.StringIO()
+        call_command("collect_garbage", "--reconcile", stdout=out, stderr=io.StringIO())
+        self.assertIn("Collected 1 unreferenced blobs, 1 blobs missing from storage", out.getvalue())
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, stray)))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, fresh)))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, self.orphan.file.name)))
+
+
+class StorageStatsTests(VaultTestMixin, TransactionTestCase):
+    fields = ("actual_space", "would_be_space", "total_files", "total_entries", "stored_space", "total_chunks")
+
+    def assert_counters_match_the_catalog(self):
+        counted = StorageStats.load()
+        recomputed = StorageStats.recompute()
+        for field in self.fields:
+            self.assertEqual(getattr(counted, field), getattr(recomputed, field), field)
+
+    def test_counters_follow_every_change(self):
+        content = os.urandom(5000)
+        entry = self.upload("a.bin", content)
+        self.upload("copy.bin", content)
+        self.upload("b.bin", os.urandom(3000))
+        self.assert_counters_match_the_catalog()
+
+        self.run_jobs()
+        self.assert_counters_match_the_catalog()
+
+        response = self.client.post(
+            "/api/files/bulk",
+            {"files": [SimpleUploadedFile("c.bin", content), SimpleUploadedFile("d.bin", b"d" * 100)]},
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assert_counters_match_the_catalog()
+
+        self.client.delete(f"/api/files/{entry['id']}/")
+        self.assert_counters_match_the_catalog()
+
+        stats = self.client.get("/api/files/savings").json()["data"]
+        self.assertEqual((stats["total_files"], stats["total_entries"]), (3, 4))
+
+    def test_reconcile_stats_repairs_drifted_counters(self):
+        self.upload("a.bin", os.urandom(5000))
+        StorageStats.objects.update(total_files=42, actual_space=0)
+        out = io.StringIO()
+        call_command("reconcile_stats", stdout=out)
+        self.assertIn("1 files, 1 entries", out.getvalue())
+        self.assertEqual(StorageStats.load().actual_space, 5000)
+
+
+@override_settings(FILES_DEFER_HASHING=False)
+class BatchDeleteTests(VaultTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        shared = os.urandom(1000)
+        self.entries = {
+            name: self.upload(name, content)["id"]
+            for name, content in (
+                ("report-1.txt", shared),
+                ("report-2.txt", shared),
+                ("report-3.txt", os.urandom(300)),
+                ("notes.txt", os.urandom(500)),
+            )
+        }
+
+    def delete(self, **selection):
+        return self.client.post("/api/files/batch-delete/", selection, content_type="application/json")
+
+    def test_dry_run_only_reports(self):
+        response = self.delete(filters={"search": "report"}, dry_run=True)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(
+            response.json()["data"], {"dry_run": True, "entries": 3, "bytes": 2300, "freed_bytes": 1300}
+        )
+        self.assertEqual(Entry.objects.count(), 4)
+
+        # The other entry still holds the shared file
+        response = self.delete(ids=[self.entries["report-1.txt"]], dry_run=True)
+        self.assertEqual(response.json()["data"]["freed_bytes"], 0)
+
+    def test_filtered_entries_are_deleted_in_batches(self):
+        response = self.delete(filters={"search": "report"}, batch_size=1)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()["data"], {"dry_run": False, "entries": 3, "bytes": 2300, "freed_bytes": 1300})
+        self.assertEqual(list(Entry.objects.values_list("name", flat=True)), ["notes.txt"])
+        self.assertEqual(StorageStats.load().total_entries, 1)
+
+    def test_empty_selection_is_rejected(self):
+        for selection in ({}, {"filters": {}}, {"filters": {"unknown": "x"}}, {"ids": []}):
+            with self.subTest(selection=selection):
+                self.assertEqual(self.delete(**selection).status_code, 400)
+        self.assertEqual(Entry.objects.count(), 4)
+
+
+@override_settings(FILES_DEFER_HASHING=False)
+class ArchiveDownloadTests(VaultTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.contents = {"notes.txt": b"notes " * 2000, "photo.jpg": os.urandom(3000), "NOTES.txt": b"other notes"}
+        self.ids = [self.upload(name, content)["id"] for name, content in self.contents.items()]
+
+    def archive(self, **params):
+        response = self.client.get("/api/files/archive/", params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertTrue(response["Content-Disposition"].startswith("attachment"))
+        return b"".join(response.streaming_content)
+
+    def test_selection_is_streamed_as_a_zip(self):
+        Entry.objects.filter(pk=self.ids[1]).update(name="../../photo.jpg")
+        with zipfile.ZipFile(io.BytesIO(self.archive(ids=",".join(self.ids)))) as archive:
+            self.assertEqual(archive.namelist(), ["notes.txt", "photo.jpg", "NOTES (1).txt"])
+            self.assertEqual(archive.read("notes.txt"), self.contents["notes.txt"])
+            self.assertEqual(archive.read("photo.jpg"), self.contents["photo.jpg"])
+            self.assertEqual(archive.read("NOTES (1).txt"), self.contents["NOTES.txt"])
+            # Already compressed content is stored as is
+            self.assertEqual(archive.getinfo("notes.txt").compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(archive.getinfo("photo.jpg").compress_type, zipfile.ZIP_STORED)
+
+    def test_filters_select_and_lost_blobs_are_skipped(self):
+        os.remove(os.path.join(self.media_root, File.objects.get(original_filename="NOTES.txt").file.name))
+        with zipfile.ZipFile(io.BytesIO(self.archive(search="notes"))) as archive:
+            self.assertEqual(archive.namelist(), ["notes.txt"])
+
+    def test_large_members_get_zip64_records(self):
+        # Pretend the 4 GiB limit is tiny, a real member that large would take minutes
+        with mock.patch.object(zipfile, "ZIP64_LIMIT", 1000):
+            data = self.archive(ids=",".join(self.ids))
+        self.assertIn(b"PK\x06\x06", data)
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.read("notes.txt"), self.contents["notes.txt"])
+
+
+@override_settings(FILES_DEFER_HASHING=False)
+class CompressionTests(VaultTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        storage = mock.patch.object(File._meta.get_field("file"), "storage", CompressedBlobStorage(codec="gzip"))
+        storage.start()
+        self.addCleanup(storage.stop)
+        self.text = b"a line of compressible text\n" * 5000
+        self.url = f"/api/files/{self.upload('log.txt', self.text)['id']}/download/"
+
+    def body(self, response):
+        return b"".join(response.streaming_content) if response.streaming else response.content
+
+    def test_only_compressible_blobs_are_compressed(self):
+        self.upload("random.bin", os.urandom(5000))
+        text, raw = File.objects.get(original_filename="log.txt"), File.objects.get(original_filename="random.bin")
+        self.assertEqual(text.codec, "gzip")
+        self.assertTrue(text.file.name.endswith(".gz"))
+        self.assertLess(text.stored_size, text.size / 10)
+        self.assertEqual((raw.codec, raw.stored_size), ("", 5000))
+        self.assertEqual(StorageStats.load().stored_space, text.stored_size + 5000)
+
+    def test_downloads_decode_unless_the_client_accepts_the_codec(self):
+        response = self.client.get(self.url)
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(self.body(response), self.text)
+
+        encoded = self.client.get(self.url, HTTP_ACCEPT_ENCODING="br, gzip")
+        self.assertEqual(encoded["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", encoded["Vary"])
+        self.assertNotEqual(encoded["ETag"], response["ETag"])
+        self.assertEqual(gzip.decompress(self.body(encoded)), self.text)
+
+        self.assertFalse(self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip;q=0").has_header("Content-Encoding"))
+        # Ranges address the decoded content
+        ranged = self.client.get(self.url, HTTP_RANGE="bytes=100-199", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(ranged.status_code, 206)
+        self.assertFalse(ranged.has_header("Content-Encoding"))
+        self.assertEqual(self.body(ranged), self.text[100:200])
+
+    def test_blobs_stay_readable_with_compression_off(self):
+        with mock.patch.object(File._meta.get_field("file"), "storage", ContentAddressedStorage()):
+            self.assertEqual(self.body(self.client.get(self.url)), self.text)
+
+
+class TypeDetectionTests(SimpleTestCase):
+    DOCX = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+    def test_content_decides(self):
+        png = b"\x89PNG\r\n\x1a\n" + bytes(100)
+        self.assertEqual(detect_type(png, "photo.txt", "text/plain"), ("image/png", "image"))
+        self.assertEqual(detect_type(b"%PDF-1.7\n", "scan", ""), ("application/pdf", "document"))
+
+    def test_filename_refines_containers_and_text(self):
+        zipped = b"PK\x03\x04" + bytes(100)
+        self.assertEqual(detect_type(zipped, "letter.docx"), (self.DOCX, "document"))
+        self.assertEqual(detect_type(zipped, "bundle.zip"), ("application/zip", "archive"))
+        # A text extension does not turn binary content into text
+        self.assertEqual(detect_type(zipped, "notes.txt"), ("application/zip", "archive"))
+        self.assertEqual(detect_type(b"a,b\n1,2\n", "data.csv"), ("text/csv", "spreadsheet"))
+        self.assertEqual(detect_type(b"plain words", "readme"), ("text/plain", "text"))
+
+    def test_declared_type_is_the_last_resort(self):
+        self.assertEqual(detect_type(bytes(100), "blob", "IMAGE/JPG; q=1"), ("image/jpeg", "image"))
+        self.assertEqual(detect_type(bytes(100), "blob", ""), ("application/octet-stream", "other"))
+
+    def test_filters_take_types_and_extensions(self):
+        for value in ("pdf", ".PDF", "application/pdf", "Application/PDF"):
+            self.assertEqual(resolve_type(value), "application/pdf")
+        self.assertEqual(resolve_type("jpg"), "image/jpeg")
+        self.assertEqual(resolve_type("image/jpg"), "image/jpeg")
+
+
+class FacetTests(VaultTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.upload("a.png", b"\x89PNG\r\n\x1a\n" + os.urandom(92))
+        self.upload("b.png", b"\x89PNG\r\n\x1a\n" + os.urandom(192))
+        self.upload("c.jpg", b"\xff\xd8\xff" + os.urandom(297))
+        self.upload("report.pdf", b"%PDF-1.7\n" + os.urandom(991))
+
+    def get(self, url, **params):
+        caches["files"].clear()
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()["data"]
+
+    def test_counts_per_category_and_type(self):
+        facets = self.get("/api/files/facets/")
+        self.assertEqual((facets["entries"], facets["bytes"]), (4, 1600))
+        self.assertEqual(
+            facets["categories"],
+            [
+                {
+                    "category": "image",
+                    "entries": 3,
+                    "bytes": 600,
+                    "types": [
+                        {"mime_type": "image/png", "entries": 2, "bytes": 300},
+                        {"mime_type": "image/jpeg", "entries": 1, "bytes": 300},
+                    ],
+                },
+                {
+                    "category": "document",
+                    "entries": 1,
+                    "bytes": 1000,
+                    "types": [{"mime_type": "application/pdf", "entries": 1, "bytes": 1000}],
+                },
+            ],
+        )
+        # Facets follow the list filters
+        facets = self.get("/api/files/facets/", min_size=250)
+        self.assertEqual([category["entries"] for category in facets["categories"]], [1, 1])
+
+    def test_type_and_category_filters(self):
+        names = lambda data: sorted(item["name"] for item in data["items"])
+        self.assertEqual(names(self.get("/api/files/", category="image")), ["a.png", "b.png", "c.jpg"])
+        self.assertEqual(names(self.get("/api/files/", file_type="jpg")), ["c.jpg"])
+        self.assertEqual(names(self.get("/api/files/", file_type="image/PNG")), ["a.png", "b.png"])
+        self.assertEqual(names(self.get("/api/files/", file_type="pdf", category="document")), ["report.pdf"])
+
+
+@override_settings(FILES_DEFER_HASHING=False)
+class ScrubTests(VaultTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        for name in ("intact.bin", "corrupt.bin", "missing.bin"):
+            self.upload(name, os.urandom(20_000))
+        self.files = {file.original_filename: file for file in File.objects.all()}
+
+    def path(self, name):
+        return os.path.join(self.media_root, self.files[name].file.name)
+
+    def scrubber(self, **options):
+        return Scrubber(log=lambda message: None, **options)
+
+    def test_corrupt_and_missing_blobs_are_recorded(self):
+        with open(self.path("corrupt.bin"), "r+b") as blob:
+            blob.seek(10_000)
+            blob.write(b"\xff" * 4)
+        os.remove(self.path("missing.bin"))
+
+        scrubber = self.scrubber()
+        self.assertEqual(scrubber.run(), 3)
+        self.assertEqual((scrubber.counts["ok"], scrubber.counts["corrupt"], scrubber.counts["missing"]), (1, 1, 1))
+        self.assertEqual(
+            dict(File.objects.values_list("original_filename", "integrity")),
+            {"intact.bin": "ok", "corrupt.bin": "corrupt", "missing.bin": "missing"},
+        )
+
+        integrity = self.client.get("/api/files/integrity").json()["data"]
+        self.assertEqual(integrity["due"], 0)
+        problems = sorted(problem["original_filename"] for problem in integrity["problems"])
+        self.assertEqual(problems, ["corrupt.bin", "missing.bin"])
+        self.assertEqual(self.scrubber().run(), 0)
+
+    def test_run_resumes_with_the_files_left(self):
+        self.assertEqual(self.scrubber(workers=1).run(limit=1), 1)
+        verified = File.objects.get(last_verified_at__isnull=False)
+        last_verified_at = verified.last_verified_at
+
+        self.assertEqual(self.scrubber().run(), 2)
+        verified.refresh_from_db()
+        self.assertEqual(verified.last_verified_at, last_verified_at)
+        self.assertFalse(File.objects.exclude(integrity="ok").exists())
+
+    def test_reads_are_rate_limited(self):
+        started = time.monotonic()
+        # A second of budget up front, the other 20 KB wait for half a second
+        self.assertEqual(self.scrubber(workers=3, max_rate=40_000).run(), 3)
+        self.assertGreaterEqual(time.monotonic() - started, 0.45)
+
+
+class RateLimiterTests(SimpleTestCase):
+    def test_budget_is_shared_across_threads(self):
+        limiter = RateLimiter(10_000)
+        started = time.monotonic()
+        threads = [threading.Thread(target=limiter.consume, args=(5_000,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        self.assertGreaterEqual(elapsed, 0.95)
+        self.assertLess(elapsed, 2)
+
+
+class ImportTreeTests(VaultTestMixin, TransactionTestCase):
+    files = {
+        "a/1.txt": b"one",
+        "a/b/2.txt": b"two",
+        "a/b/dup.txt": b"one",
+        "c/3.txt": b"three",
+        "top.txt": b"top",
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        for relative, content in self.files.items():
+            path = os.path.join(self.root, *relative.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as file:
+                file.write(content)
+        self.journal = os.path.join(self.media_root, "import.jsonl")
+
+    def import_tree(self, *args):
+        out, err = io.StringIO(), io.StringIO()
+        call_command(
+            "import_tree", self.root, "--journal", self.journal, "--processes", "1", "--batch-size", "2", *args,
+            stdout=out, stderr=err,
+        )
+        return out.getvalue(), err.getvalue()
+
+    def test_walk_starts_after_the_checkpoint(self):
+        relative = [path for _, path in walk(self.root)]
+        self.assertEqual(relative, list(self.files))
+        self.assertEqual([path for _, path in walk(self.root, ("a", "b", "2.txt"))], relative[2:])
+        self.assertEqual([path for _, path in walk(self.root, ("c", "3.txt"))], ["top.txt"])
+
+    def test_interrupted_import_resumes(self):
+        store = TreeImporter.store
+
+        def store_once(importer, batch, tasks):
+            if importer.files:
+                raise KeyboardInterrupt
+            store(importer, batch, tasks)
+
+        with mock.patch.object(TreeImporter, "store", store_once), self.assertRaises(KeyboardInterrupt):
+            self.import_tree()
+        self.assertEqual(sorted(Entry.objects.values_list("name", flat=True)), ["a/1.txt", "a/b/2.txt"])
+        # A record cut short by the crash is dropped
+        with open(self.journal, "a") as journal:
+            journal.write('{"root": ')
+
+        out, err = self.import_tree()
+        self.assertIn("Resuming after a/b/2.txt (2 files imported before)", err)
+        self.assertIn("Imported 3 files", out)
+        self.assertIn("(5 in total): 4 created, 1 deduplicated, 0 failed", out)
+        self.assertEqual(sorted(Entry.objects.values_list("name", flat=True)), sorted(self.files))
+        self.assertEqual(File.objects.count(), 4)
+        self.assertEqual(Journal(self.journal).last()["last"], "top.txt")
+
+        out, _ = self.import_tree()
+        self.assertIn("Imported 0 files", out)
+        out, _ = self.import_tree("--restart")
+        self.assertIn("0 created, 5 deduplicated", out)
+
+    def test_journal_of_another_tree_is_refused(self):
+        Journal(self.journal).record({"root": "/elsewhere", "last": "x", "counts": {}, "bytes": 0})
+        with self.assertRaises(CommandError):
+            self.import_tree()
+
+
+@override_settings(FILES_DEFER_HASHING=False)
+class BackupTests(VaultTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.destination = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.destination, ignore_errors=True)
+        self.contents = {name: os.urandom(4000) for name in ("a.bin", "b.bin", "c.bin")}
+
+    def command(self, name, *args):
+        out = io.StringIO()
+        call_command(name, self.destination, *args, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def lose_everything(self):
+        Entry.objects.all().delete()
+        File.objects.all().delete()
+        shutil.rmtree(os.path.join(self.media_root, "uploads"))
+
+    def download(self, name):
+        entry = Entry.objects.get(name=name)
+        return b"".join(self.client.get(f"/api/files/{entry.pk}/download/").streaming_content)
+
+    def test_incremental_backup_and_restore(self):
+        self.upload("a.bin", self.contents["a.bin"])
+        self.upload("b.bin", self.contents["b.bin"])
+        self.assertIn(f"2 blobs ({format_bytes(8000)}) copied of 2 checked (full)", self.command("backup_vault"))
+        first = sorted(os.listdir(os.path.join(self.destination, SNAPSHOTS_DIR)))[0]
+
+        self.upload("c.bin", self.contents["c.bin"])
+        self.upload("copy of a.bin", self.contents["a.bin"])
+        # A backup killed before its manifest was written is discarded
+        os.makedirs(os.path.join(self.destination, SNAPSHOTS_DIR, "99990101T000000000000Z"))
+        self.assertIn(f"1 blobs ({format_bytes(4000)}) copied of 1 checked since {first}", self.command("backup_vault"))
+        self.assertEqual(len(os.listdir(os.path.join(self.destination, SNAPSHOTS_DIR))), 2)
+        self.assertEqual(sum(len(names) for _, _, names in os.walk(os.path.join(self.destination, BLOBS_DIR))), 3)
+
+        self.lose_everything()
+        out = self.command("restore_vault")
+        self.assertIn("3 of 3 blobs copied", out)
+        self.assertIn("Verified 3 files, all ok", out)
+        self.assertEqual(Entry.objects.count(), 4)
+        self.assertEqual(self.download("copy of a.bin"), self.contents["a.bin"])
+
+        with self.assertRaises(CommandError):
+            self.command("restore_vault", "--snapshot", first)
+        self.command("restore_vault", "--snapshot", first, "--force")
+        self.assertEqual(sorted(Entry.objects.values_list("name", flat=True)), ["a.bin", "b.bin"])
+
+    def test_damaged_backups_are_detected(self):
+        self.upload("a.bin", self.contents["a.bin"])
+        self.command("backup_vault")
+        snapshots = os.path.join(self.destination, SNAPSHOTS_DIR)
+        snapshot = os.path.join(snapshots, os.listdir(snapshots)[0])
+        blob = os.path.join(self.destination, BLOBS_DIR, File.objects.get().file.name)
+        with open(blob, "r+b") as backed_up:
+            backed_up.write(b"\x00" * 16)
+
+        self.lose_everything()
+        with self.assertRaisesMessage(CommandError, "Restored files failed verification: 1 corrupt"):
+            self.command("restore_vault")
+
+        with open(os.path.join(snapshot, DATABASE_NAME), "ab") as database:
+            database.write(b"\x00")
+        with self.assertRaisesMessage(CommandError, "does not match its manifest"):
+            self.command("restore_vault", "--force")
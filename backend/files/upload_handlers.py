@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.core.files.uploadhandler import (
+    MemoryFileUploadHandler,
+    TemporaryFileUploadHandler,
+)
+from files.hashing import HASH_TYPE, new_hasher
+
+
+class HashingUploadHandlerMixin:
+    """
+    Feed every chunk into the hasher while the multipart body is being parsed,
+    so the digest is ready as soon as the request body ends and the upload
+    never has to be read back just to be hashed.
+
+    Only the handler that actually keeps the bytes hashes them: the memory
+    handler passes chunks on untouched when the upload is too big for it.
+    With ``FILES_DEFER_HASHING`` nothing is hashed here, most uploads are
+    then never hashed during the request at all (see ``files.dedup``), and
+    the settings only install these handlers when hashing is not deferred.
+    """
+
+    def new_file(self, *args, **kwargs):
+        # set up before super(), the memory handler claims the file by raising StopFutureHandlers
+        self.hasher = None if settings.FILES_DEFER_HASHING else new_hasher()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        remaining = super().receive_data_chunk(raw_data, start)
+        if remaining is None and self.hasher:
+            self.hasher.update(raw_data)
+        return remaining
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None and self.hasher:
+            file.hash_type = HASH_TYPE
+            file.hash_value = self.hasher.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
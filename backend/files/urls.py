@@ -1,11 +1,33 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import EntryViewSet, FileSavingsAPIView
+from .aio import offload
+from .views import (
+    EntryViewSet,
+    FileBulkUploadAPIView,
+    FileIntegrityAPIView,
+    FileProbeAPIView,
+    FileSavingsAPIView,
+    UploadSessionViewSet,
+)
 
 router = DefaultRouter()
 router.register(r'files', EntryViewSet)
+router.register(r'uploads', UploadSessionViewSet)
 
-urlpatterns = [
+# Upload, download and stats endpoints are served as async views backed by
+# the I/O pool (see files.aio) and take precedence over the router's routes
+async_urlpatterns = [
+    path('files/', offload(EntryViewSet.as_view({'get': 'list', 'post': 'create'}))),
+    path('files/facets/', offload(EntryViewSet.as_view({'get': 'facets'}))),
+    path('files/archive/', offload(EntryViewSet.as_view({'get': 'archive', 'post': 'archive'}))),
+    path('files/<str:pk>/download/', offload(EntryViewSet.as_view({'get': 'download'}))),
+    path('files/savings', offload(FileSavingsAPIView.as_view())),
+    path('files/integrity', offload(FileIntegrityAPIView.as_view())),
+    path('files/bulk', offload(FileBulkUploadAPIView.as_view())),
+    path('uploads/<str:pk>/chunks/', offload(UploadSessionViewSet.as_view({'put': 'chunks'}))),
+]
+
+urlpatterns = async_urlpatterns + [
     path('', include(router.urls)),
-    path('files/savings', FileSavingsAPIView.as_view())
+    path('files/probe', FileProbeAPIView.as_view()),
 ] 
\ No newline at end of file
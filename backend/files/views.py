@@ -1,63 +1,270 @@
 import math
+import zipfile
 
+from common.constants import ErrorMessages
 from common.exceptions import BadRequestError
-from common.filters import BasePageNumberPagination
+from common.filters import BaseCursorPagination, BasePageNumberPagination
 from common.response import CreatedResponse, EmptyResponse, SuccessResponse
 from common.utils import format_bytes
-from django.db.models import Count, F, Q, Sum
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Func, Max, Min, Q, Sum
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.http import content_disposition_header
 from django_filters.rest_framework import DjangoFilterBackend
+from files.archives import ZipStream
+from files.batch import BatchDelete
+from files.cache import cache_response
+from files.bulk import ArchiveTooLarge, BulkIngest, BulkItem, close_uploads, extract_archive
+from files.downloads import RangeNotSatisfiable, accepted_encoding, get_transfer, is_etag_match, parse_range_header
 from files.filters import EntryFilter
-from files.models import Entry, File
-from files.serializers import EntrySerializer
-from rest_framework import status, views, viewsets
+from files.models import Entry, File, StorageStats, UploadChunk, UploadSession
+from files.scrub import Scrubber
+from files.serializers import BatchDeleteSerializer, EntryListProjection, EntrySelectionSerializer, EntrySerializer, ProbeItemSerializer, UploadSessionSerializer
+from files.sessions import AssembledFile, allocate_part, claim_for_completion, remove_part, write_chunk
+from rest_framework import mixins, status, views, viewsets
+from rest_framework.decorators import action
 from rest_framework.filters import OrderingFilter, SearchFilter
 from rest_framework.response import Response
 
 # Create your views here.
 
 
+class Unindexed(Func):
+    """The value of a column, written ``+column`` so SQLite uses no index to produce it"""
+
+    template = "+%(expressions)s"
+
+
+def build_entry_data(file_obj, name=None):
+    """Shape an uploaded file the way ``EntrySerializer`` expects it"""
+    return {
+        "name": name or file_obj.name,
+        "file": {
+            "file": file_obj,
+            "original_filename": file_obj.name,
+            "file_type": file_obj.content_type,
+            "size": file_obj.size,
+        },
+    }
+
+
 class FileSavingsAPIView(views.APIView):
     http_method_names = ["get"]
 
     def get_storage_stats(self):
-        result = File.objects.annotate(reference_count=Count("entries")).aggregate(
-            actual_space=Sum("size"),
-            would_be_space=Sum(F("size") * F("reference_count")),
-            total_files=Count("id"),
-            total_entries=Sum("reference_count"),
-        )
-
-        actual_space = result["actual_space"] or 0
-        would_be_space = result["would_be_space"] or 0
-        space_saved = would_be_space - actual_space
+        stats = StorageStats.load()
 
+        space_saved = stats.would_be_space - stats.actual_space
         savings_percentage = (
-            (space_saved / would_be_space * 100) if would_be_space > 0 else 0
+            (space_saved / stats.would_be_space * 100) if stats.would_be_space > 0 else 0
         )
         deduplication_ratio = (
-            (result["total_entries"] / result["total_files"])
-            if result["total_files"] > 0
+            (stats.total_entries / stats.total_files)
+            if stats.total_files > 0
             else 0
         )
 
+        chunk_space_saved = stats.chunk_referenced_space - stats.chunk_stored_space
+        chunk_savings_percentage = (
+            (chunk_space_saved / stats.chunk_referenced_space * 100)
+            if stats.chunk_referenced_space > 0
+            else 0
+        )
+
+        compression_space_saved = stats.actual_space - stats.stored_space
+        compression_savings_percentage = (
+            (compression_space_saved / stats.actual_space * 100) if stats.actual_space > 0 else 0
+        )
+
         return {
-            "actual_space": format_bytes(actual_space),
+            "actual_space": format_bytes(stats.actual_space),
             "space_saved": format_bytes(space_saved),
-            "would_be_space": format_bytes(would_be_space),
+            "would_be_space": format_bytes(stats.would_be_space),
             "savings_percentage": f"{savings_percentage:.1f}%",
             "deduplication_ratio": f"{deduplication_ratio:.1f}",
-            "total_files": result["total_files"],
-            "total_entries": result["total_entries"],
+            "total_files": stats.total_files,
+            "total_entries": stats.total_entries,
+            # Savings of the chunked storage engine beyond whole-file deduplication
+            "chunk_stored_space": format_bytes(stats.chunk_stored_space),
+            "chunk_space_saved": format_bytes(chunk_space_saved),
+            "chunk_savings_percentage": f"{chunk_savings_percentage:.1f}%",
+            "total_chunks": stats.total_chunks,
+            # Savings of compression at rest on top of both
+            "stored_space": format_bytes(stats.stored_space),
+            "compression_space_saved": format_bytes(compression_space_saved),
+            "compression_savings_percentage": f"{compression_savings_percentage:.1f}%",
         }
 
+    @cache_response
     def get(self, request, *args, **kwargs):
         data = self.get_storage_stats()
         return SuccessResponse(data).send()
 
 
+class FileIntegrityAPIView(views.APIView):
+    """
+    Where the integrity scrubber stands (see ``files.scrub``): files and bytes
+    per outcome of their last verification, how many are due, the oldest
+    verification and the files whose blob is corrupt or missing.
+    """
+
+    http_method_names = ["get"]
+    max_problems = 100
+
+    def get(self, request, *args, **kwargs):
+        rows = File.objects.order_by().values("integrity").annotate(count=Count("pk"), size=Sum("size"))
+        totals = {integrity: {"count": 0, "size": 0} for integrity in File.Integrity.values}
+        totals.update({row["integrity"]: row for row in rows})
+        verified = File.objects.aggregate(oldest=Min("last_verified_at"), latest=Max("last_verified_at"))
+        problems = File.objects.filter(
+            integrity__in=[File.Integrity.CORRUPT, File.Integrity.MISSING]
+        ).order_by("-last_verified_at")[: self.max_problems]
+
+        data = {
+            "integrity": {
+                integrity: {"files": row["count"], "size": format_bytes(row["size"] or 0)}
+                for integrity, row in totals.items()
+            },
+            "due": Scrubber(max_age=settings.FILES_SCRUB_MAX_AGE).due().count(),
+            "oldest_verified_at": verified["oldest"],
+            "latest_verified_at": verified["latest"],
+            "problems": [
+                {
+                    "id": file.pk,
+                    "original_filename": file.original_filename,
+                    "file": file.file.name,
+                    "integrity": file.integrity,
+                    "last_verified_at": file.last_verified_at,
+                }
+                for file in problems
+            ],
+        }
+        return SuccessResponse(data).send()
+
+
+class FileProbeAPIView(views.APIView):
+    """
+    Hash-first "instant upload": the client sends the sha256, size and name of
+    one or many files, every hash that is already stored gets its entry created
+    right away and the response lists the hashes whose bytes still need uploading.
+    Only files hashed with sha256 can match, an upload of anything else listed
+    as missing is still deduplicated when it arrives.
+    """
+
+    http_method_names = ["post"]
+    max_batch_size = 1000
+
+    def get_items(self, request):
+        data = request.data
+        if isinstance(data, dict) and "files" in data:
+            data = data["files"]
+        many = isinstance(data, list)
+        if many and len(data) > self.max_batch_size:
+            raise BadRequestError(ErrorMessages.ProbeBatchTooLarge)
+
+        serializer = ProbeItemSerializer(data=data, many=many)
+        if not serializer.is_valid():
+            raise BadRequestError()
+        return serializer.validated_data if many else [serializer.validated_data]
+
+    def post(self, request, *args, **kwargs):
+        items = self.get_items(request)
+
+        # A single indexed lookup resolves every hash in the batch, the files
+        # are claimed first so the garbage collector cannot remove them meanwhile
+        candidates = File.objects.filter(
+            hash_value__in={item["sha256"] for item in items}, hash_type="sha256"
+        )
+        candidates.update(referenced_at=timezone.now())
+        stored = candidates.in_bulk(field_name="hash_value")
+
+        entries = []
+        missing = []
+        for item in items:
+            file = stored.get(item["sha256"])
+            if file is None or file.size != item["size"]:
+                if item["sha256"] not in missing:
+                    missing.append(item["sha256"])
+                continue
+            entries.append(Entry(file=file, name=item.get("name") or file.original_filename))
+
+        with transaction.atomic():
+            Entry.objects.bulk_create(entries)
+            StorageStats.record(
+                total_entries=len(entries),
+                would_be_space=sum(entry.file.size for entry in entries),
+            )
+
+        data = {
+            "entries": EntrySerializer(entries, many=True, context={"request": request}).data,
+            "missing": missing,
+        }
+        return SuccessResponse(data).send()
+
+
+class FileBulkUploadAPIView(views.APIView):
+    """
+    Upload many files in one multipart request, either as repeated ``files``
+    fields (with optional matching ``names``) or as a zip ``archive``. The
+    response reports what became of every file.
+    """
+
+    http_method_names = ["post"]
+    max_batch_size = 1000
+
+    def get_items(self, request):
+        uploads = request.FILES.getlist("files")
+        names = request.data.getlist("names") if hasattr(request.data, "getlist") else []
+        items = [BulkItem(upload, names[i] if i < len(names) else None) for i, upload in enumerate(uploads)]
+
+        archive = request.FILES.get("archive")
+        if archive is not None:
+            try:
+                members = extract_archive(archive, self.max_batch_size - len(items))
+            except zipfile.BadZipFile:
+                raise BadRequestError(ErrorMessages.InvalidArchive)
+            except ArchiveTooLarge:
+                raise BadRequestError(ErrorMessages.ArchiveTooLarge)
+            if members is None:
+                raise BadRequestError(ErrorMessages.BulkBatchTooLarge)
+            items.extend(BulkItem(upload, name) for upload, name in members)
+
+        if not items:
+            raise BadRequestError()
+        if len(items) > self.max_batch_size:
+            raise BadRequestError(ErrorMessages.BulkBatchTooLarge)
+        return items
+
+    def represent(self, item, request):
+        return {
+            "name": item.name,
+            "status": item.status,
+            "entry": EntrySerializer(item.entry, context={"request": request}).data if item.entry else None,
+            "error": item.error,
+        }
+
+    def post(self, request, *args, **kwargs):
+        items = self.get_items(request)
+        try:
+            BulkIngest().ingest(items)
+        finally:
+            close_uploads(items)
+
+        results = [self.represent(item, request) for item in items]
+        counts = {
+            state: sum(item.status == state for item in items)
+            for state in (BulkItem.CREATED, BulkItem.DEDUPLICATED, BulkItem.FAILED)
+        }
+        return CreatedResponse({"results": results, **counts}).send()
+
+
 class EntryViewSet(viewsets.ModelViewSet):
-    queryset = Entry.objects.all()
+    # Load the file in the same query as its entry
+    queryset = Entry.objects.select_related("file")
     serializer_class = EntrySerializer
     http_method_names = ["get", "post", "delete"]
 
@@ -65,9 +272,30 @@ class EntryViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend, OrderingFilter, SearchFilter]
     filterset_class = EntryFilter
 
-    # Pagination
+    # Pagination, keyset pagination when a cursor is sent or ?pagination=cursor
     pagination_class = BasePageNumberPagination
+    cursor_pagination_class = BaseCursorPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator"):
+            params = self.request.query_params
+            if "cursor" in params or params.get("pagination") == "cursor":
+                self._paginator = self.cursor_pagination_class()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_known_count(self, queryset):
+        """The total without a COUNT over every entry: the stats keep it, exactly, when nothing is filtered"""
+        if queryset.query.where:
+            return None
+        return StorageStats.load().total_entries
+
+    # Total for ``?count=estimate``, the known one is exact and just as cheap
+    get_estimated_count = get_known_count
 
+    @cache_response
     def list(self, request, *args, **kwargs):
         """
         Override list to add custom response format if needed
@@ -75,28 +303,65 @@ class EntryViewSet(viewsets.ModelViewSet):
         # The filtering is automatically handled by django-filter
         queryset = self.filter_queryset(self.get_queryset())
 
+        # Rows are read as plain values and rendered without ModelSerializer overhead
+        projection = EntryListProjection(request)
+        queryset = projection.project(queryset)
+
         page = self.paginate_queryset(queryset)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return SuccessResponse(self.get_paginated_response(serializer.data)).send()
+            return SuccessResponse(self.get_paginated_response(projection.to_representation(page))).send()
+
+        return SuccessResponse(projection.to_representation(queryset)).send()
+
+    @action(detail=False, methods=["get"])
+    @cache_response
+    def facets(self, request, *args, **kwargs):
+        """
+        Entry counts and total bytes per category and MIME type of the
+        entries matching the list filters, from a single grouped query
+        """
+        # Ranking only orders results, it would split the groups
+        params = request.query_params.copy()
+        params.pop("rank", None)
+        filterset = self.filterset_class(data=params, queryset=Entry.objects.all(), request=request)
+        if not filterset.is_valid():
+            raise BadRequestError()
+
+        queryset = filterset.qs.order_by()
+        # Filtered groups are collected in a temporary b-tree: walking every
+        # entry in the order of the (category, mime_type) index would avoid
+        # that sort but keeps the filters from using their own indexes
+        group_by = Unindexed if queryset.query.where else F
+        groups = queryset.values(
+            group_category=group_by("category"), group_mime_type=group_by("mime_type")
+        ).annotate(entries=Count("*"), bytes=Sum("size"))
+        categories = {}
+        for group in groups:
+            category = categories.setdefault(
+                group["group_category"], {"category": group["group_category"], "entries": 0, "bytes": 0, "types": []}
+            )
+            category["entries"] += group["entries"]
+            category["bytes"] += group["bytes"]
+            category["types"].append(
+                {"mime_type": group["group_mime_type"], "entries": group["entries"], "bytes": group["bytes"]}
+            )
 
-        serializer = self.get_serializer(queryset, many=True)
-        return SuccessResponse(serializer.data).send()
+        categories = sorted(categories.values(), key=lambda category: -category["entries"])
+        for category in categories:
+            category["types"].sort(key=lambda group: -group["entries"])
+        data = {
+            "entries": sum(category["entries"] for category in categories),
+            "bytes": sum(category["bytes"] for category in categories),
+            "categories": categories,
+        }
+        return SuccessResponse(data).send()
 
     def create(self, request, *args, **kwargs):
         file_obj = request.FILES.get("file") or request.FILES.get("file.file")
         if not file_obj:
             raise BadRequestError("No file was uploaded")
 
-        data = {
-            "name": request.data.get("name") or file_obj.name,
-            "file": {
-                "file": file_obj,
-                "original_filename": file_obj.name,
-                "file_type": file_obj.content_type,
-                "size": file_obj.size,
-            },
-        }
+        data = build_entry_data(file_obj, request.data.get("name"))
 
         serializer = self.get_serializer(data=data)
         if not serializer.is_valid():
@@ -110,5 +375,218 @@ class EntryViewSet(viewsets.ModelViewSet):
 
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
-        self.perform_destroy(instance)
+        with transaction.atomic():
+            self.perform_destroy(instance)
+            StorageStats.record(total_entries=-1, would_be_space=-instance.file.size)
         return EmptyResponse().send()
+
+    def select_entries(self, params):
+        """Entries picked by validated ``ids`` and/or list ``filters``"""
+        queryset = Entry.objects.all()
+        if "ids" in params:
+            queryset = queryset.filter(pk__in=params["ids"])
+        if "filters" in params:
+            # Ranking only orders results, it is meaningless for a selection
+            filters = {key: value for key, value in params["filters"].items() if key != "rank"}
+            filterset = self.filterset_class(data=filters, queryset=queryset, request=self.request)
+            if not filterset.is_valid():
+                raise BadRequestError()
+            applied = [
+                value
+                for key, value in filterset.form.cleaned_data.items()
+                if value not in (None, "")
+            ]
+            if not applied:
+                raise BadRequestError()
+            queryset = filterset.qs
+        return queryset
+
+    @action(detail=False, methods=["post"], url_path="batch-delete")
+    def batch_delete(self, request, *args, **kwargs):
+        """
+        Delete many entries at once, picked by ``ids`` and/or any list
+        ``filters``, in batches of ``batch_size``. ``dry_run`` only reports
+        the entries and bytes that would go.
+        """
+        serializer = BatchDeleteSerializer(data=request.data)
+        if not serializer.is_valid():
+            raise BadRequestError()
+        params = serializer.validated_data
+
+        queryset = self.select_entries(params)
+        result = BatchDelete(queryset, params["batch_size"], params["dry_run"]).run()
+        return SuccessResponse(result).send()
+
+    @action(detail=False, methods=["get", "post"])
+    def archive(self, request, *args, **kwargs):
+        """
+        Download a selection of entries as one ZIP archive, streamed from the
+        blobs while it is built. The selection is a JSON body like the batch
+        delete one, or on GET the list filters plus ``ids`` as query parameters.
+        """
+        if request.method == "GET":
+            params = request.query_params
+            ids = [value for item in params.getlist("ids") for value in item.split(",") if value]
+            filters = {key: params.get(key) for key in params if key != "ids"}
+            data = {**({"ids": ids} if ids else {}), **({"filters": filters} if filters else {})}
+        else:
+            data = request.data
+        serializer = EntrySelectionSerializer(data=data)
+        if not serializer.is_valid():
+            raise BadRequestError()
+
+        response = StreamingHttpResponse(
+            ZipStream(self.select_entries(serializer.validated_data)), content_type="application/zip"
+        )
+        filename = timezone.localtime().strftime("files-%Y%m%d-%H%M%S.zip")
+        response["Content-Disposition"] = content_disposition_header(True, filename)
+        return response
+
+    @action(detail=True, methods=["get"])
+    def download(self, request, *args, **kwargs):
+        """
+        Download the entry's content. The content hash is the ETag, so
+        ``If-None-Match`` revalidates for free, and byte ranges (single or
+        multiple) let clients resume and seek; ``If-Range`` drops the range
+        when the client holds another version.
+        """
+        entry = self.get_object()
+        file = entry.file
+        # Until a file stored with deferred hashing is hashed its id stands in
+        identity_etag = f'"{file.hash_value or file.pk}"'
+        # A compressed blob goes out as stored when the client accepts its
+        # encoding, ranges always address the decoded content
+        encoding = None if "Range" in request.headers else accepted_encoding(request, file.codec)
+        etag = f'"{identity_etag[1:-1]}-{encoding}"' if encoding else identity_etag
+
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match and is_etag_match(if_none_match, etag):
+            response = HttpResponseNotModified()
+            response["ETag"] = etag
+            return response
+
+        ranges = None
+        range_header = request.headers.get("Range")
+        if_range = request.headers.get("If-Range")
+        if range_header and (not if_range or if_range.strip() == identity_etag):
+            try:
+                ranges = parse_range_header(range_header, file.size)
+            except RangeNotSatisfiable:
+                response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+                response["Content-Range"] = f"bytes */{file.size}"
+                return response
+
+        content_type = file.file_type or "application/octet-stream"
+        if encoding:
+            response = get_transfer(request).encoded(file, content_type, encoding)
+        else:
+            response = get_transfer(request).respond(file, content_type, ranges)
+        if file.codec:
+            patch_vary_headers(response, ["Accept-Encoding"])
+        response["ETag"] = etag
+        response["Accept-Ranges"] = "bytes"
+        response["Content-Disposition"] = content_disposition_header(
+            True, entry.name or file.original_filename
+        )
+        return response
+
+
+class UploadSessionViewSet(
+    mixins.CreateModelMixin,
+    mixins.RetrieveModelMixin,
+    mixins.DestroyModelMixin,
+    viewsets.GenericViewSet,
+):
+    """
+    Resumable chunked uploads: create a session, PUT chunks by offset in any
+    order (or in parallel), GET the session to see the missing ranges, then
+    complete it to hand the assembled file to the regular dedup path.
+    """
+
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+    http_method_names = ["get", "post", "put", "delete"]
+    max_chunk_size = 64 * 1024 * 1024
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            raise BadRequestError()
+        session = serializer.save()
+        allocate_part(session)
+        return CreatedResponse(self.get_serializer(session).data).send()
+
+    def retrieve(self, request, *args, **kwargs):
+        return SuccessResponse(self.get_serializer(self.get_object()).data).send()
+
+    def destroy(self, request, *args, **kwargs):
+        session = self.get_object()
+        remove_part(session)
+        session.delete()
+        return EmptyResponse().send()
+
+    @action(detail=True, methods=["put"])
+    def chunks(self, request, *args, **kwargs):
+        session = self.get_object()
+        if session.status != UploadSession.Status.OPEN:
+            raise BadRequestError(ErrorMessages.UploadSessionClosed)
+
+        try:
+            offset = int(request.query_params.get("offset", ""))
+            length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            raise BadRequestError(ErrorMessages.InvalidChunk)
+        if offset < 0 or length <= 0 or length > self.max_chunk_size or offset + length > session.size:
+            raise BadRequestError(ErrorMessages.InvalidChunk)
+
+        written = write_chunk(session, offset, request.stream, length)
+        if written != length:
+            # The client went away mid-chunk, nothing is recorded so it gets re-sent
+            raise BadRequestError(ErrorMessages.InvalidChunk)
+
+        UploadChunk.objects.update_or_create(session=session, offset=offset, defaults={"size": length})
+        return SuccessResponse(self.get_serializer(session).data).send()
+
+    @action(detail=True, methods=["post"])
+    def complete(self, request, *args, **kwargs):
+        session = self.get_object()
+        if session.status == UploadSession.Status.COMPLETE and session.entry_id:
+            serializer = EntrySerializer(session.entry, context=self.get_serializer_context())
+            return SuccessResponse(serializer.data).send()
+        if session.missing_ranges():
+            raise BadRequestError(ErrorMessages.UploadSessionIncomplete)
+
+        # Only one request may finalize a session
+        if not claim_for_completion(session):
+            raise BadRequestError(ErrorMessages.UploadSessionClosed)
+
+        try:
+            file_obj = AssembledFile(session.part_path, session.original_filename, session.file_type)
+        except FileNotFoundError:
+            # A request that died after moving the part file into storage
+            session.delete()
+            raise BadRequestError(ErrorMessages.UploadSessionExpired)
+
+        try:
+            serializer = EntrySerializer(
+                data=build_entry_data(file_obj, session.name),
+                context=self.get_serializer_context(),
+            )
+            if not serializer.is_valid():
+                raise BadRequestError()
+            entry = serializer.save()
+        except Exception:
+            UploadSession.objects.filter(pk=session.pk).update(status=UploadSession.Status.OPEN)
+            raise
+        finally:
+            file_obj.close()
+
+        # The part file was moved into storage, or is redundant after a dedup hit
+        remove_part(session)
+        with transaction.atomic():
+            session.chunks.all().delete()
+            session.status = UploadSession.Status.COMPLETE
+            session.entry = entry
+            session.save(update_fields=["status", "entry", "updated_at"])
+
+        return CreatedResponse(serializer.data).send()
@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
+
+
+class JobsConfig(AppConfig):
+  default_auto_field = "django.db.models.BigAutoField"
+  name = "jobs"
+
+  def ready(self):
+    # Job types are declared in the tasks module of each app
+    autodiscover_modules("tasks")
@@ -0,0 +1,35 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from jobs.registry import registry
+from jobs.worker import Worker
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs, stops after the running jobs on SIGINT or SIGTERM"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=settings.JOBS_WORKER_CONCURRENCY, help="Jobs run at once")
+        parser.add_argument("--names", nargs="+", help="Only run jobs of these types")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between looks for due jobs")
+        parser.add_argument("--once", action="store_true", help="Exit once no job is due")
+
+    def handle(self, *args, **options):
+        unknown = set(options["names"] or ()) - set(registry)
+        if unknown:
+            raise CommandError(f"Unknown job types: {', '.join(sorted(unknown))}")
+
+        worker = Worker(
+            names=options["names"],
+            concurrency=options["concurrency"],
+            poll_interval=options["poll_interval"],
+            retention=settings.JOBS_RETENTION,
+            log=self.stderr.write,
+        )
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: worker.stop())
+
+        self.stdout.write(f"Worker {worker.id} running {', '.join(worker.names) or 'no job types'}")
+        processed = worker.run(once=options["once"])
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} jobs, {worker.failed} failed"))
@@ -0,0 +1,40 @@
+from common.models import BaseModel
+from django.db import models
+from django.utils import timezone
+
+
+class Job(BaseModel):
+    """
+    A unit of background work, stored in the application database so no
+    broker is needed. Workers lease a job before running it, a worker that
+    dies leaves the lease to expire and another worker picks the job up.
+    """
+
+    class Status(models.TextChoices):
+        QUEUED = "queued"
+        RUNNING = "running"
+        SUCCEEDED = "succeeded"
+        FAILED = "failed"
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    # Not picked up before this time, pushed back by the backoff of retries
+    run_at = models.DateTimeField(default=timezone.now)
+    leased_until = models.DateTimeField(null=True, blank=True)
+    leased_by = models.CharField(max_length=100, blank=True, default="")
+    last_error = models.TextField(blank=True, default="")
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["status", "run_at"]),  # Claiming due jobs
+            models.Index(fields=["name", "status"]),  # Concurrency limits and stats
+            models.Index(fields=["status", "finished_at"]),  # Pruning
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
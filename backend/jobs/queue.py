@@ -0,0 +1,173 @@
+import random
+import traceback
+from datetime import timedelta
+
+from django.db.models import Count, F, IntegerField, Min, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import LessThan
+from django.utils import timezone
+from jobs.models import Job
+from jobs.registry import registry
+
+# Due jobs considered per claim, the first one whose conditional update wins is taken
+CLAIM_CANDIDATES = 10
+
+
+def enqueue(name, payload=None, delay=0):
+    """
+    Queue a job. The row is written in the caller's transaction, so a job
+    enqueued next to the data it works on only becomes visible to workers
+    once that data is committed, and disappears with it on rollback.
+    """
+    return enqueue_many(name, [payload], delay)[0]
+
+
+def enqueue_many(name, payloads, delay=0):
+    """Queue a job of type ``name`` per payload in a single insert"""
+    if name not in registry:
+        raise ValueError(f"Unknown job type {name!r}")
+    job_type = registry[name]
+    run_at = timezone.now() + timedelta(seconds=delay)
+    return Job.objects.bulk_create(
+        Job(name=name, payload=payload or {}, max_attempts=job_type.max_attempts, run_at=run_at)
+        for payload in payloads
+    )
+
+
+def claimable(now):
+    # Queued and due, or running under a lease that expired with its worker
+    return (Q(status=Job.Status.QUEUED, run_at__lte=now) | Q(status=Job.Status.RUNNING, leased_until__lt=now)) & Q(
+        attempts__lt=F("max_attempts")
+    )
+
+
+def claim(worker_id, names):
+    """
+    Lease the next due job of one of ``names`` to ``worker_id``, None when
+    there is none. The lease is a single conditional UPDATE that re-checks
+    the job is still claimable and that its type is below its concurrency
+    limit, so two workers racing for a job cannot both win it.
+    """
+    now = timezone.now()
+    candidates = (
+        Job.objects.filter(claimable(now), name__in=names)
+        .order_by("run_at", "created_at")
+        .values_list("pk", "name")[:CLAIM_CANDIDATES]
+    )
+    for pk, name in candidates:
+        job_type = registry[name]
+        queryset = Job.objects.filter(claimable(now), pk=pk)
+        limit = job_type.get_concurrency()
+        if limit is not None:
+            running = (
+                Job.objects.filter(name=OuterRef("name"), status=Job.Status.RUNNING, leased_until__gte=now)
+                .values("name")
+                .annotate(count=Count("pk"))
+                .values("count")
+            )
+            queryset = queryset.filter(
+                LessThan(Coalesce(Subquery(running, output_field=IntegerField()), 0), Value(limit))
+            )
+        claimed = queryset.update(
+            status=Job.Status.RUNNING,
+            attempts=F("attempts") + 1,
+            leased_until=now + timedelta(seconds=job_type.lease),
+            leased_by=worker_id,
+            updated_at=now,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def leased(job):
+    # Guards every state change, a worker whose lease was taken over must
+    # not overwrite the outcome of the worker that holds it now
+    return Job.objects.filter(pk=job.pk, status=Job.Status.RUNNING, leased_by=job.leased_by)
+
+
+def renew(worker_id, pks, lease):
+    """Extend the leases ``worker_id`` still holds on ``pks``"""
+    now = timezone.now()
+    return Job.objects.filter(pk__in=pks, status=Job.Status.RUNNING, leased_by=worker_id).update(
+        leased_until=now + timedelta(seconds=lease), updated_at=now
+    )
+
+
+def run(job):
+    """Run a claimed job and record the outcome, True when it succeeded"""
+    job_type = registry[job.name]
+    try:
+        job_type.func(**job.payload)
+    except Exception:
+        fail(job, job_type, traceback.format_exc())
+        return False
+    now = timezone.now()
+    leased(job).update(
+        status=Job.Status.SUCCEEDED, leased_until=None, last_error="", finished_at=now, updated_at=now
+    )
+    return True
+
+
+def fail(job, job_type, error):
+    now = timezone.now()
+    if job.attempts >= job.max_attempts:
+        leased(job).update(
+            status=Job.Status.FAILED, leased_until=None, last_error=error, finished_at=now, updated_at=now
+        )
+        return
+    # Exponential backoff with jitter, so jobs failing together do not all
+    # come back at the same moment
+    delay = job_type.backoff(job.attempts) * random.uniform(0.5, 1.0)
+    leased(job).update(
+        status=Job.Status.QUEUED,
+        run_at=now + timedelta(seconds=delay),
+        leased_until=None,
+        leased_by="",
+        last_error=error,
+        updated_at=now,
+    )
+
+
+def reap():
+    """Fail running jobs whose lease expired on their last attempt, returns how many"""
+    now = timezone.now()
+    return Job.objects.filter(
+        status=Job.Status.RUNNING, leased_until__lt=now, attempts__gte=F("max_attempts")
+    ).update(
+        status=Job.Status.FAILED,
+        leased_until=None,
+        last_error="The lease expired before the job finished.",
+        finished_at=now,
+        updated_at=now,
+    )
+
+
+def prune(retention):
+    """Delete jobs that succeeded more than ``retention`` seconds ago, failed jobs are kept"""
+    cutoff = timezone.now() - timedelta(seconds=retention)
+    deleted, _ = Job.objects.filter(status=Job.Status.SUCCEEDED, finished_at__lt=cutoff).delete()
+    return deleted
+
+
+def stats():
+    """Job counts per type and status, and how long the oldest due job has been waiting"""
+    now = timezone.now()
+    counts = {}
+    for row in Job.objects.order_by().values("name", "status").annotate(count=Count("pk")):
+        counts.setdefault(row["name"], {status: 0 for status in Job.Status.values})[row["status"]] = row["count"]
+
+    oldest = Job.objects.filter(status=Job.Status.QUEUED, run_at__lte=now).aggregate(oldest=Min("run_at"))["oldest"]
+    return {
+        "types": [
+            {
+                "name": name,
+                "registered": name in registry,
+                "concurrency": registry[name].get_concurrency() if name in registry else None,
+                "counts": counts.get(name, {status: 0 for status in Job.Status.values}),
+            }
+            for name in sorted(set(counts) | set(registry))
+        ],
+        "totals": {status: sum(row[status] for row in counts.values()) for status in Job.Status.values},
+        "oldest_queued_seconds": (now - oldest).total_seconds() if oldest else None,
+    }
@@ -0,0 +1,47 @@
+from django.conf import settings
+
+
+class JobType:
+    """
+    A kind of job and how the queue runs it. ``concurrency`` caps the jobs of
+    this type running at once across all workers, ``lease`` is how long a
+    worker may hold one before another worker may take it over, and failed
+    attempts are retried after ``retry_delay * 2 ** (attempt - 1)`` seconds.
+    """
+
+    def __init__(self, name, func, concurrency=None, max_attempts=5, lease=300, retry_delay=10, max_retry_delay=3600):
+        self.name = name
+        self.func = func
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+    def get_concurrency(self):
+        # JOBS_CONCURRENCY overrides the declared limits per job type
+        return settings.JOBS_CONCURRENCY.get(self.name, self.concurrency)
+
+    def backoff(self, attempt):
+        return min(self.retry_delay * 2 ** (attempt - 1), self.max_retry_delay)
+
+
+registry = {}
+
+
+def job(name, **options):
+    """
+    Declare a job type, e.g. in an app's ``tasks`` module::
+
+        @job("files.verify_blob", concurrency=2)
+        def verify_blob(file_id):
+            ...
+
+    The function is called with the job's payload as keyword arguments.
+    """
+
+    def register(func):
+        registry[name] = JobType(name, func, **options)
+        return func
+
+    return register
@@ -0,0 +1,12 @@
+from jobs.models import Job
+from rest_framework import serializers
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = [
+            "id", "name", "payload", "status", "attempts", "max_attempts", "run_at",
+            "leased_until", "leased_by", "last_error", "finished_at", "created_at", "updated_at",
+        ]
+        read_only_fields = fields
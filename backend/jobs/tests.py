@@ -0,0 +1,139 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from jobs import queue
+from jobs.models import Job
+from jobs.registry import JobType, registry
+from jobs.worker import Worker
+
+
+class QueueTestMixin:
+    """Registers the job types of ``job_types`` for the duration of each test"""
+
+    job_types = {}
+
+    def setUp(self):
+        super().setUp()
+        self.calls = []
+        types = {
+            name: JobType(name, getattr(self, func), **options) for name, (func, options) in self.job_types.items()
+        }
+        patch = mock.patch.dict(registry, types)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def record(self, **payload):
+        self.calls.append(payload)
+
+    def explode(self, **payload):
+        self.calls.append(payload)
+        raise RuntimeError("disk full")
+
+    def make_due(self, job):
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now() - timedelta(seconds=1))
+
+
+class RetryTests(QueueTestMixin, TransactionTestCase):
+    job_types = {"tests.explode": ("explode", {"max_attempts": 3, "retry_delay": 10})}
+
+    def test_failed_attempts_back_off_then_fail(self):
+        job = queue.enqueue("tests.explode", {"attempt": 1})
+        for attempt, delay in ((1, 10), (2, 20)):
+            claimed = queue.claim("worker", ["tests.explode"])
+            self.assertEqual((claimed.pk, claimed.attempts), (job.pk, attempt))
+            started = timezone.now()
+            self.assertFalse(queue.run(claimed))
+
+            job.refresh_from_db()
+            self.assertEqual(job.status, Job.Status.QUEUED)
+            self.assertIn("disk full", job.last_error)
+            # Jittered between half and all of the exponential delay
+            self.assertGreaterEqual(job.run_at, started + timedelta(seconds=delay / 2))
+            self.assertLessEqual(job.run_at, timezone.now() + timedelta(seconds=delay))
+            self.assertIsNone(queue.claim("worker", ["tests.explode"]))
+            self.make_due(job)
+
+        self.assertFalse(queue.run(queue.claim("worker", ["tests.explode"])))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.FAILED, 3))
+        self.assertIsNotNone(job.finished_at)
+        self.make_due(job)
+        self.assertIsNone(queue.claim("worker", ["tests.explode"]))
+        self.assertEqual(len(self.calls), 3)
+
+    def test_backoff_is_capped(self):
+        job_type = JobType("tests.capped", self.record, retry_delay=10, max_retry_delay=60)
+        self.assertEqual([job_type.backoff(attempt) for attempt in range(1, 6)], [10, 20, 40, 60, 60])
+
+
+class LeaseTests(QueueTestMixin, TransactionTestCase):
+    job_types = {
+        "tests.record": ("record", {"lease": 60, "max_attempts": 2}),
+        "tests.limited": ("record", {"concurrency": 1}),
+    }
+
+    def expire(self, job):
+        Job.objects.filter(pk=job.pk).update(leased_until=timezone.now() - timedelta(seconds=1))
+
+    def test_expired_lease_is_taken_over(self):
+        queue.enqueue("tests.record")
+        first = queue.claim("first", ["tests.record"])
+        self.assertIsNone(queue.claim("second", ["tests.record"]))
+
+        self.expire(first)
+        second = queue.claim("second", ["tests.record"])
+        self.assertEqual((second.pk, second.attempts, second.leased_by), (first.pk, 2, "second"))
+        # The worker that lost its lease does not record an outcome
+        queue.run(first)
+        self.assertEqual(Job.objects.get(pk=first.pk).status, Job.Status.RUNNING)
+        self.assertTrue(queue.run(second))
+        self.assertEqual(Job.objects.get(pk=first.pk).status, Job.Status.SUCCEEDED)
+
+    def test_lease_expired_on_the_last_attempt_is_reaped(self):
+        job = queue.enqueue("tests.record")
+        for _ in range(2):
+            self.expire(queue.claim("worker", ["tests.record"]))
+        self.assertIsNone(queue.claim("worker", ["tests.record"]))
+        self.assertEqual(queue.reap(), 1)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.Status.FAILED)
+
+    def test_renewed_lease_is_kept(self):
+        queue.enqueue("tests.record")
+        job = queue.claim("worker", ["tests.record"])
+        self.expire(job)
+        self.assertEqual(queue.renew("worker", [job.pk], 60), 1)
+        self.assertIsNone(queue.claim("other", ["tests.record"]))
+
+    def test_concurrency_limit(self):
+        queue.enqueue_many("tests.limited", [{"index": 0}, {"index": 1}])
+        running = queue.claim("worker", ["tests.limited"])
+        self.assertIsNone(queue.claim("worker", ["tests.limited"]))
+        queue.run(running)
+        self.assertIsNotNone(queue.claim("worker", ["tests.limited"]))
+
+        queue.enqueue("tests.limited")
+        with override_settings(JOBS_CONCURRENCY={"tests.limited": 2}):
+            self.assertIsNotNone(queue.claim("worker", ["tests.limited"]))
+
+
+class WorkerTests(QueueTestMixin, TransactionTestCase):
+    job_types = {"tests.record": ("record", {}), "tests.explode": ("explode", {"max_attempts": 1})}
+
+    def test_runs_due_jobs(self):
+        queue.enqueue_many("tests.record", [{"index": index} for index in range(6)])
+        queue.enqueue("tests.record", {"index": "later"}, delay=3600)
+        queue.enqueue("tests.explode")
+
+        worker = Worker(names=["tests.record", "tests.explode"], poll_interval=0.05, log=lambda message: None)
+        self.assertEqual(worker.run(once=True), 7)
+        self.assertEqual(worker.failed, 1)
+        self.assertEqual(sorted(call["index"] for call in self.calls if "index" in call), list(range(6)))
+
+        totals = queue.stats()["totals"]
+        self.assertEqual((totals["succeeded"], totals["failed"], totals["queued"]), (6, 1, 1))
+        Job.objects.filter(status=Job.Status.SUCCEEDED).update(finished_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(queue.prune(24 * 3600), 6)
+        self.assertEqual(Job.objects.filter(status=Job.Status.FAILED).count(), 1)
@@ -0,0 +1,31 @@
+from common.filters import BasePageNumberPagination
+from common.response import SuccessResponse
+from django_filters.rest_framework import DjangoFilterBackend
+from jobs import queue
+from jobs.models import Job
+from jobs.serializers import JobSerializer
+from rest_framework import viewsets
+from rest_framework.decorators import action
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Introspection of the background job queue"""
+
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ["name", "status"]
+    pagination_class = BasePageNumberPagination
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        data = self.get_serializer(page, many=True).data
+        return SuccessResponse(self.get_paginated_response(data)).send()
+
+    def retrieve(self, request, *args, **kwargs):
+        return SuccessResponse(self.get_serializer(self.get_object()).data).send()
+
+    @action(detail=False, methods=["get"])
+    def stats(self, request, *args, **kwargs):
+        return SuccessResponse(queue.stats()).send()
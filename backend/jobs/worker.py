@@ -0,0 +1,94 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.db import close_old_connections
+from jobs import queue
+from jobs.registry import registry
+
+
+def _run(job):
+    # Pool threads outlive jobs, so they clean up database connections the
+    # way the request cycle does
+    close_old_connections()
+    try:
+        return queue.run(job)
+    finally:
+        close_old_connections()
+
+
+class Worker:
+    """
+    Claims due jobs and runs them on ``concurrency`` threads. Leases of
+    running jobs are renewed while they run, so only a worker that stopped
+    (crashed, killed) lets its jobs be picked up by another one.
+    """
+
+    def __init__(self, names=None, concurrency=4, poll_interval=1.0, retention=None, log=print):
+        self.names = [name for name in (names or registry) if name in registry]
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.log = log
+        self.id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.stopping = threading.Event()
+        self.processed = self.failed = 0
+
+    def stop(self):
+        """Stop claiming jobs, the ones running are finished first"""
+        self.stopping.set()
+
+    def housekeeping(self, running):
+        renewals = {}
+        for job in running.values():
+            renewals.setdefault(registry[job.name].lease, []).append(job.pk)
+        for lease, pks in renewals.items():
+            queue.renew(self.id, pks, lease)
+        if reaped := queue.reap():
+            self.log(f"Failed {reaped} jobs whose lease expired on their last attempt")
+        if self.retention is not None:
+            queue.prune(self.retention)
+
+    def collect(self, done, running):
+        for future in done:
+            job = running.pop(future)
+            self.processed += 1
+            if not future.result():
+                self.failed += 1
+                self.log(f"Job {job.name} {job.pk} failed (attempt {job.attempts} of {job.max_attempts})")
+
+    def run(self, once=False):
+        """
+        Process jobs until stopped, or with ``once`` until none is due.
+        Returns the number of jobs processed.
+        """
+        if not self.names:
+            return 0
+        # Renewed well before the shortest lease runs out
+        renew_every = min(registry[name].lease for name in self.names) / 3
+        last_housekeeping = 0
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="jobs") as executor:
+            while not self.stopping.is_set():
+                if time.monotonic() - last_housekeeping >= renew_every:
+                    self.housekeeping(running)
+                    last_housekeeping = time.monotonic()
+
+                while len(running) < self.concurrency and (job := queue.claim(self.id, self.names)):
+                    running[executor.submit(_run, job)] = job
+
+                if not running:
+                    if once:
+                        break
+                    self.stopping.wait(self.poll_interval)
+                    continue
+                # Wake up for a finished job, or to look for new ones
+                done, _ = wait(running, timeout=min(self.poll_interval, renew_every), return_when=FIRST_COMPLETED)
+                self.collect(done, running)
+
+            done, _ = wait(running)
+            self.collect(done, running)
+        return self.processed
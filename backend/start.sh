@@ -11,4 +11,6 @@ python manage.py migrate
 
 # Start server
 echo "Starting server..."
-gunicorn --bind 0.0.0.0:8000 core.wsgi:application 
\ No newline at end of file
+# ASGI, so slow uploads and downloads wait on the event loop instead of
+# holding a worker each
+gunicorn --bind 0.0.0.0:8000 --worker-class uvicorn.workers.UvicornWorker core.asgi:application 
\ No newline at end of file
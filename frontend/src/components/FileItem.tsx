@@ -3,6 +3,7 @@ import {
     DocumentIcon,
     TrashIcon
 } from '@heroicons/react/24/outline';
+import { fileService } from '../services/fileService';
 import { Entry } from '../types/file';
 import { formatFileSize } from '../utils';
 
@@ -31,7 +32,7 @@ export default function EntryItem({
                         {item.name}
                     </p>
                     <p className="text-sm text-gray-500">
-                        {item.file.file_type.toUpperCase()} • {formatFileSize(item.file.size)}
+                        {(item.file.mime_type || item.file.file_type).toUpperCase()} • {formatFileSize(item.file.size)}
                     </p>
                     <p className="text-sm text-gray-500">
                         Uploaded {new Date(item.created_at).toLocaleString()}
@@ -39,7 +40,7 @@ export default function EntryItem({
                 </div>
                 <div className="flex space-x-2">
                     <button
-                        onClick={() => handleDownload(item.file.file, item.file.original_filename)}
+                        onClick={() => handleDownload(fileService.getDownloadUrl(item.id), item.name || item.file.original_filename)}
                         disabled={downloading}
                         className="inline-flex items-center px-3 py-2 border border-transparent shadow-sm text-sm leading-4 font-medium rounded-md text-white bg-primary-600 hover:bg-primary-700 focus:outline-none focus:ring-2 focus:ring-offset-2 focus:ring-primary-500 disabled:opacity-50"
                     >
@@ -22,6 +22,7 @@ export const FileList: React.FC = () => {
   const [filters, setFilters] = useState<FileFilters>({
     search: '',
     file_type: '',
+    category: '',
     min_size: '',
     max_size: '',
     uploaded_after: '',
@@ -40,12 +41,31 @@ export const FileList: React.FC = () => {
     placeholderData: (previousData) => previousData,
   });
 
+  // Type and category options with their counts under the other filters, so
+  // picking a type does not hide the alternatives
+  const facetFilters = {
+    search: debouncedFilters.search,
+    min_size: debouncedFilters.min_size,
+    max_size: debouncedFilters.max_size,
+    uploaded_after: debouncedFilters.uploaded_after,
+    uploaded_before: debouncedFilters.uploaded_before,
+  };
+  const { data: facets } = useQuery({
+    queryKey: ['facets', facetFilters],
+    queryFn: () => fileService.getFacets(facetFilters),
+    placeholderData: (previousData) => previousData,
+  });
+  const typeFacets = (facets?.categories ?? [])
+    .filter((facet) => !filters.category || facet.category === filters.category)
+    .flatMap((facet) => facet.types);
+
   // Mutation for deleting files
   const deleteMutation = useMutation({
     mutationFn: fileService.deleteFile,
     onSuccess: () => {
       queryClient.invalidateQueries({ queryKey: ['files'] });
       queryClient.invalidateQueries({ queryKey: ['stats'] });
+      queryClient.invalidateQueries({ queryKey: ['facets'] });
     },
     onError: (error) => {
       const message = getAxiosError(error, "Failed to delete file. Please try again.")
@@ -72,6 +92,7 @@ export const FileList: React.FC = () => {
     setFilters({
       search: '',
       file_type: '',
+      category: '',
       min_size: '',
       max_size: '',
       uploaded_after: '',
@@ -173,6 +194,25 @@ export const FileList: React.FC = () => {
             </div>
 
             <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-4">
+              {/* Category */}
+              <div>
+                <label className="block text-sm font-medium text-gray-700 mb-1">
+                  Category
+                </label>
+                <select
+                  value={filters.category}
+                  onChange={(e) => handleFilterChange('category', e.target.value)}
+                  className="block w-full px-3 py-2 border border-gray-300 rounded-md shadow-sm focus:outline-none focus:ring-primary-500 focus:border-primary-500"
+                >
+                  <option value="">All categories</option>
+                  {facets?.categories.map((facet) => (
+                    <option key={facet.category} value={facet.category}>
+                      {facet.category.charAt(0).toUpperCase() + facet.category.slice(1)} ({facet.entries})
+                    </option>
+                  ))}
+                </select>
+              </div>
+
               {/* File Type */}
               <div>
                 <label className="block text-sm font-medium text-gray-700 mb-1">
@@ -184,16 +224,11 @@ export const FileList: React.FC = () => {
                   className="block w-full px-3 py-2 border border-gray-300 rounded-md shadow-sm focus:outline-none focus:ring-primary-500 focus:border-primary-500"
                 >
                   <option value="">All types</option>
-                  <option value="pdf">PDF</option>
-                  <option value="jpg">JPG</option>
-                  <option value="jpeg">JPEG</option>
-                  <option value="png">PNG</option>
-                  <option value="gif">GIF</option>
-                  <option value="doc">DOC</option>
-                  <option value="docx">DOCX</option>
-                  <option value="txt">TXT</option>
-                  <option value="mp4">MP4</option>
-                  <option value="avi">AVI</option>
+                  {typeFacets.map((facet) => (
+                    <option key={facet.mime_type} value={facet.mime_type}>
+                      {facet.mime_type} ({facet.entries})
+                    </option>
+                  ))}
                 </select>
               </div>
 
@@ -16,6 +16,7 @@ export const FileUpload: React.FC = () => {
       // Invalidate and refetch files query
       queryClient.invalidateQueries({ queryKey: ['files'] });
       queryClient.invalidateQueries({ queryKey: ['stats'] });
+      queryClient.invalidateQueries({ queryKey: ['facets'] });
       setSelectedFile(null);
       setCustomName("")
       // onUploadSuccess();
@@ -1,11 +1,58 @@
 import axios from 'axios';
-import { Entry, FileStorageStats } from '../types/file';
+import { Entry, FileFacets, FileProbeItem, FileProbeResult, FileStorageStats } from '../types/file';
 import { PaginatedData } from '../types';
 
 const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:8000/api';
 
+// Above this size the file is hashed in slices on a worker, never read into memory whole
+const SUBTLE_HASH_MAX_SIZE = 16 * 1024 * 1024;
+
+function hashInWorker(file: File): Promise<string | null> {
+  return new Promise((resolve) => {
+    const worker = new Worker(new URL('./hashWorker.ts', import.meta.url));
+    const finish = (digest: string | null) => {
+      worker.terminate();
+      resolve(digest);
+    };
+    worker.onmessage = ({ data }: MessageEvent<string | null>) => finish(data);
+    worker.onerror = () => finish(null);
+    worker.postMessage(file);
+  });
+}
+
+async function hashFile(file: File): Promise<string | null> {
+  if (file.size > SUBTLE_HASH_MAX_SIZE) {
+    // Without workers the probe is skipped, the upload goes ahead either way
+    return typeof Worker === 'undefined' ? null : hashInWorker(file);
+  }
+  // SubtleCrypto is only available in secure contexts (https or localhost)
+  if (!window.crypto?.subtle) {
+    return null;
+  }
+  const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+  return Array.from(new Uint8Array(digest))
+    .map((byte) => byte.toString(16).padStart(2, '0'))
+    .join('');
+}
+
 export const fileService = {
+  async probeFiles(files: FileProbeItem[]): Promise<FileProbeResult> {
+    const response = await axios.post(`${API_URL}/files/probe`, { files });
+    return response.data.data;
+  },
+
   async uploadFile({ customName, selectedFile }: { customName: string, selectedFile: File }): Promise<Entry> {
+    // Ask the server first, content it already stores never has to be sent again
+    const sha256 = await hashFile(selectedFile);
+    if (sha256) {
+      const probe = await fileService.probeFiles([
+        { sha256, size: selectedFile.size, name: customName || selectedFile.name },
+      ]);
+      if (!probe.missing.includes(sha256) && probe.entries.length) {
+        return probe.entries[0];
+      }
+    }
+
     const formData = new FormData();
     formData.append('file', selectedFile);
     formData.append('name', customName);
@@ -18,7 +65,7 @@ export const fileService = {
     return response.data;
   },
 
-  async getFiles(filters: any = {}): Promise<PaginatedData<Entry>> {
+  buildParams(filters: any = {}): URLSearchParams {
     const params = new URLSearchParams();
 
     Object.entries(filters).forEach(([key, value]) => {
@@ -34,12 +81,21 @@ export const fileService = {
         }
       }
     });
+    return params;
+  },
 
-    // Don't forget to actually use the params!
+  async getFiles(filters: any = {}): Promise<PaginatedData<Entry>> {
+    const params = fileService.buildParams(filters);
     const response = await axios.get(`${API_URL}/files/?${params.toString()}`);
     return response.data.data;
   },
 
+  async getFacets(filters: any = {}): Promise<FileFacets> {
+    const params = fileService.buildParams(filters);
+    const response = await axios.get(`${API_URL}/files/facets/?${params.toString()}`);
+    return response.data.data;
+  },
+
 
   async getStats(): Promise<FileStorageStats> {
     const response = await axios.get(`${API_URL}/files/savings`);
@@ -50,6 +106,10 @@ export const fileService = {
     await axios.delete(`${API_URL}/files/${id}/`);
   },
 
+  getDownloadUrl(id: string): string {
+    return `${API_URL}/files/${id}/download/`;
+  },
+
   async downloadFile(fileUrl: string, filename: string): Promise<void> {
     try {
       const response = await axios.get(fileUrl, {
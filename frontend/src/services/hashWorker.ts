@@ -0,0 +1,18 @@
+import { Sha256 } from './sha256';
+
+// Hashes a File a slice at a time, off the main thread
+const SLICE_SIZE = 4 * 1024 * 1024;
+
+const worker = self as unknown as Worker;
+
+worker.onmessage = async ({ data: file }: MessageEvent<File>) => {
+  try {
+    const hasher = new Sha256();
+    for (let start = 0; start < file.size; start += SLICE_SIZE) {
+      hasher.update(new Uint8Array(await file.slice(start, start + SLICE_SIZE).arrayBuffer()));
+    }
+    worker.postMessage(hasher.digest());
+  } catch {
+    worker.postMessage(null);
+  }
+};
@@ -0,0 +1,47 @@
+import { describe, expect, it } from '@jest/globals';
+import { Sha256 } from './sha256';
+
+const encode = (text: string) => new TextEncoder().encode(text);
+
+function hashSlices(data: Uint8Array, sliceSize: number): string {
+  const hasher = new Sha256();
+  for (let start = 0; start < data.length; start += sliceSize) {
+    hasher.update(data.subarray(start, start + sliceSize));
+  }
+  return hasher.digest();
+}
+
+describe('Sha256', () => {
+  it('matches the FIPS 180-2 test vectors', () => {
+    expect(new Sha256().digest()).toBe('e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855');
+    expect(new Sha256().update(encode('abc')).digest()).toBe(
+      'ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad',
+    );
+    expect(new Sha256().update(encode('abcdbcdecdefdefgefghfghighijhijkijkljklmklmnlmnomnopnopq')).digest()).toBe(
+      '248d6a61d20638b8e5c026930c3e6039a33ce45964ff2167f6ecedd419db06c1',
+    );
+    expect(hashSlices(encode('a'.repeat(1000000)), 4096)).toBe(
+      'cdc76e5c9914fb9281a1c7e284d73e67f1809a48a497200e046d39ccc7112cd0',
+    );
+  });
+
+  it('hashes a file in slices like the backend hash_file', () => {
+    // The digest was taken with files.hashing.hash_file
+    const data = new Uint8Array(9 * 1024 * 1024 + 77);
+    for (let i = 0; i < data.length; i++) {
+      data[i] = (i * 31 + 7) % 251;
+    }
+    // hashWorker's 4MB slices, and sizes that split the 64 byte blocks
+    for (const sliceSize of [4 * 1024 * 1024, 1000, 63]) {
+      expect(hashSlices(data, sliceSize)).toBe('88308d6a1d536761c63bc8dfd875df90553bf5f8a3e4c23c93abf3317199b9eb');
+    }
+  });
+
+  it('does not depend on where the slices end', () => {
+    const data = encode('The quick brown fox jumps over the lazy dog'.repeat(10));
+    const whole = new Sha256().update(data).digest();
+    for (const sliceSize of [1, 55, 56, 64, 65]) {
+      expect(hashSlices(data, sliceSize)).toBe(whole);
+    }
+  });
+});
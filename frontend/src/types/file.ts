@@ -2,6 +2,8 @@ export interface DBFile {
   id: string;
   original_filename: string;
   file_type: string;
+  mime_type: string;
+  category: string;
   size: number;
   created_at: string;
   file: string;
@@ -26,6 +28,7 @@ export interface PaginationFilters {
 export interface FileFilters extends PaginationFilters {
   search: string;
   file_type: string;
+  category: string;
   min_size: string;
   max_size: string;
   uploaded_after: string;
@@ -40,4 +43,41 @@ export interface FileStorageStats {
   deduplication_ratio: string;
   total_files: number;
   total_entries: number;
-}
\ No newline at end of file
+  chunk_stored_space: string;
+  chunk_space_saved: string;
+  chunk_savings_percentage: string;
+  total_chunks: number;
+  stored_space: string;
+  compression_space_saved: string;
+  compression_savings_percentage: string;
+}
+
+export interface FileProbeItem {
+  sha256: string;
+  size: number;
+  name?: string;
+}
+
+export interface FileProbeResult {
+  entries: Entry[];
+  missing: string[];
+}
+
+export interface FileTypeFacet {
+  mime_type: string;
+  entries: number;
+  bytes: number;
+}
+
+export interface FileCategoryFacet {
+  category: string;
+  entries: number;
+  bytes: number;
+  types: FileTypeFacet[];
+}
+
+export interface FileFacets {
+  entries: number;
+  bytes: number;
+  categories: FileCategoryFacet[];
+}
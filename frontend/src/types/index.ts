@@ -8,6 +8,15 @@ export interface PaginatedData<T = any> {
     has_previous: boolean;
 }
 
+// Envelope of ?pagination=cursor, totals are null when skipped (?count=none)
+export interface CursorPaginatedData<T = any> extends Omit<PaginatedData<T>, 'page' | 'total' | 'total_pages'> {
+    page: null;
+    total: number | null;
+    total_pages: number | null;
+    next_cursor: string | null;
+    previous_cursor: string | null;
+}
+
 export interface APIResponse<T = any> {
     code: number;
     message: string;